@@ -0,0 +1,167 @@
+"""Память процесса при параллельной загрузке больших картинок.
+
+Запускает N потоков, каждый отправляет в post_create картинку размером
+около --megabytes мегабайт, и печатает JSON с пиковым RSS и пиком
+аллокаций Python (tracemalloc) для потоковых обработчиков загрузки
+(posts.uploads) и для стандартных обработчиков Django. Каждый режим
+запускается в отдельном процессе, потому что пиковый RSS не убывает.
+
+Тело запроса готовится заранее и читается из файла на диске, поэтому
+сам бенчмарк не держит в памяти N копий картинки. База - временный
+файл SQLite.
+
+    python benchmarks/upload_memory.py --uploads 20 --megabytes 10
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'yatube'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+MODES = ('streaming', 'default')
+
+
+def make_jpeg(megabytes):
+    """JPEG из шума: шум почти не сжимается, размер близок к заданному."""
+    from PIL import Image
+    side = int((megabytes * 1024 * 1024 / 1.2) ** 0.5)
+    image = Image.frombytes('RGB', (side, side), os.urandom(side * side * 3))
+    content = BytesIO()
+    image.save(content, format='JPEG', quality=95)
+    return content.getvalue()
+
+
+def write_body(path, image):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test.client import (BOUNDARY, MULTIPART_CONTENT,
+                                    encode_multipart)
+    body = encode_multipart(BOUNDARY, {
+        'text': 'Бенчмарк загрузки',
+        'image': SimpleUploadedFile('noise.jpg', image, 'image/jpeg'),
+    })
+    with open(path, 'wb') as body_file:
+        body_file.write(body)
+    return MULTIPART_CONTENT, len(body)
+
+
+def run(mode, uploads, body_path, content_type, workdir):
+    import django
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = os.path.join(workdir, 'db.sqlite3')
+    settings.DATABASES['default']['OPTIONS'] = {'timeout': 60}
+    settings.MEDIA_ROOT = os.path.join(workdir, 'media')
+    settings.POST_IMAGE_STREAMING_UPLOADS = mode == 'streaming'
+    django.setup()
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.test import Client
+    from django.test.client import ClientHandler
+    from django.urls import reverse
+
+    from posts import thumbnails
+
+    # Меряется только загрузка: уменьшение оригинала и миниатюры - дело
+    # отдельного пула процессов (posts.thumbnails).
+    thumbnails.schedule = lambda image: None
+    call_command('migrate', verbosity=0)
+    user = get_user_model().objects.create_user(username='benchmark')
+    client = Client()
+    client.force_login(user)
+    cookie = f'{settings.SESSION_COOKIE_NAME}=' + client.cookies[
+        settings.SESSION_COOKIE_NAME
+    ].value
+    length = os.path.getsize(body_path)
+    handler = ClientHandler(enforce_csrf_checks=False)
+    statuses = []
+
+    def upload():
+        with open(body_path, 'rb') as body:
+            response = handler({
+                'REQUEST_METHOD': 'POST',
+                'PATH_INFO': reverse('posts:post_create'),
+                'CONTENT_TYPE': content_type,
+                'CONTENT_LENGTH': str(length),
+                'HTTP_COOKIE': cookie,
+                'SERVER_NAME': 'testserver',
+                'SERVER_PORT': '80',
+                'wsgi.input': body,
+                'wsgi.url_scheme': 'http',
+            })
+        statuses.append(response.status_code)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=upload) for _ in range(uploads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'mode': mode,
+        'uploads': uploads,
+        'body_bytes': length,
+        'seconds': round(elapsed, 2),
+        'statuses': sorted(set(statuses)),
+        'peak_rss_growth_mb': round((rss_after - rss_before) / 1024, 1),
+        'python_alloc_peak_mb': round(traced_peak / 1024 / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--uploads', type=int, default=20)
+    parser.add_argument('--megabytes', type=float, default=10)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--body', help=argparse.SUPPRESS)
+    parser.add_argument('--content-type', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        workdir = tempfile.mkdtemp(prefix='yatube-upload-bench-')
+        try:
+            result = run(
+                args.mode, args.uploads, args.body, args.content_type,
+                workdir,
+            )
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        print(json.dumps(result))
+        return
+    workdir = tempfile.mkdtemp(prefix='yatube-upload-body-')
+    try:
+        body_path = os.path.join(workdir, 'body')
+        content_type, _ = write_body(body_path, make_jpeg(args.megabytes))
+        results = []
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, __file__, '--mode', mode,
+                 '--uploads', str(args.uploads), '--body', body_path,
+                 '--content-type', content_type],
+                check=True, stdout=subprocess.PIPE,
+                universal_newlines=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+"""Задержка, число SQL-запросов и размер ответа для каждого маршрута posts.
+
+Поднимает проект на наборе данных из generate_load_data (временный файл
+SQLite или --database, который создаётся при первом запуске и потом
+переиспользуется), прогоняет по --requests запросов на сценарий -
+анонимно и с входом, первая и глубокая (--depth строк) страница - и
+печатает JSON с p50/p95/p99 в миллисекундах, числом запросов к базе и
+байтами ответа.
+
+Перед каждым запросом кеш очищается целиком: страницы, карточки постов,
+версии и набор подтягиваемых авторов - меряется рендеринг с холодным
+кешем, а не попадания. С --warm-cache кеш не трогается, и прогоны после
+разогрева показывают ответы из кеша.
+Запросы, меняющие данные, выполняются в транзакции, которая
+откатывается, поэтому набор данных между прогонами не меняется.
+
+С --baseline результаты сравниваются с сохранённым --output прошлого
+прогона: рост p95 больше чем на --tolerance (и на MIN_DELTA_MS), лишние
+запросы к базе или рост размера ответа считаются регрессией, и скрипт
+завершается с кодом 1.
+
+    python benchmarks/views.py --posts 100000 --output base.json
+    python benchmarks/views.py --posts 100000 --baseline base.json
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'yatube'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+PERCENTILES = (50, 95, 99)
+# Меньшие изменения задержки - шум, а не регрессия.
+MIN_DELTA_MS = 1.0
+DATASET = ('users', 'groups', 'posts', 'follows', 'comments')
+
+
+def percentile(samples, rank):
+    """Перцентиль по ближайшему рангу из отсортированных samples."""
+    index = max(0, math.ceil(rank / 100 * len(samples)) - 1)
+    return samples[index]
+
+
+class QueryCounter:
+    """execute_wrapper, считающий запросы без отладочного курсора."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def setup(args, workdir):
+    import django
+    from django.conf import settings
+
+    database = args.database or os.path.join(workdir, 'db.sqlite3')
+    fresh = not os.path.exists(database)
+    settings.DEBUG = False
+    # Процесс один, поэтому кеши по версиям работают и с LocMemCache.
+    settings.CACHE_SINGLE_PROCESS = True
+    settings.DATABASES['default']['NAME'] = database
+    settings.MEDIA_ROOT = os.path.join(workdir, 'media')
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+    if fresh:
+        call_command(
+            'generate_load_data', seed=args.seed, skip_timelines=True,
+            stdout=sys.stderr,
+            **{entity: getattr(args, entity) for entity in DATASET}
+        )
+
+
+def cursor_at(make_paginator, pages):
+    """Курсор after страницы номер pages + 1 (или последней)."""
+    cursor = None
+    for _ in range(pages):
+        paginator = make_paginator(cursor)
+        paginator.get_page()
+        if paginator.next_cursor is None:
+            break
+        cursor = paginator.next_cursor
+    return cursor
+
+
+def scenarios(args):
+    """Сценарии: (имя, клиент, метод, путь, данные, меняет ли данные)."""
+    from django.contrib.auth import get_user_model
+    from django.db.models import Count, Max
+    from django.urls import reverse
+    from django.utils.http import urlencode
+
+    from posts import timeline
+    from posts.models import Comment, Follow, Group, Post
+    from posts.paginators import KeysetPaginator
+    from posts.search import SearchPaginator, find
+    from posts.settings import COMMENTS_PER_PAGE, LIST_LENGHT
+
+    User = get_user_model()
+    pages = max(1, args.depth // LIST_LENGHT)
+
+    def deep(queryset, per_page=LIST_LENGHT, paginator=KeysetPaginator,
+             **kwargs):
+        cursor = cursor_at(
+            lambda after: paginator(queryset, per_page, after=after,
+                                    **kwargs),
+            max(1, args.depth // per_page),
+        )
+        return '?' + urlencode({'after': cursor or ''})
+
+    reader = User.objects.annotate(
+        follows=Count('follower')
+    ).order_by('-follows', 'pk').first()
+    reader.is_staff = True
+    reader.save(update_fields=['is_staff'])
+    timeline.rebuild(reader.pk)
+    author = User.objects.annotate(
+        total=Count('posts')
+    ).order_by('-total', 'pk').first()
+    group = Group.objects.order_by('-posts_count', 'pk').first()
+    post = Post.objects.order_by('-comments_count', 'pk').first()
+    own_post = reader.posts.first() or post
+    word = Post.objects.order_by('-pk').first().text.split()[0]
+    last_post = Post.objects.aggregate(last=Max('pk'))['last']
+    last_comment = Comment.objects.aggregate(last=Max('pk'))['last'] or 0
+    unfollowed = User.objects.exclude(pk=reader.pk).exclude(
+        pk__in=Follow.objects.filter(user=reader).values('author_id')
+    ).first()
+
+    index = reverse('posts:index')
+    group_url = reverse('posts:group_list', args=[group.slug])
+    profile_url = reverse('posts:profile', args=[author.username])
+    post_url = reverse('posts:post_detail', args=[post.pk])
+    search_url = reverse('posts:search') + '?' + urlencode({'q': word})
+    follow_url = reverse('posts:follow_index')
+    posts = Post.objects.select_related('author', 'group')
+    found = find(word, posts)
+    feed = Post.objects.filter(author__following__user=reader)
+    deep_search = cursor_at(
+        lambda after: SearchPaginator(found, LIST_LENGHT, after=after),
+        pages,
+    )
+    result = []
+    for client in ('anon', 'user'):
+        result += [
+            ('index:first', client, 'get', index, None, False),
+            ('index:deep', client, 'get', index + deep(posts),
+             None, False),
+            ('group_list:first', client, 'get', group_url, None, False),
+            ('group_list:deep', client, 'get',
+             group_url + deep(group.posts.all()), None, False),
+            ('profile:first', client, 'get', profile_url, None, False),
+            ('profile:deep', client, 'get',
+             profile_url + deep(author.posts.all()), None, False),
+            ('post_detail:first', client, 'get', post_url, None, False),
+            ('post_detail:deep', client, 'get',
+             post_url + deep(post.comments.all(), COMMENTS_PER_PAGE,
+                             keys=('created', 'pk')), None, False),
+            ('search:first', client, 'get', search_url, None, False),
+            ('search:deep', client, 'get', search_url + '&' + urlencode(
+                {'after': deep_search or ''}
+            ), None, False),
+        ]
+    result += [
+        ('follow_index:first', 'user', 'get', follow_url, None, False),
+        ('follow_index:deep', 'user', 'get', follow_url + deep(
+            feed, paginator=timeline.FeedPaginator, user=reader
+        ), None, False),
+        ('post_create:form', 'user', 'get', reverse('posts:post_create'),
+         None, False),
+        ('post_create:submit', 'user', 'post',
+         reverse('posts:post_create'), {'text': 'Бенчмарк'}, True),
+        ('post_edit:form', 'user', 'get',
+         reverse('posts:post_edit', args=[own_post.pk]), None, False),
+        ('add_comment', 'user', 'post',
+         reverse('posts:add_comment', args=[post.pk]),
+         {'text': 'Бенчмарк'}, True),
+        ('export:posts', 'user', 'get',
+         reverse('posts:export', args=['posts']) + '?' + urlencode(
+             {'after_id': max(0, last_post - args.depth)}
+         ), None, False),
+        ('export:comments', 'user', 'get',
+         reverse('posts:export', args=['comments']) + '?' + urlencode(
+             {'after_id': max(0, last_comment - args.depth)}
+         ), None, False),
+    ]
+    if unfollowed is not None:
+        result += [
+            ('profile_follow', 'user', 'get', reverse(
+                'posts:profile_follow', args=[unfollowed.username]
+            ), None, True),
+        ]
+    followed = Follow.objects.filter(user=reader).first()
+    if followed is not None:
+        result += [
+            ('profile_unfollow', 'user', 'get', reverse(
+                'posts:profile_unfollow', args=[followed.author.username]
+            ), None, True),
+        ]
+    return reader, result
+
+
+def measure(client, method, path, data, mutating, counter):
+    from django.db import transaction
+
+    counter.count = 0
+    started = time.perf_counter()
+    if mutating:
+        with transaction.atomic():
+            response = getattr(client, method)(path, data)
+            transaction.set_rollback(True)
+    else:
+        response = getattr(client, method)(path, data)
+    if response.streaming:
+        size = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        size = len(response.content)
+    elapsed = time.perf_counter() - started
+    return elapsed * 1000, counter.count, size, response.status_code
+
+
+def run(args):
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import Client
+
+    from posts.models import Comment, Follow, Group, Post, User
+
+    reader, cases = scenarios(args)
+    clients = {'anon': Client(), 'user': Client()}
+    clients['user'].force_login(reader)
+    counter = QueryCounter()
+    results = {}
+    with connection.execute_wrapper(counter):
+        for name, kind, method, path, data, mutating in cases:
+            if args.only and not any(part in name for part in args.only):
+                continue
+            samples = []
+            for number in range(args.warmup + args.requests):
+                if not args.warm_cache:
+                    cache.clear()
+                sample = measure(
+                    clients[kind], method, path, data, mutating, counter
+                )
+                if number >= args.warmup:
+                    samples.append(sample)
+            latencies = sorted(sample[0] for sample in samples)
+            result = {
+                f'p{rank}_ms': round(percentile(latencies, rank), 2)
+                for rank in PERCENTILES
+            }
+            result.update(
+                queries=max(sample[1] for sample in samples),
+                bytes=max(sample[2] for sample in samples),
+                status=samples[-1][3],
+                path=path,
+            )
+            results[f'{name}:{kind}'] = result
+            print(f'{name}:{kind}: p50 {result["p50_ms"]} мс, '
+                  f'{result["queries"]} запросов', file=sys.stderr)
+    dataset = {
+        model.__name__.lower(): model.objects.count()
+        for model in (User, Group, Post, Follow, Comment)
+    }
+    return {'dataset': dataset, 'requests': args.requests,
+            'results': results}
+
+
+def compare(current, baseline, tolerance):
+    """Список регрессий current относительно baseline."""
+    regressions = []
+    for name, old in baseline['results'].items():
+        new = current['results'].get(name)
+        if new is None:
+            continue
+        if (new['p95_ms'] > old['p95_ms'] * (1 + tolerance)
+                and new['p95_ms'] - old['p95_ms'] > MIN_DELTA_MS):
+            regressions.append(
+                f'{name}: p95 {old["p95_ms"]} -> {new["p95_ms"]} мс'
+            )
+        if new['queries'] > old['queries']:
+            regressions.append(
+                f'{name}: запросов {old["queries"]} -> {new["queries"]}'
+            )
+        if new['bytes'] > old['bytes'] * (1 + tolerance):
+            regressions.append(
+                f'{name}: байт {old["bytes"]} -> {new["bytes"]}'
+            )
+    if current['dataset'] != baseline['dataset']:
+        regressions.insert(0, 'внимание: наборы данных различаются')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=50000)
+    parser.add_argument('--follows', type=int, default=20000)
+    parser.add_argument('--comments', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--database', help='Файл SQLite с данными; создаётся, если его нет',
+    )
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument(
+        '--depth', type=int, default=1000,
+        help='Сколько строк пропустить для глубокой страницы',
+    )
+    parser.add_argument(
+        '--only', action='append', default=[],
+        help='Только сценарии, в имени которых есть эта строка',
+    )
+    parser.add_argument(
+        '--warm-cache', action='store_true',
+        help='Не очищать кеш перед запросами',
+    )
+    parser.add_argument('--output', help='Куда сохранить JSON результатов')
+    parser.add_argument('--baseline', help='JSON прошлого прогона')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='yatube-views-bench-')
+    try:
+        setup(args, workdir)
+        report = run(args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + '\n')
+    print(output)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            print(line, file=sys.stderr)
+        if any(not line.startswith('внимание') for line in regressions):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
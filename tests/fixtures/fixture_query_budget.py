@@ -0,0 +1,11 @@
+import pytest
+from core.testing import QueryBudget
+
+
+@pytest.fixture
+def query_budget(db):
+    """with query_budget(3): ... - не больше трёх запросов к базе в блоке.
+
+    Для теста целиком - декоратор @QueryBudget(3) из core.testing.
+    """
+    return QueryBudget
@@ -0,0 +1,27 @@
+import pytest
+from django.core.cache import cache
+
+from core.testing import QueryBudget
+
+
+class TestQueryBudget:
+
+    @pytest.mark.parametrize('url', ['/', '/group/test-link/', '/profile/TestUser/'])
+    def test_feed_pages_do_not_query_per_post(self, client, query_budget, few_posts_with_group, url):
+        cache.clear()
+        with query_budget(2):
+            response = client.get(url)
+        assert response.status_code == 200
+
+    def test_budget_overrun_reports_duplicates(self, few_posts_with_group):
+        from posts.models import Post
+        with pytest.raises(AssertionError, match='Повторяющиеся формы запросов'):
+            with QueryBudget(1):
+                for post in Post.objects.all()[:3]:
+                    post.author.username
+
+    @pytest.mark.django_db
+    @QueryBudget(1)
+    def test_budget_as_decorator(self):
+        from posts.models import Post
+        Post.objects.count()
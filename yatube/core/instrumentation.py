@@ -0,0 +1,126 @@
+"""Инструментирование запросов: Server-Timing и метрики по view.
+
+InstrumentationMiddleware меряет время ответа, время и число запросов к
+базе (connection.execute_wrapper), время рендеринга шаблонов (бэкенд
+DjangoTemplates ниже) и попадания в кеши страниц и карточек. Итоги
+запроса уходят в заголовок Server-Timing и в гистограммы core.metrics с
+меткой view, которые отдаёт /metrics.
+"""
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends import django as django_backend
+
+from core import metrics
+
+# Счётчики core.metrics, которые считаются попаданием и промахом кеша.
+CACHE_HITS = ('page_cache_hits', 'post_card_cache_hits')
+CACHE_MISSES = ('page_cache_misses', 'post_card_cache_misses')
+
+_current = ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    """Время и число запросов к базе и время шаблонов одного запроса."""
+
+    def __init__(self):
+        self.db = 0.0
+        self.queries = 0
+        self.template = 0.0
+        self.rendering = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += perf_counter() - started
+            self.queries += 1
+
+
+@contextmanager
+def timed_render():
+    """Копит время рендеринга; вложенный рендер (карточки) не удваивается."""
+    timing = _current.get()
+    if timing is None or timing.rendering:
+        yield
+        return
+    timing.rendering = True
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        timing.template += perf_counter() - started
+        timing.rendering = False
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        with timed_render():
+            return super().render(context, request)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Стандартный бэкенд, который сообщает время рендеринга шаблонов."""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
+
+
+def server_timing(total, timing, hits, misses):
+    return ', '.join((
+        f'total;dur={total * 1000:.1f}',
+        f'db;dur={timing.db * 1000:.1f};desc="{timing.queries} queries"',
+        f'tpl;dur={timing.template * 1000:.1f}',
+        f'cache;desc="hit={hits:g} miss={misses:g}"',
+    ))
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing = RequestTiming()
+        token = _current.set(timing)
+        started = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timing))
+                scope = stack.enter_context(metrics.request_scope())
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = perf_counter() - started
+        hits = sum(scope.get(name, 0) for name in CACHE_HITS)
+        misses = sum(scope.get(name, 0) for name in CACHE_MISSES)
+        if getattr(settings, 'SERVER_TIMING', True):
+            response['Server-Timing'] = server_timing(
+                total, timing, hits, misses
+            )
+        self.record(request, response, total, timing, hits, misses)
+        return response
+
+    def record(self, request, response, total, timing, hits, misses):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        metrics.inc('http_responses', view=view,
+                    status=response.status_code)
+        metrics.histogram('http_request_seconds', total, view=view)
+        metrics.histogram('http_request_db_seconds', timing.db, view=view)
+        metrics.histogram('http_request_queries', timing.queries,
+                          metrics.COUNT_BUCKETS, view=view)
+        metrics.histogram('http_request_template_seconds', timing.template,
+                          view=view)
+        if hits:
+            metrics.inc('http_cache_hits', hits, view=view)
+        if misses:
+            metrics.inc('http_cache_misses', misses, view=view)
+        metrics.flush()
@@ -0,0 +1,175 @@
+"""Отдача загруженных файлов (MEDIA_ROOT) в продакшене.
+
+Если перед Django стоит веб-сервер, настроенный на MEDIA_SENDFILE,
+view только проверяет путь и заголовки кеширования, а сам файл
+отдаёт сервер: заголовок X-Sendfile (Apache, lighttpd) или
+X-Accel-Redirect (nginx). Иначе файл отдаётся через FileResponse:
+WSGI-сервер с wsgi.file_wrapper (gunicorn) передаёт его через
+os.sendfile. Поддерживаются Range с одним диапазоном, ETag,
+If-None-Match/If-Modified-Since и долгий Cache-Control для файлов,
+имя которых меняется вместе с содержимым.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified)
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Миниатюры sorl (cache/ab/cd/<md5>.jpg) и картинки постов
+# (posts/ab/cd/<sha256>.jpg) не меняются, пока у них то же имя.
+IMMUTABLE = re.compile(
+    r'^[\w-]+/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{32}|[0-9a-f]{64})'
+    r'(@\dx)?\.\w+$'
+)
+
+
+def cache_control(path):
+    if IMMUTABLE.match(path):
+        return 'public, max-age={}, immutable'.format(
+            settings.MEDIA_IMMUTABLE_MAX_AGE
+        )
+    return f'public, max-age={settings.MEDIA_MAX_AGE}'
+
+
+def parse_range(header, size):
+    """(начало, конец) единственного диапазона Range.
+
+    None - заголовка нет или он не поддерживается (несколько диапазонов,
+    другие единицы): отдаётся весь файл. ValueError - диапазон вне файла.
+    """
+    match = RANGE.match(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not size:
+        raise ValueError('empty file')
+    if not first:
+        if not int(last):
+            raise ValueError('empty suffix range')
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        # Синтаксически неверный диапазон игнорируется (RFC 7233).
+        return None
+    if start >= size:
+        raise ValueError('range not satisfiable')
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+class FileRange:
+    """Файл, из которого читается только диапазон [start, start+length).
+
+    fileno() и позиция остаются у файла, поэтому wsgi.file_wrapper
+    отдаёт через os.sendfile ровно Content-Length байт с нужного места.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def _sendfile(path, full_path):
+    backend = settings.MEDIA_SENDFILE
+    response = HttpResponse()
+    if backend == 'x-sendfile':
+        response['X-Sendfile'] = full_path
+    elif backend == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path)
+        )
+    else:
+        raise ValueError(f'Неизвестный MEDIA_SENDFILE: {backend}')
+    return response
+
+
+@require_safe
+def serve(request, path):
+    path = path.lstrip('/')
+    if any(part.startswith('.') for part in path.split('/')):
+        raise Http404
+    content_type, encoding = mimetypes.guess_type(path)
+    if encoding or not (content_type or '').startswith('image/'):
+        raise Http404
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control(path),
+        'Accept-Ranges': 'bytes',
+    }
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if response is None:
+        response = _build_response(request, path, full_path, stat, etag,
+                                   content_type)
+    if isinstance(response, HttpResponseNotModified) or (
+            200 <= response.status_code < 300):
+        for header, value in headers.items():
+            response[header] = value
+    return response
+
+
+def _build_response(request, path, full_path, stat, etag, content_type):
+    if settings.MEDIA_SENDFILE:
+        # Range и тело отдаёт веб-сервер.
+        response = _sendfile(path, full_path)
+        response['Content-Type'] = content_type
+        return response
+    size = stat.st_size
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if 'HTTP_RANGE' in request.META and (not if_range or if_range == etag):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = size
+        return response
+    start, end = byte_range
+    response = FileResponse(
+        FileRange(file, start, end - start + 1),
+        status=206, content_type=content_type,
+    )
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = end - start + 1
+    return response
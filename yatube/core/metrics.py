@@ -0,0 +1,261 @@
+"""Метрики процесса: счётчики, текущие значения, наблюдения и гистограммы.
+
+У счётчиков и гистограмм могут быть метки: inc('http_responses',
+view='posts:index', status='200'). Внутри request_scope() счётчики
+копятся ещё и для текущего запроса - так middleware узнаёт, сколько
+попаданий в кеш было у этого запроса.
+
+Несколько процессов-воркеров: если задан METRICS_DIR, процесс не чаще
+раза в METRICS_FLUSH_INTERVAL секунд сохраняет свой snapshot в файл
+каталога, а collect() складывает файлы всех процессов. Файлы
+завершившихся процессов остаются, поэтому счётчики не убывают при
+перезапуске воркеров; каталог очищают при перезапуске всего сервиса.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+PREFIX = 'yatube_'
+# Границы корзин гистограмм: секунды и число запросов к базе.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+FLUSH_INTERVAL = 1.0
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_observations = defaultdict(lambda: [0, 0.0])
+_histograms = {}
+_request = ContextVar('metrics_request', default=None)
+_process = {}
+
+
+def series(name, labels):
+    """Имя ряда с метками в записи Prometheus: name{a="1",b="2"}."""
+    if not labels:
+        return name
+    text = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for key, value in sorted(labels.items())
+    )
+    return f'{name}{{{text}}}'
+
+
+def inc(name, amount=1, **labels):
+    key = series(name, labels)
+    with _lock:
+        _counters[key] += amount
+    scope = _request.get()
+    if scope is not None:
+        scope[key] += amount
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, value):
+    """Копит количество и сумму наблюдений, например, стоимость слияния."""
+    with _lock:
+        observation = _observations[name]
+        observation[0] += 1
+        observation[1] += value
+
+
+def histogram(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Раскладывает наблюдение по корзинам, например, время ответа view."""
+    key = series(name, labels)
+    with _lock:
+        item = _histograms.get(key)
+        if item is None:
+            item = _histograms[key] = {
+                'buckets': list(buckets),
+                'counts': [0] * len(buckets),
+                'sum': 0.0,
+                'count': 0,
+            }
+        for index, bound in enumerate(item['buckets']):
+            if value <= bound:
+                item['counts'][index] += 1
+                break
+        item['sum'] += value
+        item['count'] += 1
+
+
+@contextmanager
+def request_scope():
+    """Счётчики, увеличенные внутри блока: {ряд: прирост}."""
+    scope = defaultdict(float)
+    token = _request.set(scope)
+    try:
+        yield scope
+    finally:
+        _request.reset(token)
+
+
+def snapshot():
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'observations': {
+                name: {'count': count, 'sum': total}
+                for name, (count, total) in _observations.items()
+            },
+            'histograms': {
+                key: dict(item, counts=list(item['counts']))
+                for key, item in _histograms.items()
+            },
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _observations.clear()
+        _histograms.clear()
+
+
+def _directory():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def _process_file(directory):
+    """Файл процесса; pid и время старта - pid могут повторно выдаваться."""
+    if _process.get('pid') != os.getpid():
+        _process['pid'] = os.getpid()
+        _process['name'] = f'{os.getpid()}-{time.time():.0f}.json'
+        _process['flushed'] = 0.0
+        atexit.register(flush, force=True)
+    return os.path.join(directory, _process['name'])
+
+
+def flush(force=False):
+    """Сохраняет snapshot процесса в METRICS_DIR не чаще интервала."""
+    directory = _directory()
+    if not directory:
+        return
+    path = _process_file(directory)
+    now = time.monotonic()
+    interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', FLUSH_INTERVAL)
+    if not force and now - _process['flushed'] < interval:
+        return
+    _process['flushed'] = now
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(descriptor, 'w') as file:
+        json.dump(snapshot(), file)
+    os.replace(temporary, path)
+
+
+def _merge(total, data):
+    for key, value in data['counters'].items():
+        total['counters'][key] = total['counters'].get(key, 0) + value
+    total['gauges'].update(data['gauges'])
+    for name, item in data['observations'].items():
+        merged = total['observations'].setdefault(
+            name, {'count': 0, 'sum': 0}
+        )
+        merged['count'] += item['count']
+        merged['sum'] += item['sum']
+    for key, item in data['histograms'].items():
+        merged = total['histograms'].get(key)
+        if merged is None or merged['buckets'] != item['buckets']:
+            total['histograms'][key] = dict(item, counts=list(item['counts']))
+            continue
+        merged['counts'] = [a + b for a, b in zip(merged['counts'],
+                                                  item['counts'])]
+        merged['sum'] += item['sum']
+        merged['count'] += item['count']
+
+
+def collect():
+    """Метрики всех процессов из METRICS_DIR или только этого процесса.
+
+    Счётчики, наблюдения и гистограммы складываются; текущие значения
+    берутся из файла, записанного последним.
+    """
+    directory = _directory()
+    if not directory:
+        return snapshot()
+    flush(force=True)
+    files = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as file:
+                files.append((os.path.getmtime(path), json.load(file)))
+        except (OSError, ValueError):
+            # Файл удалили или ещё пишут - его процесс сдаст данные позже.
+            continue
+    total = {'counters': {}, 'gauges': {}, 'observations': {},
+             'histograms': {}}
+    for _, data in sorted(files, key=lambda item: item[0]):
+        _merge(total, data)
+    return total
+
+
+def _split(key):
+    name, brace, labels = key.partition('{')
+    return name, brace + labels
+
+
+def _with_label(labels, label):
+    if not labels:
+        return '{' + label + '}'
+    return labels[:-1] + ',' + label + '}'
+
+
+def _families(values):
+    families = defaultdict(list)
+    for key in sorted(values):
+        name, labels = _split(key)
+        families[name].append((labels, values[key]))
+    return sorted(families.items())
+
+
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render(data):
+    """Метрики в текстовом формате Prometheus 0.0.4."""
+    lines = []
+    for name, rows in _families(data['counters']):
+        lines.append(f'# TYPE {PREFIX}{name}_total counter')
+        lines += [f'{PREFIX}{name}_total{labels} {_number(value)}'
+                  for labels, value in rows]
+    for name, value in sorted(data['gauges'].items()):
+        lines.append(f'# TYPE {PREFIX}{name} gauge')
+        lines.append(f'{PREFIX}{name} {_number(value)}')
+    for name, item in sorted(data['observations'].items()):
+        lines.append(f'# TYPE {PREFIX}{name} summary')
+        lines.append(f'{PREFIX}{name}_count {item["count"]}')
+        lines.append(f'{PREFIX}{name}_sum {item["sum"]}')
+    for name, rows in _families(data['histograms']):
+        lines.append(f'# TYPE {PREFIX}{name} histogram')
+        for labels, item in rows:
+            cumulative = 0
+            for bound, count in zip(item['buckets'], item['counts']):
+                cumulative += count
+                le = _with_label(labels, f'le="{float(bound)}"')
+                lines.append(f'{PREFIX}{name}_bucket{le} {cumulative}')
+            le = _with_label(labels, 'le="+Inf"')
+            lines.append(f'{PREFIX}{name}_bucket{le} {item["count"]}')
+            lines.append(f'{PREFIX}{name}_sum{labels} {item["sum"]}')
+            lines.append(f'{PREFIX}{name}_count{labels} {item["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,172 @@
+"""Статика с отпечатками в именах и заранее сжатыми копиями.
+
+collectstatic через CompressedManifestStaticFilesStorage кладёт в
+STATIC_ROOT файлы с хешем содержимого в имени (logo.3f2a9c1b7e4d.png),
+а рядом с текстовыми - сжатые копии .gz и, если установлен brotli, .br.
+serve отдаёт лучшую копию, которую принимает клиент (Accept-Encoding),
+и помечает файлы с хешем в имени как immutable: при изменении файла
+меняется и его адрес.
+"""
+import gzip
+import mimetypes
+import os
+import re
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Кодировка ответа и расширение её копии, в порядке предпочтения.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE = (
+    '.css', '.js', '.map', '.svg', '.json', '.txt', '.xml', '.html',
+    '.ico', '.ttf', '.otf', '.eot',
+)
+# Меньше этого сжатие не окупает заголовков и лишнего файла.
+MIN_COMPRESS_SIZE = 256
+# Имя с отпечатком из ManifestStaticFilesStorage: logo.3f2a9c1b7e4d.png.
+HASHED = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+
+
+def compress(path):
+    """Пишет рядом с файлом .gz и .br, если они заметно меньше него."""
+    with open(path, 'rb') as source:
+        data = source.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return []
+    buffer = BytesIO()
+    # mtime=0: одинаковый файл даёт одинаковую копию при каждой сборке.
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as target:
+        target.write(data)
+    variants = [('.gz', buffer.getvalue())]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    written = []
+    for extension, compressed in variants:
+        if len(compressed) >= len(data) * 0.95:
+            continue
+        with open(path + extension, 'wb') as target:
+            target.write(compressed)
+        written.append(path + extension)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        for name, hashed_name, processed in super().post_process(
+                paths, dry_run, **options):
+            if not isinstance(processed, Exception):
+                names.update((name, hashed_name))
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for name in sorted(filter(None, names)):
+            if name.endswith(COMPRESSIBLE):
+                compress(self.path(name))
+
+    @property
+    def manifest_strict(self):
+        return getattr(settings, 'STATIC_MANIFEST_STRICT', True)
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            if self.manifest_strict:
+                raise
+            # Без collectstatic (тесты, разработка) ссылка ведёт на файл
+            # без отпечатка, а не роняет страницу.
+            return name
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding, которые клиент принимает."""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    if '*' in accepted:
+        accepted.update(coding for coding, _ in ENCODINGS)
+    return accepted
+
+
+def cache_control(path):
+    if HASHED.search(path):
+        return 'public, max-age={}, immutable'.format(
+            settings.STATIC_IMMUTABLE_MAX_AGE
+        )
+    return f'public, max-age={settings.STATIC_MAX_AGE}'
+
+
+def _locate(path):
+    if any(part.startswith('.') for part in path.split('/')):
+        raise Http404
+    if mimetypes.guess_type(path)[1] or not settings.STATIC_ROOT:
+        # Сжатые копии отдаются только вместо своего файла.
+        raise Http404
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    return full_path
+
+
+def best_variant(full_path, accept_encoding):
+    """Путь к лучшей принимаемой клиентом копии файла и её кодировка."""
+    accepted = accepted_encodings(accept_encoding)
+    for coding, extension in ENCODINGS:
+        if coding in accepted and os.path.isfile(full_path + extension):
+            return full_path + extension, coding
+    return full_path, None
+
+
+@require_safe
+def serve(request, path):
+    path = path.lstrip('/')
+    content_type = mimetypes.guess_type(path)[0]
+    full_path, coding = best_variant(
+        _locate(path), request.META.get('HTTP_ACCEPT_ENCODING', '')
+    )
+    stat = os.stat(full_path)
+    etag = '"{:x}-{:x}{}"'.format(
+        stat.st_mtime_ns, stat.st_size, f'-{coding}' if coding else ''
+    )
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if response is None:
+        response = FileResponse(open(full_path, 'rb'))
+        # Тип - исходного файла, а не его сжатой копии.
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        if coding:
+            response['Content-Encoding'] = coding
+    if isinstance(response, HttpResponseNotModified) or (
+            200 <= response.status_code < 300):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Cache-Control'] = cache_control(path)
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
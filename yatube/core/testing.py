@@ -0,0 +1,75 @@
+"""Бюджет SQL-запросов для тестов.
+
+QueryBudget(n) - контекстный менеджер и декоратор: записывает запросы к
+базе и падает, если их больше n. В сообщении об ошибке - все запросы и
+повторяющиеся формы запросов (SQL без значений): одна форма, повторённая
+для каждой строки страницы, - признак N+1.
+
+Для TestCase - примесь QueryBudgetMixin, для pytest - фикстура
+query_budget (tests/fixtures/fixture_query_budget.py).
+"""
+import re
+from collections import Counter
+from contextlib import ContextDecorator
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+VALUE_LISTS = re.compile(r'\(\?(?:, \?)+\)')
+
+
+def shape(sql):
+    """SQL без значений: запросы, различающиеся только id, совпадают."""
+    return VALUE_LISTS.sub('(...)', LITERALS.sub('?', sql))
+
+
+class QueryBudget(ContextDecorator):
+    """Не больше budget запросов к базе using внутри блока."""
+
+    def __init__(self, budget, using=DEFAULT_DB_ALIAS):
+        self.budget = budget
+        self.connection = connections[using]
+        self.captured = None
+
+    def __enter__(self):
+        self.captured = CaptureQueriesContext(self.connection)
+        self.captured.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.captured.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and len(self) > self.budget:
+            raise AssertionError(self.report())
+
+    def __len__(self):
+        return len(self.captured)
+
+    @property
+    def queries(self):
+        return [query['sql'] for query in self.captured.captured_queries]
+
+    def duplicates(self):
+        """[(форма, сколько раз)] для форм, выполненных больше одного раза."""
+        counts = Counter(shape(sql) for sql in self.queries)
+        return [
+            (sql, count) for sql, count in counts.most_common() if count > 1
+        ]
+
+    def report(self):
+        lines = [f'{len(self)} запросов при бюджете {self.budget}:']
+        lines += [
+            f'{number}. {sql}' for number, sql in enumerate(self.queries, 1)
+        ]
+        duplicates = self.duplicates()
+        if duplicates:
+            lines.append('Повторяющиеся формы запросов:')
+            lines += [f'{count} x {sql}' for sql, count in duplicates]
+        return '\n'.join(lines)
+
+
+class QueryBudgetMixin:
+    """Примесь к TestCase: with self.assertQueryBudget(n): ..."""
+
+    def assertQueryBudget(self, budget, using=DEFAULT_DB_ALIAS):
+        return QueryBudget(budget, using)
@@ -0,0 +1,134 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+from http import HTTPStatus
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+
+from core import metrics
+from posts.models import Post
+
+User = get_user_model()
+TIMING = re.compile(
+    r'total;dur=[\d.]+, db;dur=[\d.]+;desc="(\d+) queries", '
+    r'tpl;dur=([\d.]+), cache;desc="hit=(\d+) miss=(\d+)"'
+)
+
+
+@override_settings(METRICS_TOKEN='secret')
+class InstrumentationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='timed')
+        for number in range(3):
+            Post.objects.create(author=author, text=f'Пост {number}')
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+
+    def scrape(self):
+        return self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+
+    def timing(self, response):
+        match = TIMING.fullmatch(response['Server-Timing'])
+        self.assertIsNotNone(match, response['Server-Timing'])
+        queries, template, hits, misses = match.groups()
+        return int(queries), float(template), int(hits), int(misses)
+
+    def test_server_timing_reports_queries_templates_and_cache(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('posts:index'))
+        queries, template, hits, misses = self.timing(response)
+        self.assertEqual(queries, len(captured))
+        self.assertGreater(template, 0)
+        # Промах кеша страницы и три промаха карточек.
+        self.assertEqual((hits, misses), (0, 4))
+        queries, _, hits, misses = self.timing(
+            self.client.get(reverse('posts:index')))
+        self.assertEqual((hits, misses), (1, 0))
+
+    def test_metrics_endpoint_exposes_per_view_histograms(self):
+        self.client.get(reverse('posts:index'))
+        self.client.get('/missing/')
+        response = self.scrape()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn('# TYPE yatube_http_request_seconds histogram', text)
+        self.assertIn(
+            'yatube_http_responses_total'
+            '{status="200",view="index:index"} 1', text)
+        self.assertIn(
+            'yatube_http_request_seconds_bucket'
+            '{view="index:index",le="+Inf"} 1', text)
+        self.assertIn('yatube_http_request_queries_count'
+                      '{view="index:index"} 1', text)
+        self.assertIn('status="404",view="unresolved"', text)
+        self.assertIn('yatube_page_cache_misses_total 1', text)
+
+    def test_metrics_endpoint_requires_token_or_staff(self):
+        # За прокси на той же машине запросы приходят с 127.0.0.1.
+        for headers in ({}, {'HTTP_AUTHORIZATION': 'Bearer wrong'},
+                        {'HTTP_AUTHORIZATION': 'secret'}):
+            with self.subTest(headers=headers):
+                response = self.client.get(
+                    reverse('metrics'), REMOTE_ADDR='127.0.0.1', **headers)
+                self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+        with override_settings(METRICS_TOKEN=None):
+            response = self.client.get(
+                reverse('metrics'), HTTP_AUTHORIZATION='Bearer None')
+            self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+            self.client.force_login(
+                User.objects.create_user(username='reader'))
+            response = self.client.get(reverse('metrics'))
+            self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+            self.client.force_login(
+                User.objects.create_user(username='admin', is_staff=True))
+            response = self.client.get(reverse('metrics'))
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(self.scrape().status_code, HTTPStatus.OK)
+
+    def test_metrics_of_worker_processes_are_merged(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        other = {
+            'counters': {'page_cache_hits': 5},
+            'gauges': {},
+            'observations': {},
+            'histograms': {'http_request_seconds{view="index:index"}': {
+                'buckets': list(metrics.LATENCY_BUCKETS),
+                'counts': [2] + [0] * (len(metrics.LATENCY_BUCKETS) - 1),
+                'sum': 0.004,
+                'count': 2,
+            }},
+        }
+        with open(os.path.join(directory, '1-1.json'), 'w') as file:
+            json.dump(other, file)
+        with override_settings(METRICS_DIR=directory):
+            self.client.get(reverse('posts:index'))
+            self.client.get(reverse('posts:index'))
+            text = self.scrape().content.decode()
+            self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertIn('yatube_page_cache_hits_total 6', text)
+        self.assertIn('yatube_http_request_seconds_count'
+                      '{view="index:index"} 4', text)
+        self.assertIn('yatube_http_request_seconds_bucket'
+                      '{view="index:index",le="+Inf"} 4', text)
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_can_be_disabled(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(
+            metrics.snapshot()['histograms'][
+                'http_request_seconds{view="index:index"}']['count'], 1)
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+from http import HTTPStatus
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+THUMBNAIL = 'cache/ab/cd/' + 'e' * 32 + '.jpg'
+LEGACY = 'posts/photo.jpg'
+CONTENT = bytes(range(256)) * 4
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaServeTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for name in (THUMBNAIL, LEGACY, 'cache/thumbnail.idx',
+                     'posts/.tmp.upload.jpg'):
+            path = os.path.join(TEMP_MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(CONTENT)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def get(self, name, **headers):
+        return self.client.get(settings.MEDIA_URL + name, **headers)
+
+    def test_full_file(self):
+        response = self.get(THUMBNAIL)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(CONTENT)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertNotIn('immutable', self.get(LEGACY)['Cache-Control'])
+
+    def test_not_modified(self):
+        etag = self.get(THUMBNAIL)['ETag']
+        response = self.get(THUMBNAIL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_ranges(self):
+        cases = {
+            'bytes=0-9': (0, 9),
+            'bytes=1000-': (1000, 1023),
+            'bytes=-24': (1000, 1023),
+            'bytes=1000-5000': (1000, 1023),
+        }
+        for header, (start, end) in cases.items():
+            with self.subTest(header=header):
+                response = self.get(THUMBNAIL, HTTP_RANGE=header)
+                self.assertEqual(
+                    response.status_code, HTTPStatus.PARTIAL_CONTENT)
+                self.assertEqual(
+                    b''.join(response.streaming_content),
+                    CONTENT[start:end + 1])
+                self.assertEqual(
+                    response['Content-Range'],
+                    f'bytes {start}-{end}/{len(CONTENT)}')
+                self.assertEqual(
+                    response['Content-Length'], str(end - start + 1))
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response = self.get(THUMBNAIL, HTTP_RANGE='bytes=5000-')
+        self.assertEqual(
+            response.status_code, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(CONTENT)}')
+        for header in ('bytes=0-1,5-6', 'items=0-1', 'bytes=9-1'):
+            with self.subTest(header=header):
+                response = self.get(THUMBNAIL, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+        response = self.get(
+            THUMBNAIL, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_hidden_and_foreign_files_are_not_served(self):
+        for name in ('cache/thumbnail.idx', 'posts/.tmp.upload.jpg',
+                     '../manage.py', 'posts/missing.jpg'):
+            with self.subTest(name=name):
+                self.assertEqual(
+                    self.get(name).status_code, HTTPStatus.NOT_FOUND)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect')
+    def test_accel_redirect(self):
+        response = self.get(THUMBNAIL)
+        self.assertEqual(
+            response['X-Accel-Redirect'], '/protected-media/' + THUMBNAIL)
+        self.assertEqual(response.content, b'')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    @override_settings(MEDIA_SENDFILE='x-sendfile')
+    def test_x_sendfile(self):
+        response = self.get(LEGACY)
+        self.assertEqual(
+            response['X-Sendfile'], os.path.join(TEMP_MEDIA_ROOT, LEGACY))
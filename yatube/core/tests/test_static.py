@@ -0,0 +1,122 @@
+import gzip
+import os
+import shutil
+import tempfile
+from http import HTTPStatus
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+
+from core import static
+
+TEMP_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SOURCE_DIR = os.path.join(TEMP_DIR, 'static')
+STATIC_ROOT = os.path.join(TEMP_DIR, 'staticfiles')
+CSS = ('body { color: #333; }\n' * 100).encode()
+PNG = bytes(range(256)) * 4
+
+
+@override_settings(
+    STATICFILES_DIRS=[SOURCE_DIR],
+    STATIC_ROOT=STATIC_ROOT,
+    STATICFILES_STORAGE='core.static.CompressedManifestStaticFilesStorage',
+)
+class StaticFilesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for name, content in (('css/site.css', CSS), ('img/logo.png', PNG)):
+            path = os.path.join(SOURCE_DIR, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(content)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.css = staticfiles_storage.stored_name('css/site.css')
+
+    def get(self, name, **headers):
+        return self.client.get(settings.STATIC_URL + name, **headers)
+
+    def test_collectstatic_fingerprints_and_compresses(self):
+        self.assertRegex(self.css, r'^css/site\.[0-9a-f]{12}\.css$')
+        with gzip.open(os.path.join(STATIC_ROOT, self.css + '.gz')) as file:
+            self.assertEqual(file.read(), CSS)
+        png = staticfiles_storage.stored_name('img/logo.png')
+        self.assertFalse(
+            os.path.exists(os.path.join(STATIC_ROOT, png + '.gz'))
+        )
+
+    def test_static_tag_uses_fingerprinted_name(self):
+        html = Template(
+            "{% load static %}{% static 'css/site.css' %}"
+            "|{% static 'img/missing.png' %}"
+        ).render(Context())
+        self.assertEqual(
+            html,
+            f'{settings.STATIC_URL}{self.css}|'
+            f'{settings.STATIC_URL}img/missing.png',
+        )
+
+    @override_settings(STATIC_MANIFEST_STRICT=True)
+    def test_strict_manifest_rejects_missing_file(self):
+        with self.assertRaisesMessage(ValueError, 'img/missing.png'):
+            staticfiles_storage.stored_name('img/missing.png')
+        self.assertEqual(
+            staticfiles_storage.stored_name('css/site.css'), self.css)
+
+    def test_serves_precompressed_variant(self):
+        response = self.get(self.css, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)), CSS
+        )
+
+    @skipUnless(static.brotli, 'brotli не установлен')
+    def test_prefers_brotli(self):
+        response = self.get(self.css, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(
+            static.brotli.decompress(b''.join(response.streaming_content)),
+            CSS,
+        )
+
+    def test_serves_identity_when_encoding_not_accepted(self):
+        for header in ('', 'identity', 'gzip;q=0'):
+            with self.subTest(header=header):
+                response = self.get(self.css, HTTP_ACCEPT_ENCODING=header)
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertEqual(b''.join(response.streaming_content), CSS)
+
+    def test_not_modified_per_encoding(self):
+        etag = self.get(self.css, HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        response = self.get(
+            self.css, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertNotEqual(self.get(self.css)['ETag'], etag)
+
+    def test_unhashed_name_is_not_immutable(self):
+        response = self.get('css/site.css')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_not_found(self):
+        for name in (self.css + '.gz', '../manage.py', 'css/missing.css'):
+            with self.subTest(name=name):
+                self.assertEqual(
+                    self.get(name).status_code, HTTPStatus.NOT_FOUND
+                )
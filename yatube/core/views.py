@@ -1,4 +1,10 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+
+from core import metrics
 
 
 def page_not_found(request, exception):
@@ -15,3 +21,27 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+def metrics_allowed(request):
+    """Сотрудник или запрос с заголовком Authorization: Bearer <токен>.
+
+    Адрес клиента не в счёт: за прокси на той же машине все запросы
+    приходят с 127.0.0.1.
+    """
+    if request.user.is_staff:
+        return True
+    token = settings.METRICS_TOKEN
+    return bool(token) and constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'
+    )
+
+
+def metrics_endpoint(request):
+    """Метрики всех процессов в текстовом формате Prometheus."""
+    if not metrics_allowed(request):
+        raise PermissionDenied
+    return HttpResponse(
+        metrics.render(metrics.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -1,6 +1,36 @@
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
 
+from .counters import index_count
 from .models import Post, Group
+from .paginators import AdminPaginator
+from .search import filter_matching
+
+
+class PreloadedAutocompleteSelect(AutocompleteSelect):
+    """Автодополнение, которому выбранный объект передаёт форма.
+
+    В списке постов у каждой строки своя форма, и без этого виджет
+    читал бы подпись выбранной группы отдельным запросом на строку.
+    """
+    preloaded = None
+
+    def optgroups(self, name, value, attr=None):
+        selected = {
+            str(v) for v in value
+            if str(v) not in self.choices.field.empty_values
+        }
+        obj = self.preloaded
+        if obj is None or selected != {str(obj.pk)}:
+            return super().optgroups(name, value, attr)
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        options.append(self.create_option(
+            name, obj.pk, self.choices.field.label_from_instance(obj),
+            True, len(options),
+        ))
+        return [(None, options, 0)]
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -12,9 +42,47 @@ class PostAdmin(admin.ModelAdmin):
         'group',
     )
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
+    autocomplete_fields = ('group',)
     search_fields = ('text',)
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        return AdminPaginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            estimate=index_count,
+        )
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'group':
+            kwargs['widget'] = PreloadedAutocompleteSelect(
+                db_field.remote_field, self.admin_site,
+                using=kwargs.get('using'),
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_changelist_form(self, request, **kwargs):
+        form_class = super().get_changelist_form(request, **kwargs)
+
+        class ChangelistForm(form_class):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                # Группа уже загружена list_select_related.
+                widget = self.fields['group'].widget
+                getattr(widget, 'widget', widget).preloaded = (
+                    self.instance.group if self.instance.group_id else None
+                )
+
+        return ChangelistForm
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по тексту идёт через полнотекстовый индекс, а не LIKE.
+        if not search_term.strip():
+            return queryset, False
+        return filter_matching(queryset, search_term), False
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -23,10 +91,13 @@ class GroupAdmin(admin.ModelAdmin):
         'title',
         'slug',
         'description',
+        'posts_count',
     )
     list_editable = ('description',)
     search_fields = ('title',)
     empty_value_display = '-пусто-'
+    paginator = AdminPaginator
+    show_full_result_count = False
 
 
 admin.site.register(Post, PostAdmin)
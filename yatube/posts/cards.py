@@ -0,0 +1,57 @@
+"""Кеш отрендеренных карточек постов.
+
+Ключ карточки состоит из id поста и версий поста, автора и группы
+(см. posts.versions), которые меняются в posts.signals.
+"""
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from core import metrics
+from posts import versions
+from posts.settings import POST_CARD_TEMPLATE, POST_CARD_TIMEOUT
+
+
+def _dependencies(post):
+    return (
+        versions.version_key('post', post.pk),
+        versions.version_key('user', post.author_id),
+        versions.version_key('group', post.group_id),
+    )
+
+
+def lookup(posts):
+    """Ключи и готовые карточки для постов страницы двумя запросами к кешу.
+
+    Возвращает {id поста: (ключ, html или None)}; без общего кеша
+    (versions.enabled) ключи - None, и карточки не кешируются.
+    """
+    posts = list(posts)
+    if not versions.enabled():
+        return {post.pk: (None, None) for post in posts}
+    stamps = versions.get_many(
+        {key for post in posts for key in _dependencies(post)}
+    )
+    keys = {
+        post.pk: 'post_card:{}:{}:{}:{}'.format(
+            post.pk, *(stamps[key] for key in _dependencies(post))
+        )
+        for post in posts
+    }
+    found = cache.get_many(keys.values())
+    return {pk: (key, found.get(key)) for pk, key in keys.items()}
+
+
+def render(post, cards=None):
+    """HTML карточки поста: из кеша или свежий рендер с записью в кеш."""
+    if cards is None or post.pk not in cards:
+        cards = lookup([post])
+    key, html = cards[post.pk]
+    if key is None:
+        return render_to_string(POST_CARD_TEMPLATE, {'post': post})
+    if html is not None:
+        metrics.inc('post_card_cache_hits')
+        return html
+    metrics.inc('post_card_cache_misses')
+    html = render_to_string(POST_CARD_TEMPLATE, {'post': post})
+    cache.set(key, html, POST_CARD_TIMEOUT)
+    return html
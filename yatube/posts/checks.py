@@ -0,0 +1,16 @@
+from django.core.checks import Warning, register
+
+from posts import versions
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    if versions.enabled():
+        return []
+    return [Warning(
+        'Кеш страниц и карточек постов отключён: кеш в памяти процесса '
+        'не годится для нескольких воркеров.',
+        hint='Настройте общий кеш (memcached, redis) или, если процесс '
+             'один, CACHE_SINGLE_PROCESS = True.',
+        id='posts.W001',
+    )]
@@ -0,0 +1,102 @@
+"""Денормализованные счётчики постов, подписок и комментариев.
+
+Счётчики меняются атомарно через F-выражения из сигналов моделей
+(см. posts.signals), а recount() пересчитывает их пачками, если
+значения разошлись с таблицами. Общее число постов для главной
+страницы хранится в строке FeedCount, общей для всех процессов: сигналы
+сдвигают его, а команда refresh_feed_counts периодически пересчитывает.
+"""
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import (Comment, FeedCount, Follow, Group, Post, Profile,
+                          User)
+
+INDEX_FEED = 'index'
+
+
+def shift(model, pk, field, delta):
+    """Сдвигает счётчик field строки model на delta одним UPDATE.
+
+    Счётчик не уходит ниже нуля, даже если успел разойтись с таблицей.
+    """
+    if pk is None:
+        return
+    rows = model.objects.filter(pk=pk)
+    if delta < 0:
+        rows = rows.filter(**{f'{field}__gte': -delta})
+    rows.update(**{field: F(field) + delta})
+
+
+def index_count():
+    """Оценка числа постов на главной или None, если её ещё нет."""
+    return FeedCount.objects.filter(pk=INDEX_FEED).values_list(
+        'count', flat=True
+    ).first()
+
+
+def shift_index_count(delta):
+    # Строки нет - её заполнит refresh_feed_counts.
+    shift(FeedCount, INDEX_FEED, 'count', delta)
+
+
+def refresh_index_count():
+    count = Post.objects.count()
+    FeedCount.objects.update_or_create(
+        pk=INDEX_FEED, defaults={'count': count}
+    )
+    return count
+
+
+def _count(model, field):
+    rows = model.objects.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(rows), 0)
+
+
+RECOUNTS = (
+    (Profile, {
+        'posts_count': _count(Post, 'author'),
+        'followers_count': _count(Follow, 'author'),
+        'following_count': _count(Follow, 'user'),
+    }),
+    (Post, {'comments_count': _count(Comment, 'post')}),
+    (Group, {'posts_count': _count(Post, 'group')}),
+)
+
+
+def create_missing_profiles():
+    missing = User.objects.filter(profile__isnull=True).values_list(
+        'pk', flat=True
+    )
+    return len(Profile.objects.bulk_create(
+        [Profile(user_id=pk) for pk in missing], ignore_conflicts=True
+    ))
+
+
+def recount(batch_size=1000):
+    """Пересчитывает все счётчики диапазонами первичного ключа.
+
+    Возвращает число обновлённых строк по каждой модели.
+    """
+    create_missing_profiles()
+    updated = {}
+    for model, counters in RECOUNTS:
+        updated[model.__name__] = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                model.objects.filter(pk__gt=last_pk).order_by(
+                    'pk'
+                ).values_list('pk', flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            with transaction.atomic():
+                updated[model.__name__] += model.objects.filter(
+                    pk__gte=batch[0], pk__lte=batch[-1]
+                ).update(**counters)
+            last_pk = batch[-1]
+    return updated
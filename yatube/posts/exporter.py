@@ -0,0 +1,100 @@
+"""Потоковая выгрузка постов и комментариев в NDJSON.
+
+Таблица обходится диапазонами первичного ключа: каждый диапазон - свой
+короткий запрос (на SQLite - своя короткая блокировка чтения), строки
+читаются через iterator() без создания моделей и сразу превращаются в
+строки NDJSON, поэтому память не растёт с размером таблицы. Поля и
+имена совпадают с форматом import_yatube.
+
+Инкрементальная выгрузка: since - только строки с датой не раньше
+указанной, after_id - только строки с id больше указанного. Последний
+выгруженный id сообщает Export.last_id.
+"""
+import json
+import zlib
+
+from posts.models import Comment, Post
+from posts.paginators import MAX_CURSOR_PK
+
+ENTITIES = {
+    'posts': (
+        Post, 'pub_date',
+        ('id', 'author', 'group', 'text', 'pub_date', 'image'),
+    ),
+    'comments': (
+        Comment, 'created',
+        ('id', 'post', 'author', 'text', 'created'),
+    ),
+}
+CHUNK_SIZE = 2000
+
+
+class Export:
+    """Строки NDJSON одной сущности; итерируется один раз."""
+
+    def __init__(self, entity, since=None, after_id=None,
+                 chunk_size=CHUNK_SIZE):
+        self.model, self.date_field, self.fields = ENTITIES[entity]
+        self.since = since
+        self.last_id = after_id or 0
+        # Как и id в курсорах страниц, должен поместиться в целое базы.
+        if not 0 <= self.last_id < MAX_CURSOR_PK:
+            raise ValueError(f'after_id вне диапазона: {self.last_id}')
+        self.chunk_size = chunk_size
+        self.rows = 0
+
+    def queryset(self):
+        rows = self.model.objects.order_by('pk')
+        if self.since is not None:
+            rows = rows.filter(**{f'{self.date_field}__gte': self.since})
+        return rows
+
+    def __iter__(self):
+        columns = [
+            self.model._meta.get_field(name).attname for name in self.fields
+        ]
+        while True:
+            chunk = self.queryset().filter(pk__gt=self.last_id).values_list(
+                *columns
+            )[:self.chunk_size]
+            count = 0
+            for row in chunk.iterator(chunk_size=self.chunk_size):
+                count += 1
+                self.last_id = row[0]
+                yield self.line(row)
+            self.rows += count
+            if count < self.chunk_size:
+                return
+
+    def line(self, row):
+        record = {}
+        for name, value in zip(self.fields, row):
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            record[name] = value
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def encode(lines):
+    """Строки в байтах, склеенные в куски около 64 КБ."""
+    buffer = []
+    size = 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= 64 * 1024:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks):
+    """Сжимает поток байтов в gzip на лету, не накапливая его."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
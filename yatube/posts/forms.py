@@ -22,6 +22,22 @@ class PostForm(forms.ModelForm):
                                           'resize: vertical;'})
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Картинку, отклонённую при загрузке (posts.uploads), форма
+        # не проверяет, а показывает причину отказа.
+        image = self.files.get('image')
+        self.upload_error = getattr(image, 'upload_error', None)
+        if self.upload_error:
+            self.files = self.files.copy()
+            del self.files['image']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.upload_error:
+            self.add_error('image', self.upload_error)
+        return cleaned_data
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,296 @@
+"""Массовый импорт данных из других систем (команда import_yatube).
+
+Записи читаются потоком из NDJSON (объект на строку) или CSV с
+заголовком и пишутся bulk_create пачками, каждая пачка - в своей
+транзакции. Внешние id пользователей, групп и постов переводятся в id
+yatube через словари в памяти, а id новых строк выдаёт сам импорт,
+поэтому их не нужно перечитывать из базы после вставки.
+
+bulk_create не вызывает сигналов, поэтому счётчики, ленты подписок,
+оценка числа постов и кеш страниц пересчитываются один раз в конце
+(finish), а триггеры поискового индекса на время импорта снимаются.
+
+Поля записей (id - внешний идентификатор, ссылки - внешние id):
+    users: id, username, email, first_name, last_name, password
+           (готовый хеш), date_joined
+    groups: id, title, slug, description
+    posts: id, author, group, text, pub_date, image
+    comments: post, author, text, created
+    follows: user, author
+"""
+import csv
+import json
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import dateparse, timezone
+
+from posts import counters, page_cache, timeline
+from posts.models import Comment, Follow, Group, Post, User
+
+ENTITIES = ('users', 'groups', 'posts', 'comments', 'follows')
+MODELS = {
+    'users': User, 'groups': Group, 'posts': Post,
+    'comments': Comment, 'follows': Follow,
+}
+
+
+class RecordError(ValueError):
+    """Запись, которую нельзя разобрать: с номером строки файла."""
+
+
+def read_records(path):
+    """(номер строки, словарь) из файла NDJSON или CSV; '-' - stdin.
+
+    Формат выбирается по расширению: .csv - CSV, остальное - NDJSON.
+    """
+    if path == '-':
+        yield from _read_ndjson(sys.stdin, path)
+        return
+    with open(path, encoding='utf-8', newline='') as stream:
+        if path.lower().endswith('.csv'):
+            for number, row in enumerate(csv.DictReader(stream), start=2):
+                yield number, row
+        else:
+            yield from _read_ndjson(stream, path)
+
+
+def _read_ndjson(stream, path):
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise RecordError(f'{path}:{number}: {error}')
+        if not isinstance(record, dict):
+            raise RecordError(f'{path}:{number}: ожидался объект')
+        yield number, record
+
+
+def parse_date(value):
+    """Дата из ISO 8601; без часового пояса - в TIME_ZONE, пусто - сейчас.
+
+    Дата без времени означает полночь.
+    """
+    if not value:
+        return timezone.now()
+    parsed = dateparse.parse_datetime(value)
+    if parsed is None:
+        day = dateparse.parse_date(value)
+        if day is None:
+            raise ValueError(f'неверная дата: {value}')
+        parsed = datetime.combine(day, datetime.min.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+@contextmanager
+def preserved_dates(*fields):
+    """Отключает auto_now_add, чтобы сохранить даты из источника."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Stats:
+    def __init__(self):
+        self.rows = 0
+        self.skipped = 0
+        self.seconds = 0.0
+
+    @property
+    def rate(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class Importer:
+    """Импорт сущностей по очереди: пользователи, группы, посты и т.д.
+
+    Ссылки разрешаются только на уже импортированные в этом запуске
+    записи, поэтому файлы передаются в порядке ENTITIES. Запись со
+    ссылкой на неизвестный id пропускается и учитывается в skipped.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.ids = {'users': {}, 'groups': {}, 'posts': {}}
+        self.stats = {}
+        self.authors = set()
+        self.followers = set()
+
+    def _next_pk(self, model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def _write(self, model, objects, **kwargs):
+        with transaction.atomic():
+            model.objects.bulk_create(objects, **kwargs)
+
+    def load(self, entity, records):
+        build = getattr(self, f'build_{entity[:-1]}')
+        model = MODELS[entity]
+        stats = self.stats[entity] = Stats()
+        started = time.perf_counter()
+        self._pk = self._next_pk(model)
+        batch = []
+        for number, record in records:
+            try:
+                obj = build(record)
+            except (KeyError, ValueError) as error:
+                raise RecordError(f'{entity}:{number}: {error}')
+            if obj is None:
+                stats.skipped += 1
+                continue
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                self._flush(entity, model, batch, stats)
+                batch = []
+        if batch:
+            self._flush(entity, model, batch, stats)
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+    def _flush(self, entity, model, batch, stats):
+        size = len(batch)
+        if entity == 'users':
+            batch = self._skip_existing(entity, batch, 'username')
+        elif entity == 'groups':
+            batch = self._skip_existing(entity, batch, 'slug')
+        self._write(model, batch, ignore_conflicts=entity == 'follows')
+        stats.rows += len(batch)
+        stats.skipped += size - len(batch)
+
+    def _take_pk(self):
+        pk, self._pk = self._pk, self._pk + 1
+        return pk
+
+    def _ref(self, entity, value):
+        if value in (None, ''):
+            return None
+        return self.ids[entity].get(str(value))
+
+    def build_user(self, record):
+        user = User(
+            pk=self._take_pk(),
+            username=record['username'],
+            email=record.get('email') or '',
+            first_name=record.get('first_name') or '',
+            last_name=record.get('last_name') or '',
+            password=record.get('password') or make_password(None),
+            date_joined=parse_date(record.get('date_joined')),
+        )
+        user.import_key = str(record['id'])
+        self.ids['users'][user.import_key] = user.pk
+        return user
+
+    def _skip_existing(self, entity, batch, field):
+        """Убирает из пачки строки, уже лежащие в базе под тем же field,
+        и повторы field внутри пачки (остаётся первая запись).
+
+        Ссылки на такую запись ведут на существующую строку, поэтому
+        повторный импорт пользователей и групп их не дублирует.
+        """
+        model = type(batch[0])
+        existing = dict(model.objects.filter(**{
+            f'{field}__in': [getattr(obj, field) for obj in batch]
+        }).values_list(field, 'pk'))
+        fresh = []
+        for obj in batch:
+            value = getattr(obj, field)
+            pk = existing.get(value)
+            if pk is None:
+                fresh.append(obj)
+                existing[value] = obj.pk
+            else:
+                self.ids[entity][obj.import_key] = pk
+        return fresh
+
+    def build_group(self, record):
+        group = Group(
+            pk=self._take_pk(),
+            title=record['title'],
+            slug=record['slug'],
+            description=record.get('description') or '',
+        )
+        group.import_key = str(record['id'])
+        self.ids['groups'][group.import_key] = group.pk
+        return group
+
+    def build_post(self, record):
+        author = self._ref('users', record['author'])
+        group = self._ref('groups', record.get('group'))
+        if author is None or (record.get('group') and group is None):
+            return None
+        post = Post(
+            pk=self._take_pk(),
+            author_id=author,
+            group_id=group,
+            text=record['text'],
+            pub_date=parse_date(record.get('pub_date')),
+            image=record.get('image') or None,
+        )
+        self.ids['posts'][str(record['id'])] = post.pk
+        self.authors.add(author)
+        return post
+
+    def build_comment(self, record):
+        post = self._ref('posts', record['post'])
+        author = self._ref('users', record['author'])
+        if post is None or author is None:
+            return None
+        return Comment(
+            pk=self._take_pk(),
+            post_id=post,
+            author_id=author,
+            text=record['text'],
+            created=parse_date(record.get('created')),
+        )
+
+    def build_follow(self, record):
+        user = self._ref('users', record['user'])
+        author = self._ref('users', record['author'])
+        if user is None or author is None or user == author:
+            return None
+        self.followers.add(user)
+        return Follow(user_id=user, author_id=author)
+
+    def finish(self):
+        """Пересчитывает то, что при обычной записи делают сигналы."""
+        readers = set(self.followers)
+        readers.update(Follow.objects.filter(
+            author_id__in=self.authors
+        ).values_list('user_id', flat=True))
+        refresh_derived(readers, batch_size=self.batch_size)
+        return len(readers)
+
+
+def refresh_derived(readers=(), batch_size=1000):
+    """Приводит производные данные в порядок после записи в обход моделей.
+
+    Сдвигает последовательности id за вставленные явно ключи,
+    пересчитывает счётчики и оценку числа постов, пересобирает ленты
+    readers и сбрасывает кеш страниц.
+    """
+    statements = connection.ops.sequence_reset_sql(
+        no_style(), list(MODELS.values())
+    )
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+    counters.recount(batch_size=batch_size)
+    counters.refresh_index_count()
+    for user_id in sorted(readers):
+        timeline.rebuild(user_id)
+    page_cache.bump(page_cache.GLOBAL_SCOPE)
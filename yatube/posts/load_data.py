@@ -0,0 +1,291 @@
+"""Генерация больших правдоподобных наборов данных (generate_load_data).
+
+Данные похожи на живую соцсеть: посты пишет немногочисленное ядро
+авторов, у популярных авторов больше подписчиков, группы сильно
+различаются по размеру, а комментарии собираются под небольшой долей
+популярных постов. Все такие выборы - степенные законы (PowerLaw).
+
+Один seed на пустой базе даёт те же самые данные (даты отсчитываются от
+момента запуска): случайность идёт из random.Random(seed), тексты - из
+пула предложений Faker с тем же seed.
+
+Строки пишутся executemany кортежами значений пачками batch_size, каждая
+пачка - в своей транзакции: на десятках миллионов строк создание
+объектов моделей для bulk_create стоит дороже самой вставки. Id новых
+строк выдаёт сам генератор, сигналы не срабатывают, поэтому счётчики,
+ленты и кеш пересчитываются в конце (importer.refresh_derived).
+"""
+import io
+import math
+import random
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+from PIL import Image
+
+from posts.importer import Stats
+from posts.models import Comment, Follow, Group, Post, User
+from posts.settings import POST_IMAGE_SIZE
+
+BATCH_SIZE = 5000
+# Сколько разных предложений Faker готовится для текстов.
+SENTENCES = 2000
+# Показатели степенных законов: чем больше, тем сильнее перекос.
+AUTHOR_EXPONENT = 1.1
+GROUP_EXPONENT = 1.0
+COMMENTED_POST_EXPONENT = 1.2
+COMMENTER_EXPONENT = 0.8
+# Хвост распределения числа подписок одного пользователя (Парето).
+FOLLOW_ALPHA = 1.5
+# Доля постов без группы.
+GROUPLESS_SHARE = 0.3
+# Сколько разных картинок делят между собой посты с картинками.
+IMAGE_VARIANTS = 12
+# Среднее время от поста до комментария, секунды.
+COMMENT_DELAY = 60 * 60 * 24
+
+
+class PowerLaw:
+    """Индексы 0..n-1; ранг r выпадает с вероятностью ~ 1 / (r + 1) ** s.
+
+    Выборка за O(1) по обратной функции непрерывного распределения, без
+    таблицы весов на n элементов. Ранги разбросаны по индексам
+    перестановкой (r * step + shift) mod n, чтобы популярными были не
+    первые id.
+    """
+
+    def __init__(self, n, exponent, rng):
+        self.n = n
+        self.rng = rng
+        self.power = 1 - exponent
+        self.top = (n + 1) ** self.power
+        step = rng.randrange(n // 2, n) if n > 2 else 1
+        while math.gcd(step, n) != 1:
+            step += 1
+        self.step = step
+        self.shift = rng.randrange(n) if n else 0
+
+    def rank(self):
+        u = self.rng.random()
+        if self.power == 0:
+            x = (self.n + 1) ** u
+        else:
+            x = (1 + u * (self.top - 1)) ** (1 / self.power)
+        return min(int(x) - 1, self.n - 1)
+
+    def __call__(self):
+        return (self.rank() * self.step + self.shift) % self.n
+
+
+def insert(model, fields, rows, batch_size=BATCH_SIZE):
+    """Вставляет кортежи значений fields пачками, возвращает число строк."""
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(model._meta.get_field(name).column) for name in fields
+    )
+    placeholders = ', '.join(['%s'] * len(fields))
+    sql = (f'INSERT INTO {quote(model._meta.db_table)} ({columns}) '
+           f'VALUES ({placeholders})')
+    rows = iter(rows)
+    total = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return total
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, batch)
+        total += len(batch)
+
+
+class Generator:
+    """Создаёт сущности по очереди: пользователи, группы, посты и т.д.
+
+    Ссылки ведут только на строки, созданные в этом же запуске, поэтому
+    методы вызываются в порядке users, groups, posts, follows, comments.
+    """
+
+    def __init__(self, seed=0, batch_size=BATCH_SIZE, days=365):
+        self.rng = random.Random(seed)
+        self.fake = Faker('ru_RU')
+        self.fake.seed_instance(seed)
+        self.batch_size = batch_size
+        self.now = timezone.now()
+        self.start = self.now - timedelta(days=days)
+        self.sentences = [self.fake.sentence() for _ in range(SENTENCES)]
+        self.users = range(0)
+        self.groups = range(0)
+        self.posts = range(0)
+        self.readers = set()
+        self.stats = {}
+
+    def _first_pk(self, model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def _date(self, value):
+        return connection.ops.adapt_datetimefield_value(value)
+
+    def _text(self, mean_sentences):
+        count = 1 + int(self.rng.expovariate(1 / mean_sentences))
+        return ' '.join(self.rng.choices(self.sentences, k=count))
+
+    def _post_date(self, index):
+        """Даты постов равномерно растут вместе с id."""
+        share = (index + 0.5) / len(self.posts)
+        return self.start + (self.now - self.start) * share
+
+    def _run(self, entity, model, fields, rows):
+        stats = self.stats[entity] = Stats()
+        started = time.perf_counter()
+        stats.rows = insert(model, fields, rows, self.batch_size)
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+    def generate_users(self, count):
+        first = self._first_pk(User)
+        self.users = range(first, first + count)
+        password = make_password(None)
+        span = self.now - self.start
+        first_names = [self.fake.first_name() for _ in range(100)]
+        last_names = [self.fake.last_name() for _ in range(100)]
+        rows = (
+            (
+                pk, f'user{pk}', f'user{pk}@example.com',
+                self.rng.choice(first_names), self.rng.choice(last_names),
+                password, False, False, True,
+                self._date(self.start - span * self.rng.random()),
+            )
+            for pk in self.users
+        )
+        return self._run('users', User, (
+            'id', 'username', 'email', 'first_name', 'last_name',
+            'password', 'is_superuser', 'is_staff', 'is_active',
+            'date_joined',
+        ), rows)
+
+    def generate_groups(self, count):
+        first = self._first_pk(Group)
+        self.groups = range(first, first + count)
+        rows = (
+            (
+                pk, self.fake.catch_phrase()[:200], f'group-{pk}',
+                self._text(2), 0,
+            )
+            for pk in self.groups
+        )
+        return self._run('groups', Group, (
+            'id', 'title', 'slug', 'description', 'posts_count',
+        ), rows)
+
+    def generate_posts(self, count, image_share=0.0):
+        if count and not self.users:
+            raise ValueError('посты нужно создавать вместе с пользователями')
+        first = self._first_pk(Post)
+        self.posts = range(first, first + count)
+        author = PowerLaw(len(self.users), AUTHOR_EXPONENT, self.rng)
+        group = None
+        if self.groups:
+            group = PowerLaw(len(self.groups), GROUP_EXPONENT, self.rng)
+        pictures = self.images() if image_share else ()
+        rng = self.rng
+
+        def rows():
+            for index, pk in enumerate(self.posts):
+                group_id = None
+                if group and rng.random() >= GROUPLESS_SHARE:
+                    group_id = self.groups[group()]
+                image = None
+                if pictures and rng.random() < image_share:
+                    image = rng.choice(pictures)
+                yield (
+                    pk, self._text(3), self._date(self._post_date(index)),
+                    self.users[author()], group_id, image, 0,
+                )
+
+        return self._run('posts', Post, (
+            'id', 'text', 'pub_date', 'author', 'group', 'image',
+            'comments_count',
+        ), rows())
+
+    def images(self):
+        """Имена IMAGE_VARIANTS сохранённых в хранилище картинок."""
+        storage = Post._meta.get_field('image').storage
+        names = []
+        for number in range(IMAGE_VARIANTS):
+            colors = [
+                tuple(self.rng.randrange(256) for _ in range(3))
+                for _ in range(2)
+            ]
+            image = Image.new('RGB', POST_IMAGE_SIZE, colors[0])
+            image.paste(colors[1], (0, 0, POST_IMAGE_SIZE[0] // 2,
+                                    POST_IMAGE_SIZE[1]))
+            content = io.BytesIO()
+            image.save(content, 'JPEG', quality=85)
+            names.append(storage.save(
+                f'posts/load-{number}.jpg', ContentFile(content.getvalue())
+            ))
+        return names
+
+    def generate_follows(self, count):
+        """Около count подписок: число подписок на читателя - Парето,
+        авторы выбираются по популярности, поэтому и число подписчиков
+        распределено по степенному закону.
+        """
+        users = len(self.users)
+        if not count or users < 2:
+            self.stats['follows'] = Stats()
+            return self.stats['follows']
+        author = PowerLaw(users, AUTHOR_EXPONENT, self.rng)
+        scale = count / users * (FOLLOW_ALPHA - 1) / FOLLOW_ALPHA
+        rng = self.rng
+
+        def rows():
+            for user_id in self.users:
+                wanted = min(
+                    int(scale * rng.paretovariate(FOLLOW_ALPHA)), users - 1
+                )
+                authors = set()
+                # Популярные авторы выпадают часто - попыток с запасом.
+                for _ in range(wanted * 4):
+                    if len(authors) >= wanted:
+                        break
+                    author_id = self.users[author()]
+                    if author_id != user_id:
+                        authors.add(author_id)
+                if authors:
+                    self.readers.add(user_id)
+                for author_id in sorted(authors):
+                    yield user_id, author_id
+
+        return self._run('follows', Follow, ('user', 'author'), rows())
+
+    def generate_comments(self, count):
+        if count and not (self.posts and self.users):
+            raise ValueError(
+                'комментарии нужно создавать вместе с постами и '
+                'пользователями'
+            )
+        post = PowerLaw(len(self.posts), COMMENTED_POST_EXPONENT, self.rng)
+        author = PowerLaw(len(self.users), COMMENTER_EXPONENT, self.rng)
+        rng = self.rng
+
+        def rows():
+            for _ in range(count):
+                index = post()
+                created = self._post_date(index) + timedelta(
+                    seconds=rng.expovariate(1 / COMMENT_DELAY)
+                )
+                yield (
+                    self.posts[index], self.users[author()],
+                    self._text(1), self._date(min(created, self.now)),
+                )
+
+        return self._run('comments', Comment, (
+            'post', 'author', 'text', 'created',
+        ), rows())
@@ -0,0 +1,72 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from sorl.thumbnail import delete
+
+from posts import page_cache, thumbnail_index, thumbnails, versions
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Переименовывает картинки постов по хешу содержимого '
+        'и объединяет одинаковые файлы'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        dry_run = options['dry_run']
+        names = (
+            Post.objects.exclude(image='').exclude(image__isnull=True)
+            .order_by().values_list('image', flat=True).distinct()
+        )
+        renamed = merged = missing = freed = 0
+        for name in list(names):
+            if storage.is_hashed(name):
+                continue
+            if not storage.exists(name):
+                missing += 1
+                self.stderr.write(f'{name}: файл не найден')
+                continue
+            with storage.open(name) as content:
+                hashed = storage.hashed_name(name, content)
+            duplicate = storage.exists(hashed)
+            if duplicate:
+                merged += 1
+                freed += storage.size(name)
+            else:
+                renamed += 1
+            if dry_run:
+                continue
+            if not duplicate:
+                # Жёсткая ссылка: до обновления строк доступны оба имени.
+                target = storage.path(hashed)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.link(storage.path(name), target)
+            with transaction.atomic():
+                posts = list(
+                    Post.objects.filter(image=name).values_list(
+                        'pk', flat=True
+                    )
+                )
+                Post.objects.filter(pk__in=posts).update(image=hashed)
+            for pk in posts:
+                versions.bump('post', pk)
+            # Миниатюры старого имени удаляются вместе с файлом: и
+            # построенные до хранилища по хешу, и после.
+            delete(thumbnails.source(name), delete_file=False)
+            delete(name)
+        if not dry_run and (renamed or merged):
+            page_cache.bump(page_cache.GLOBAL_SCOPE)
+            thumbnail_index.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Переименовано: {renamed}, объединено дублей: {merged}, '
+            f'не найдено: {missing}, освобождено байт: {freed}'
+        ))
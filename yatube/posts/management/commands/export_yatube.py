@@ -0,0 +1,61 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import exporter
+from posts.importer import parse_date
+
+
+class Command(BaseCommand):
+    help = 'Выгружает посты или комментарии в NDJSON потоком'
+
+    def add_arguments(self, parser):
+        parser.add_argument('entity', choices=sorted(exporter.ENTITIES))
+        parser.add_argument(
+            '--output', '-o', default='-',
+            help='Файл для выгрузки; по умолчанию stdout',
+        )
+        parser.add_argument(
+            '--gzip', action='store_true', help='Сжимать выгрузку gzip',
+        )
+        parser.add_argument(
+            '--since', help='Только строки с датой не раньше этой (ISO 8601)',
+        )
+        parser.add_argument(
+            '--after-id', type=int, default=0,
+            help='Только строки с id больше этого',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=exporter.CHUNK_SIZE,
+            help='Сколько строк читать одним запросом',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        try:
+            if options['since']:
+                since = parse_date(options['since'])
+            export = exporter.Export(
+                options['entity'], since=since, after_id=options['after_id'],
+                chunk_size=options['chunk_size'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        chunks = exporter.encode(export)
+        if options['gzip']:
+            chunks = exporter.gzipped(chunks)
+        if options['output'] == '-':
+            self.write(chunks, sys.stdout.buffer)
+        else:
+            with open(options['output'], 'wb') as output:
+                self.write(chunks, output)
+        # Итог - в stderr, чтобы не смешивать его с данными в stdout.
+        self.stderr.write(
+            f'Выгружено строк: {export.rows}, последний id: '
+            f'{export.last_id}', style_func=self.style.SUCCESS,
+        )
+
+    def write(self, chunks, output):
+        for chunk in chunks:
+            output.write(chunk)
+        output.flush()
@@ -0,0 +1,86 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from posts import importer, search
+from posts.load_data import BATCH_SIZE, Generator
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт большой правдоподобный набор данных для нагрузочных '
+        'тестов: степенные распределения авторов, подписок, групп и '
+        'комментариев, воспроизводимые по --seed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument(
+            '--follows', type=int, default=20000,
+            help='Примерное общее число подписок',
+        )
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument(
+            '--images', type=float, default=0.0, metavar='SHARE',
+            help='Доля постов с картинкой, от 0 до 1',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько последних дней распределены посты',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help='Сколько строк вставлять одной пачкой и транзакцией',
+        )
+        parser.add_argument(
+            '--skip-timelines', action='store_true',
+            help='Не пересобирать ленты подписок (долго на больших данных)',
+        )
+
+    def handle(self, *args, **options):
+        if not 0 <= options['images'] <= 1:
+            raise CommandError('--images - доля от 0 до 1')
+        generator = Generator(
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            days=options['days'],
+        )
+        started = time.perf_counter()
+        steps = (
+            ('users', generator.generate_users, ()),
+            ('groups', generator.generate_groups, ()),
+            ('posts', generator.generate_posts, (options['images'],)),
+            ('follows', generator.generate_follows, ()),
+            ('comments', generator.generate_comments, ()),
+        )
+        try:
+            with search.suspended():
+                for entity, generate, extra in steps:
+                    stats = generate(options[entity], *extra)
+                    self.stdout.write(
+                        f'{entity}: {stats.rows} строк, '
+                        f'{stats.rate:.0f} строк/с'
+                    )
+        except ValueError as error:
+            raise CommandError(error)
+        except IntegrityError as error:
+            # Имена user<id> и group-<id> заняты строками, созданными
+            # не генератором; прежние пачки уже записаны.
+            raise CommandError(
+                f'{entity}: созданные строки совпали с существующими '
+                f'({error}); вставленные до этого пачки остались в базе'
+            )
+        finally:
+            readers = () if options['skip_timelines'] else generator.readers
+            importer.refresh_derived(readers, options['batch_size'])
+        seconds = time.perf_counter() - started
+        rows = sum(stats.rows for stats in generator.stats.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано строк: {rows} за {seconds:.1f} с '
+            f'({rows / seconds:.0f} строк/с), пересобрано лент: '
+            f'{len(readers)}'
+        ))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnail_index, thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Заранее строит миниатюры всех картинок постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Число процессов; 0 - строить в текущем процессе',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=20,
+            help='Сколько картинок отдавать процессу за раз',
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers is None:
+            workers = thumbnails.workers()
+        names = (
+            Post.objects.exclude(image='').exclude(image__isnull=True)
+            .order_by('pk').values_list('image', flat=True).iterator()
+        )
+        if workers:
+            pool = thumbnails.make_pool(workers)
+            results = pool.map(
+                thumbnails.generate, names, chunksize=options['chunk_size']
+            )
+        else:
+            pool = None
+            results = map(thumbnails.generate, names)
+        built = failed = 0
+        try:
+            for name, count, error in results:
+                built += count
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        indexed = thumbnail_index.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Построено миниатюр: {built}, картинок с ошибками: {failed}, '
+            f'записей в индексе: {indexed}'
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+from posts.settings import POST_IMAGE_WIDTHS
+
+
+class Command(BaseCommand):
+    help = (
+        'Сколько байт экономят варианты картинок постов по сравнению '
+        'с единственным JPEG полной ширины'
+    )
+
+    def handle(self, *args, **options):
+        names = (
+            Post.objects.exclude(image='').exclude(image__isnull=True)
+            .values_list('image', flat=True).iterator()
+        )
+        sources, totals = thumbnails.savings(names)
+        baseline = totals.get((None, max(POST_IMAGE_WIDTHS)), 0)
+        self.stdout.write(f'Исходники в media: {sources} байт')
+        self.stdout.write(f'JPEG полной ширины (сейчас): {baseline} байт')
+        for (image_format, width), size in sorted(
+            totals.items(), key=lambda item: (item[0][0] or '', item[0][1])
+        ):
+            saved = baseline - size
+            share = saved * 100 / baseline if baseline else 0
+            self.stdout.write(
+                f'{image_format or "JPEG"} {width}w: {size} байт, '
+                f'экономия {saved} байт ({share:.1f}%)'
+            )
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import importer, search
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает пользователей, группы, посты, комментарии и подписки '
+        'из NDJSON или CSV пачками через bulk_create'
+    )
+
+    def add_arguments(self, parser):
+        for entity in importer.ENTITIES:
+            parser.add_argument(
+                f'--{entity}', metavar='FILE',
+                help=f'Файл {entity} (.csv или NDJSON, "-" - stdin)',
+            )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк вставлять одним запросом и транзакцией',
+        )
+
+    def handle(self, *args, **options):
+        files = [
+            (entity, options[entity]) for entity in importer.ENTITIES
+            if options[entity]
+        ]
+        if not files:
+            raise CommandError('Укажите хотя бы один файл, например --posts')
+        if sum(path == '-' for _, path in files) > 1:
+            raise CommandError('Из stdin можно читать только один файл')
+        loader = importer.Importer(batch_size=options['batch_size'])
+        started = time.perf_counter()
+        dates = (
+            Post._meta.get_field('pub_date'),
+            Comment._meta.get_field('created'),
+        )
+        try:
+            with importer.preserved_dates(*dates), search.suspended():
+                for entity, path in files:
+                    stats = loader.load(entity, importer.read_records(path))
+                    self.stdout.write(
+                        f'{entity}: {stats.rows} строк, пропущено '
+                        f'{stats.skipped}, {stats.rate:.0f} строк/с'
+                    )
+        except (OSError, importer.RecordError) as error:
+            # Записанные пачки остаются в базе - для них тоже нужно
+            # пересчитать счётчики и ленты.
+            loader.finish()
+            raise CommandError(f'{error}; записано до ошибки: '
+                               f'{self.rows(loader)} строк')
+        readers = loader.finish()
+        seconds = time.perf_counter() - started
+        rows = self.rows(loader)
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано строк: {rows} за {seconds:.1f} с '
+            f'({rows / seconds:.0f} строк/с), пересобрано лент: {readers}'
+        ))
+
+    def rows(self, loader):
+        return sum(stats.rows for stats in loader.stats.values())
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import search
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает полнотекстовый индекс постов'
+
+    def handle(self, *args, **options):
+        if not search.fts_available():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite')
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Постов в поисковом индексе: {Post.objects.count()}'
+        ))
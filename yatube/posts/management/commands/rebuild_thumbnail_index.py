@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnail_index
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает индекс миниатюр на диске из хранилища sorl'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=None,
+            help='Куда записать индекс; по умолчанию THUMBNAIL_INDEX_PATH',
+        )
+
+    def handle(self, *args, **options):
+        count = thumbnail_index.rebuild(options['path'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в индексе миниатюр: {count}'
+        ))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+from posts.models import Follow, User
+from posts.settings import TIMELINE_LENGTH
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ленты подписок и обрезает их до заданной длины'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='usernames', default=[],
+            help='Пересобрать ленту только этого пользователя',
+        )
+        parser.add_argument(
+            '--length', type=int, default=TIMELINE_LENGTH,
+            help='Сколько последних постов хранить в ленте',
+        )
+        parser.add_argument(
+            '--trim-only', action='store_true',
+            help='Не пересобирать, только обрезать ленты',
+        )
+
+    def handle(self, *args, **options):
+        length = options['length']
+        if options['trim_only'] and not options['usernames']:
+            trimmed = timeline.trim_all(length)
+            self.stdout.write(self.style.SUCCESS(
+                f'Обрезано лент: {trimmed}'
+            ))
+            return
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+        else:
+            users = User.objects.filter(
+                pk__in=Follow.objects.values('user_id')
+            )
+        processed = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            if options['trim_only']:
+                timeline.trim(user_id, length)
+            else:
+                timeline.rebuild(user_id, length)
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано лент: {processed}'
+        ))
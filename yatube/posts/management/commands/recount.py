@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import recount
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов, подписок и комментариев'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк обновлять в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        updated = recount(batch_size=options['batch_size'])
+        for model, rows in updated.items():
+            self.stdout.write(f'{model}: {rows}')
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
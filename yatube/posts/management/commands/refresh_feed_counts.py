@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import refresh_index_count
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает оценку числа постов главной страницы '
+            '(запускать по расписанию)')
+
+    def handle(self, *args, **options):
+        count = refresh_index_count()
+        self.stdout.write(self.style.SUCCESS(f'Постов на главной: {count}'))
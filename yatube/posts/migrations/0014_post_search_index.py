@@ -0,0 +1,64 @@
+from django.db import migrations
+
+# Полнотекстовый индекс FTS5 по тексту постов (только SQLite). Таблица
+# без содержимого: хранит лишь индекс, rowid - id поста. Текст
+# индексируется с заменой ё на е; регистр unicode61 сворачивает сам.
+NORMALIZED = "replace(replace({}.text, 'ё', 'е'), 'Ё', 'Е')"
+CREATE = [
+    """
+    CREATE VIRTUAL TABLE posts_post_fts USING fts5(
+        text, content='', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER posts_post_fts_insert AFTER INSERT ON posts_post BEGIN
+        INSERT INTO posts_post_fts (rowid, text)
+        VALUES (new.id, {NORMALIZED.format('new')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER posts_post_fts_delete AFTER DELETE ON posts_post BEGIN
+        INSERT INTO posts_post_fts (posts_post_fts, rowid, text)
+        VALUES ('delete', old.id, {NORMALIZED.format('old')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER posts_post_fts_update AFTER UPDATE OF text ON posts_post
+    BEGIN
+        INSERT INTO posts_post_fts (posts_post_fts, rowid, text)
+        VALUES ('delete', old.id, {NORMALIZED.format('old')});
+        INSERT INTO posts_post_fts (rowid, text)
+        VALUES (new.id, {NORMALIZED.format('new')});
+    END
+    """,
+    f"""
+    INSERT INTO posts_post_fts (rowid, text)
+    SELECT id, {NORMALIZED.format('posts_post')} FROM posts_post
+    """,
+]
+DROP = [
+    'DROP TRIGGER IF EXISTS posts_post_fts_update',
+    'DROP TRIGGER IF EXISTS posts_post_fts_delete',
+    'DROP TRIGGER IF EXISTS posts_post_fts_insert',
+    'DROP TABLE IF EXISTS posts_post_fts',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_image_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
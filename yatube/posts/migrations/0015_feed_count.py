@@ -0,0 +1,31 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:20
+
+from django.db import migrations, models
+
+
+def fill_index_count(apps, schema_editor):
+    FeedCount = apps.get_model('posts', 'FeedCount')
+    Post = apps.get_model('posts', 'Post')
+    FeedCount.objects.create(name='index', count=Post.objects.count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_post_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedCount',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Лента')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Количество строк')),
+            ],
+            options={
+                'verbose_name': 'Размер ленты',
+                'verbose_name_plural': 'Размеры лент',
+            },
+        ),
+        migrations.RunPython(fill_index_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_feed_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='pulled_since',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Подтягивается в ленты с'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from posts.storage import ContentAddressedStorage
+
 User = get_user_model()
 
 LENGHT: int = 15
@@ -19,6 +21,11 @@ class Group(models.Model):
     description = models.TextField(
         verbose_name='Описание'
     )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество постов'
+    )
 
     def __str__(self) -> str:
         return self.title
@@ -59,15 +66,31 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True,
         null=True,
         help_text='Загрузите картинку'
     )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество комментариев'
+    )
 
     class Meta:
         ordering = ("-pub_date",)
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text[:LENGHT]
@@ -102,6 +125,12 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(
+                fields=['post', '-created', '-id'],
+                name='comment_post_created_idx'
+            ),
+        ]
 
 
 class Follow(models.Model):
@@ -116,5 +145,104 @@ class Follow(models.Model):
         on_delete=models.CASCADE
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='unique_follow'
+            ),
+        ]
+
     def __str__(self):
         return f"Последователь: '{self.user}', автор: '{self.author}'"
+
+
+class Profile(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='profile',
+        verbose_name='Пользователь'
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество постов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество подписчиков'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество подписок'
+    )
+    # Посты автора с этого момента не раскладывались в ленты подписчиков,
+    # а подтягивались при чтении (см. posts.timeline).
+    pulled_since = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        verbose_name='Подтягивается в ленты с'
+    )
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self):
+        return f"Счётчики '{self.user_id}'"
+
+
+class FeedCount(models.Model):
+    """Число строк ленты, которое дорого считать COUNT(*), например,
+    всех постов главной страницы."""
+    name = models.CharField(
+        max_length=50,
+        primary_key=True,
+        verbose_name='Лента'
+    )
+    count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество строк'
+    )
+
+    class Meta:
+        verbose_name = 'Размер ленты'
+        verbose_name_plural = 'Размеры лент'
+
+    def __str__(self):
+        return f"{self.name}: {self.count}"
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации поста'
+    )
+
+    class Meta:
+        ordering = ('-pub_date', '-post')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_pub_date_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Лента '{self.user_id}': пост {self.post_id}"
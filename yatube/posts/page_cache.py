@@ -0,0 +1,106 @@
+"""Кеш страниц для анонимных посетителей.
+
+Вместо фиксированного TTL ключ страницы включает поколения областей,
+от которых она зависит: общее (all) и свои - index, group:<slug>,
+author:<username>, post:<id> и author_posts:<id автора> (число постов
+автора на странице поста). Сигналы моделей (posts.signals) меняют
+поколения, поэтому страница отдаётся из кеша, пока не изменится то, что
+на ней показано.
+"""
+import hashlib
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from core import metrics
+from posts import versions
+from posts.settings import PAGE_CACHE_TIMEOUT
+
+GLOBAL_SCOPE = 'all'
+
+
+def bump(*scopes):
+    for scope in scopes:
+        versions.bump('page', scope)
+
+
+def post_author_key(post_id):
+    return f'post_author:{post_id}'
+
+
+def remember_post_author(post):
+    """Запоминает автора поста: он нужен ключу страницы ещё до view."""
+    cache.set(post_author_key(post.pk), post.author_id, None)
+
+
+def post_author_scope(post_id):
+    """Область числа постов автора или None, пока автор не запомнен."""
+    author_id = cache.get(post_author_key(post_id))
+    if author_id is None:
+        return None
+    return f'author_posts:{author_id}'
+
+
+def _scopes(scopes, kwargs):
+    resolved = [GLOBAL_SCOPE]
+    for scope in scopes:
+        if callable(scope):
+            scope = scope(**kwargs)
+            if scope is None:
+                return None
+        else:
+            scope = scope.format(**kwargs)
+        resolved.append(scope)
+    return resolved
+
+
+def _page_key(request, scopes):
+    stamps = versions.get_many(
+        [versions.version_key('page', scope) for scope in scopes]
+    )
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    generations = ':'.join(str(stamps[key]) for key in sorted(stamps))
+    return f'page:{path}:{generations}'
+
+
+def cache_anonymous_page(*scopes):
+    """Кеширует ответ view для анонимных GET-запросов.
+
+    scopes - шаблоны областей, заполняемые аргументами view, например
+    'author:{username}', или функции от аргументов view. Если функция
+    вернула None, область ещё неизвестна: страница рендерится заново, а
+    в кеш попадает, только если view успел её определить.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated
+                    or not versions.enabled()):
+                return view(request, *args, **kwargs)
+            resolved = _scopes(scopes, kwargs)
+            key = None
+            if resolved is not None:
+                key = _page_key(request, resolved)
+                cached = cache.get(key)
+                if cached is not None:
+                    metrics.inc('page_cache_hits')
+                    content, content_type = cached
+                    return HttpResponse(content, content_type=content_type)
+            metrics.inc('page_cache_misses')
+            response = view(request, *args, **kwargs)
+            if key is None:
+                resolved = _scopes(scopes, kwargs)
+                if resolved is not None:
+                    key = _page_key(request, resolved)
+            if (key is not None and response.status_code == 200
+                    and not response.streaming):
+                cache.set(
+                    key,
+                    (response.content, response['Content-Type']),
+                    PAGE_CACHE_TIMEOUT,
+                )
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,311 @@
+import base64
+import sys
+from math import ceil
+
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+from posts.settings import (ADMIN_COUNT_LIMIT, LIST_LENGHT,
+                            PAGE_RANGE_ON_EACH_SIDE, PAGE_RANGE_ON_ENDS)
+
+
+# id в курсоре должен поместиться в целое базы данных.
+MAX_CURSOR_PK = 2 ** 63
+
+
+def pack_cursor(key, pk):
+    """Непрозрачный курсор из значения ключа сортировки и id."""
+    raw = f'{key}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def unpack_cursor(token):
+    """Возвращает (ключ строкой, id) или None для пустого/битого курсора."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        key, pk = base64.urlsafe_b64decode(padded).decode().split('|')
+        pk = int(pk)
+    except ValueError:
+        return None
+    if not 0 < pk < MAX_CURSOR_PK:
+        return None
+    return key, pk
+
+
+def encode_cursor(row, keys=('pub_date', 'pk')):
+    """Курсор из пары (дата, id) строки, по умолчанию поста."""
+    date_key, id_key = keys
+    return pack_cursor(
+        getattr(row, date_key).isoformat(), getattr(row, id_key)
+    )
+
+
+def decode_cursor(token):
+    """Возвращает (pub_date, id) или None для пустого/битого курсора."""
+    unpacked = unpack_cursor(token)
+    if unpacked is None:
+        return None
+    stamp, pk = unpacked
+    try:
+        pub_date = parse_datetime(stamp)
+        if pub_date is None:
+            return None
+        # База сравнивает даты в UTC; крайние даты при переводе выходят
+        # за пределы datetime.
+        if timezone.is_naive(pub_date):
+            pub_date = timezone.make_aware(pub_date)
+        pub_date = pub_date.astimezone(timezone.utc)
+    except (OverflowError, ValueError):
+        return None
+    return pub_date, pk
+
+
+ELLIPSIS = '…'
+
+
+def elided_page_range(number, num_pages, on_each_side=PAGE_RANGE_ON_EACH_SIDE,
+                      on_ends=PAGE_RANGE_ON_ENDS):
+    """Номера страниц: края и окно вокруг текущей, пропуски - ELLIPSIS.
+
+    Длина не зависит от числа страниц, в отличие от page_range.
+    """
+    if num_pages <= (on_each_side + on_ends) * 2:
+        yield from range(1, num_pages + 1)
+        return
+    if number > (1 + on_each_side + on_ends) + 1:
+        yield from range(1, on_ends + 1)
+        yield ELLIPSIS
+        yield from range(number - on_each_side, number + 1)
+    else:
+        yield from range(1, number + 1)
+    if number < (num_pages - on_each_side - on_ends) - 1:
+        yield from range(number + 1, number + on_each_side + 1)
+        yield ELLIPSIS
+        yield from range(num_pages - on_ends + 1, num_pages + 1)
+    else:
+        yield from range(number + 1, num_pages + 1)
+
+
+def keyset_filter(queryset, cursor, newer=False, keys=('pub_date', 'pk')):
+    """Строки строго старее (или новее) курсора в порядке обхода.
+
+    Старее - от новых к старым, новее - от старых к новым.
+    """
+    date_key, id_key = keys
+    if newer:
+        ordering = (date_key, id_key)
+        lookup = 'gt'
+    else:
+        ordering = (f'-{date_key}', f'-{id_key}')
+        lookup = 'lt'
+    queryset = queryset.order_by(*ordering)
+    if cursor is None:
+        return queryset
+    pub_date, pk = cursor
+    # Нестрогое условие по дате даёт планировщику границу диапазона
+    # индекса, OR уточняет её по id.
+    return queryset.filter(
+        Q(**{f'{date_key}__{lookup}e': pub_date}),
+        Q(**{f'{date_key}__{lookup}': pub_date})
+        | Q(**{f'{id_key}__{lookup}': pk}),
+    )
+
+
+class KeysetPaginator(Paginator):
+    """Пагинация по ключу (pub_date, id) без COUNT(*) и OFFSET.
+
+    Страница выбирается курсором after (старее) или before (новее),
+    поэтому глубокая страница стоит столько же, сколько первая.
+    Номер страницы условный: 1 - начало ленты, 2 - любая страница
+    глубже; num_pages знает только, есть ли страница дальше.
+    keys - поля даты и id, например ('created', 'pk') для комментариев.
+    """
+    keyset = True
+
+    def __init__(self, object_list, per_page, after=None, before=None,
+                 keys=('pub_date', 'pk')):
+        super().__init__(object_list, per_page)
+        self.keys = keys
+        self.after = self.decode(after)
+        self.before = None if self.after else self.decode(before)
+        self.next_cursor = None
+        self.previous_cursor = None
+        self._num_pages = 1
+
+    @property
+    def num_pages(self):
+        return self._num_pages
+
+    def encode(self, row):
+        return encode_cursor(row, self.keys)
+
+    def decode(self, token):
+        return decode_cursor(token)
+
+    def fetch(self, cursor, newer, limit):
+        """Не больше limit строк за курсором в порядке keyset_filter."""
+        return list(
+            keyset_filter(self.object_list, cursor, newer, self.keys)[:limit]
+        )
+
+    def get_page(self, number=None):
+        """Номер игнорируется: страницу задают курсоры из __init__."""
+        if self.before:
+            rows = self.fetch(self.before, True, self.per_page + 1)
+            if len(rows) <= self.per_page:
+                # Новее только начало ленты - отдаём его целиком.
+                self.before = None
+                return self.get_page()
+            rows = rows[:self.per_page][::-1]
+            has_newer, has_older = True, True
+        else:
+            rows = self.fetch(self.after, False, self.per_page + 1)
+            has_newer = self.after is not None
+            has_older = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+        if rows and has_newer:
+            self.previous_cursor = self.encode(rows[0])
+        if rows and has_older:
+            self.next_cursor = self.encode(rows[-1])
+        number = 2 if has_newer else 1
+        self._num_pages = number + 1 if has_older else number
+        return Page(rows, number, self)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Постраничная пагинация без COUNT(*) по всей выборке.
+
+    count - готовое число строк (поддерживаемый счётчик или кешированная
+    оценка). Без него пагинатор только проверяет, есть ли следующая
+    страница, выбирая per_page + 1 строк. Оценка нужна лишь для ссылки
+    на последнюю страницу: наличие следующей страницы проверяется всегда.
+    """
+
+    def __init__(self, object_list, per_page, count=None, orphans=0,
+                 allow_empty_first_page=True):
+        super().__init__(object_list, per_page, orphans,
+                         allow_empty_first_page)
+        self.estimated_count = count
+        self.count_known = count is not None
+        self._num_pages = None
+
+    @property
+    def count(self):
+        return self.estimated_count
+
+    def _estimated_pages(self):
+        if not self.estimated_count:
+            return 1
+        hits = max(1, self.estimated_count - self.orphans)
+        return ceil(hits / self.per_page)
+
+    @property
+    def num_pages(self):
+        if self._num_pages is None:
+            return self._estimated_pages()
+        return self._num_pages
+
+    def validate_number(self, number):
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        # Смещение страницы должно поместиться в целое базы данных.
+        if number > (sys.maxsize - 1) // self.per_page:
+            raise EmptyPage(_('That page contains no results'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        if len(rows) > self.per_page:
+            self._num_pages = max(self._estimated_pages(), number + 1)
+        else:
+            self._num_pages = number
+            if not self.count_known:
+                self.estimated_count = bottom + len(rows)
+        return self._get_page(rows[:self.per_page], number, self)
+
+    def get_page(self, number):
+        try:
+            return self.page(number)
+        except PageNotAnInteger:
+            return self.page(1)
+        except EmptyPage:
+            pass
+        try:
+            return self.page(self._estimated_pages())
+        except EmptyPage:
+            return self.page(1)
+
+
+class AtLeast(int):
+    """Число строк, подсчитанное до предела: в шаблоне выводится как 10000+."""
+
+    def __str__(self):
+        return f'{int(self)}+'
+
+
+class AdminPaginator(Paginator):
+    """Пагинатор списков админки без COUNT(*) по всей таблице.
+
+    Для выборки без фильтров и поиска число строк берётся из estimate
+    (функция, например оценка из счётчика), иначе считается не больше
+    limit строк: если их больше, count - AtLeast(limit), и дальше
+    limit-й строки список не листается.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0,
+                 allow_empty_first_page=True, estimate=None, limit=None):
+        super().__init__(object_list, per_page, orphans,
+                         allow_empty_first_page)
+        self.estimate = estimate
+        self.limit = ADMIN_COUNT_LIMIT if limit is None else limit
+
+    @cached_property
+    def count(self):
+        if self.estimate is not None and not self.object_list.query.where:
+            estimated = self.estimate()
+            if estimated is not None:
+                return estimated
+        counted = self.object_list.order_by()[:self.limit + 1].count()
+        if counted > self.limit:
+            return AtLeast(self.limit)
+        return counted
+
+
+def paginate(request, queryset, per_page=LIST_LENGHT,
+             paginator_class=KeysetPaginator, count=None, **kwargs):
+    """Страница ленты для запроса.
+
+    По умолчанию - курсорная пагинация; ?page=N оставлен для старых
+    ссылок и обслуживается EstimatedCountPaginator с числом строк count
+    (число или функция; None - без подсчёта, только проверка следующей
+    страницы).
+    """
+    if 'page' in request.GET:
+        if callable(count):
+            count = count()
+        paginator = EstimatedCountPaginator(queryset, per_page, count=count)
+        return paginator.get_page(request.GET.get('page'))
+    paginator = paginator_class(
+        queryset,
+        per_page,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        **kwargs
+    )
+    return paginator.get_page()
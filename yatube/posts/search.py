@@ -0,0 +1,206 @@
+"""Полнотекстовый поиск по постам.
+
+Индекс - таблица FTS5 posts_post_fts (миграция 0014), её синхронизируют
+триггеры на posts_post, так что любые вставки, правки и удаления, в
+том числе массовые, попадают в индекс в той же транзакции. Русской
+морфологии в FTS5 нет, поэтому слова запроса обрезаются до основы
+лёгким стеммером и ищутся по префиксу: «котами» найдёт «кот» и «коты».
+Результаты упорядочены по bm25 (меньше - лучше), затем по id.
+На базах, отличных от SQLite, поиск сводится к icontains без ранжирования.
+"""
+import math
+import re
+from contextlib import contextmanager
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from posts.models import Post
+from posts.paginators import KeysetPaginator, pack_cursor, unpack_cursor
+
+FTS_TABLE = 'posts_post_fts'
+# Текст поста в том виде, в каком он попадает в индекс.
+INDEXED_TEXT = "replace(replace({}.text, 'ё', 'е'), 'Ё', 'Е')"
+# Триггеры синхронизации индекса - те же, что создаёт миграция 0014.
+TRIGGERS = {
+    'posts_post_fts_insert': f'''
+        CREATE TRIGGER posts_post_fts_insert AFTER INSERT ON posts_post
+        BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, text)
+            VALUES (new.id, {INDEXED_TEXT.format('new')});
+        END''',
+    'posts_post_fts_delete': f'''
+        CREATE TRIGGER posts_post_fts_delete AFTER DELETE ON posts_post
+        BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, text)
+            VALUES ('delete', old.id, {INDEXED_TEXT.format('old')});
+        END''',
+    'posts_post_fts_update': f'''
+        CREATE TRIGGER posts_post_fts_update AFTER UPDATE OF text
+        ON posts_post BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, text)
+            VALUES ('delete', old.id, {INDEXED_TEXT.format('old')});
+            INSERT INTO {FTS_TABLE} (rowid, text)
+            VALUES (new.id, {INDEXED_TEXT.format('new')});
+        END''',
+}
+# Не больше стольких слов запроса уходит в индекс.
+MAX_TERMS = 10
+# Короче этого основа не обрезается: «дом» не должен стать «до».
+MIN_STEM = 3
+WORD = re.compile(r'\w+')
+CYRILLIC = re.compile(r'^[а-я]+$')
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ость', 'ости', 'ться', 'ешь', 'ишь', 'ете', 'ите', 'ала', 'ила',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ию', 'ью', 'ия', 'ья', 'ть', 'ет',
+    'ут', 'ют', 'ит', 'ат', 'ят', 'ла', 'ло', 'ли',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+
+
+def normalize(text):
+    """Приводит текст к виду, в котором он лежит в индексе."""
+    return text.lower().replace('ё', 'е')
+
+
+def stem(word):
+    """Основа русского слова; остальные слова не меняются."""
+    if not CYRILLIC.match(word):
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def terms(query):
+    return [stem(word) for word in WORD.findall(normalize(query))][:MAX_TERMS]
+
+
+def match_expression(query):
+    """Запрос MATCH: все слова по префиксу; синтаксис FTS5 экранирован."""
+    return ' '.join(f'"{term}"*' for term in terms(query))
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def find(query, queryset=None):
+    """Посты, подходящие под запрос, с рангом rank (меньше - лучше)."""
+    if queryset is None:
+        queryset = Post.objects.all()
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none().annotate(
+            rank=Value(0.0, output_field=FloatField())
+        )
+    if not fts_available():
+        condition = Q()
+        for word in WORD.findall(query)[:MAX_TERMS]:
+            condition &= Q(text__icontains=word)
+        return queryset.filter(condition).annotate(
+            rank=Value(0.0, output_field=FloatField())
+        )
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[
+            f'{FTS_TABLE}.rowid = {Post._meta.db_table}.id',
+            f'{FTS_TABLE} MATCH %s',
+        ],
+        params=[expression],
+    ).annotate(
+        rank=RawSQL(f'bm25({FTS_TABLE})', (), output_field=FloatField())
+    )
+
+
+def filter_matching(queryset, query):
+    """Только подходящие под запрос посты, без ранга и своего порядка."""
+    expression = match_expression(query)
+    if not expression or not fts_available():
+        return queryset.filter(pk__in=find(query).values('pk'))
+    # RawSQL в pk__in Django оборачивает в лишние скобки, и SQLite
+    # видит скалярный подзапрос, поэтому условие пишется целиком.
+    return queryset.extra(
+        where=[
+            f'{Post._meta.db_table}.id IN (SELECT rowid FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s)'
+        ],
+        params=[expression],
+    )
+
+
+def rebuild():
+    """Заново строит индекс по posts_post (после ручных правок базы)."""
+    if not fts_available():
+        return
+    table = Post._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) "
+                       "VALUES ('delete-all')")
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) '
+            f'SELECT id, {INDEXED_TEXT.format(table)} FROM {table}'
+        )
+
+
+@contextmanager
+def suspended():
+    """Отключает триггеры индекса на время массовой записи постов.
+
+    Вставка пачкой без триггеров заметно быстрее; на выходе триггеры
+    создаются снова, а индекс пересобирается целиком.
+    """
+    if not fts_available():
+        yield
+        return
+    with connection.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for sql in TRIGGERS.values():
+                cursor.execute(sql)
+        rebuild()
+
+
+class SearchPaginator(KeysetPaginator):
+    """Курсорная пагинация результатов find по ключу (rank, id).
+
+    Вперёд - от лучших к худшим, при равном ранге от новых id к старым.
+    """
+
+    def encode(self, row):
+        return pack_cursor(repr(row.rank), row.pk)
+
+    def decode(self, token):
+        unpacked = unpack_cursor(token)
+        if unpacked is None:
+            return None
+        rank, pk = unpacked
+        try:
+            rank = float(rank)
+        except ValueError:
+            return None
+        if not math.isfinite(rank):
+            return None
+        return rank, pk
+
+    def fetch(self, cursor, newer, limit):
+        if newer:
+            ordering, rank_lookup, pk_lookup = ('-rank', 'pk'), 'lt', 'gt'
+        else:
+            ordering, rank_lookup, pk_lookup = ('rank', '-pk'), 'gt', 'lt'
+        queryset = self.object_list.order_by(*ordering)
+        if cursor is not None:
+            rank, pk = cursor
+            queryset = queryset.filter(
+                Q(**{f'rank__{rank_lookup}': rank})
+                | Q(rank=rank, **{f'pk__{pk_lookup}': pk})
+            )
+        return list(queryset[:limit])
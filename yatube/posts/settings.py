@@ -4,3 +4,46 @@ LIST_LENGHT: int = 10
 
 SECOND_PAGE_POST: int = 3
 ALL_PAGES = LIST_LENGHT + SECOND_PAGE_POST
+COMMENTS_PER_PAGE: int = 20
+# Сколько номеров страниц показывать вокруг текущей и по краям.
+PAGE_RANGE_ON_EACH_SIDE: int = 3
+PAGE_RANGE_ON_ENDS: int = 2
+# Больше стольких строк списки админки с фильтрами не пересчитывают.
+ADMIN_COUNT_LIMIT: int = 10000
+
+# Сколько последних постов хранится в материализованной ленте подписок.
+TIMELINE_LENGTH: int = 1000
+# Размер пачки при массовой записи в ленты.
+TIMELINE_BATCH_SIZE: int = 500
+# Авторы с большим числом подписчиков не раскладываются в ленты,
+# а подтягиваются при чтении; переопределяется в settings проекта.
+TIMELINE_PULL_THRESHOLD: int = 10000
+# Сколько секунд кешируется список подтягиваемых авторов.
+PULLED_AUTHORS_TTL: int = 300
+# Шаблон и время жизни кешированной карточки поста, секунды.
+POST_CARD_TEMPLATE = 'posts/includes/post_card.html'
+POST_CARD_TIMEOUT: int = 60 * 60 * 24
+# Страховочный срок жизни страницы в кеше анонимных страниц, секунды.
+PAGE_CACHE_TIMEOUT: int = 60 * 60
+# Картинка поста: полный размер, ширины для srcset и параметры sorl.
+POST_IMAGE_SIZE = (960, 339)
+POST_IMAGE_WIDTHS = (480, 720, 960)
+POST_IMAGE_OPTIONS = {'crop': 'center', 'upscale': True}
+# Современные форматы в порядке предпочтения в <picture>; те, что не
+# умеет сохранять Pillow или sorl, пропускаются. Запасной формат - JPEG.
+POST_IMAGE_FORMATS = ('AVIF', 'WEBP')
+# Ограничения загружаемой картинки: байты и пиксели проверяются по мере
+# загрузки (posts.uploads), до большей стороны оригинал уменьшается при
+# построении миниатюр; POST_IMAGE_STREAMING_UPLOADS = False возвращает
+# стандартные обработчики загрузки Django.
+POST_IMAGE_MAX_BYTES: int = 20 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS: int = 40 * 10 ** 6
+POST_IMAGE_MAX_SIDE: int = 2560
+POST_IMAGE_STREAMING_UPLOADS = True
+# Атрибут sizes: на широком экране картинка занимает колонку в 960px.
+POST_IMAGE_SIZES = '(min-width: 992px) 960px, 100vw'
+# Число процессов, строящих миниатюры; 0 - строить в текущем процессе.
+THUMBNAIL_WORKERS: int = 2
+# Как часто, в секундах, процесс проверяет, не пересобран ли индекс
+# миниатюр на диске (posts.thumbnail_index).
+THUMBNAIL_INDEX_CHECK_INTERVAL: float = 1.0
@@ -0,0 +1,170 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from posts import page_cache, thumbnails, timeline, versions
+from posts.counters import shift, shift_index_count
+from posts.models import Comment, Follow, Group, Post, Profile, User
+
+
+@receiver(post_save, sender=User)
+def create_profile(sender, instance, created, **kwargs):
+    if created:
+        Profile.objects.get_or_create(user=instance)
+
+
+@receiver(post_init, sender=Post)
+def remember_group(sender, instance, **kwargs):
+    instance._saved_group_id = instance.group_id
+
+
+@receiver(post_init, sender=Post)
+def remember_image(sender, instance, **kwargs):
+    # Через __dict__, чтобы не загружать отложенное поле лишним запросом.
+    value = instance.__dict__.get('image')
+    instance._saved_image = getattr(value, 'name', value) or None
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    if created:
+        shift_index_count(1)
+        shift(Profile, instance.author_id, 'posts_count', 1)
+        shift(Group, instance.group_id, 'posts_count', 1)
+    elif instance._saved_group_id != instance.group_id:
+        shift(Group, instance._saved_group_id, 'posts_count', -1)
+        shift(Group, instance.group_id, 'posts_count', 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    shift_index_count(-1)
+    shift(Profile, instance.author_id, 'posts_count', -1)
+    shift(Group, instance.group_id, 'posts_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    if created:
+        shift(Post, instance.post_id, 'comments_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    shift(Post, instance.post_id, 'comments_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_saved_follow(sender, instance, created, **kwargs):
+    if created:
+        shift(Profile, instance.user_id, 'following_count', 1)
+        shift(Profile, instance.author_id, 'followers_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    shift(Profile, instance.user_id, 'following_count', -1)
+    shift(Profile, instance.author_id, 'followers_count', -1)
+
+
+@receiver(post_save, sender=Post)
+def push_to_timelines(sender, instance, created, **kwargs):
+    if created and instance.author_id:
+        timeline.push_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def purge_timeline(sender, instance, **kwargs):
+    timeline.purge(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_post_cards(sender, instance, **kwargs):
+    versions.bump('post', instance.pk)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def bump_group_cards(sender, instance, **kwargs):
+    versions.bump('group', instance.pk)
+
+
+@receiver(post_save, sender=User)
+def bump_author_cards(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    versions.bump('user', instance.pk)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_post_pages(sender, instance, signal, created=False, **kwargs):
+    scopes = ['index', f'post:{instance.pk}']
+    if instance.author_id:
+        scopes.append(f'author:{instance.author.username}')
+        if created or signal is post_delete:
+            # Число постов автора показано на страницах всех его постов.
+            scopes.append(f'author_posts:{instance.author_id}')
+    group_ids = {instance.group_id, instance._saved_group_id} - {None}
+    if group_ids:
+        slugs = Group.objects.filter(pk__in=group_ids).values_list(
+            'slug', flat=True
+        )
+        scopes.extend(f'group:{slug}' for slug in slugs)
+    page_cache.bump(*scopes)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_comment_pages(sender, instance, **kwargs):
+    page_cache.bump(f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_follow_pages(sender, instance, **kwargs):
+    page_cache.bump(
+        f'author:{instance.user.username}',
+        f'author:{instance.author.username}',
+    )
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=User)
+def bump_all_pages(sender, instance, created=False, **kwargs):
+    if not created:
+        page_cache.bump(page_cache.GLOBAL_SCOPE)
+
+
+@receiver(post_save, sender=User)
+def bump_pages_for_user(sender, instance, created, update_fields=None,
+                        **kwargs):
+    if created or (update_fields and set(update_fields) == {'last_login'}):
+        return
+    page_cache.bump(page_cache.GLOBAL_SCOPE)
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, created, **kwargs):
+    if not created and instance._saved_image != (instance.image.name or None):
+        thumbnails.release(instance._saved_image)
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    thumbnails.release(instance.image.name)
+
+
+# Подключается последним: обработчики выше видят прежние группу
+# и картинку поста.
+@receiver(post_save, sender=Post)
+def remember_saved_values(sender, instance, **kwargs):
+    instance._saved_group_id = instance.group_id
+    instance._saved_image = instance.image.name or None
@@ -0,0 +1,66 @@
+"""Хранилище картинок постов с адресацией по содержимому.
+
+Файл сохраняется под именем из SHA-256 своего содержимого внутри каталога
+upload_to: posts/ab/cd/abcd...ef.jpg. Одна и та же картинка, загруженная
+разными пользователями, хранится один раз, а раз имя у неё одно, то и
+миниатюры sorl у всех её постов общие. Файл удаляется, когда на него
+больше не ссылается ни один пост (см. posts.thumbnails.release).
+
+Сохранение, которое нашло готовый файл, проверяет его ещё раз после
+коммита и при необходимости записывает заново: иначе release() другого
+поста мог бы удалить файл между проверкой ссылок и коммитом нового
+поста. Поэтому картинки сохраняются внутри transaction.atomic.
+"""
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def hashed_name(self, name, content):
+        """Имя файла по его содержимому в каталоге исходного имени."""
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        hexdigest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(
+            posixpath.dirname(name), hexdigest[:2], hexdigest[2:4],
+            hexdigest + extension,
+        )
+
+    def is_hashed(self, name):
+        return bool(HASHED_NAME.search(name))
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            # Файл может удалить release() прежнего владельца, пока
+            # ссылка на него ещё не в базе: после коммита он проверяется.
+            transaction.on_commit(lambda: self.restore(name, content))
+            return name
+        # При одновременной загрузке одинаковых файлов проигравший
+        # получит имя с суффиксом; dedupe_media потом их объединит.
+        return self._save(name, content)
+
+    def restore(self, name, content):
+        """Записывает content под именем name заново, если файла нет."""
+        if self.exists(name):
+            return
+        content.seek(0)
+        self._save(name, content)
@@ -0,0 +1,12 @@
+from django import template
+
+from posts.paginators import elided_page_range as _elided_page_range
+
+register = template.Library()
+
+
+@register.filter
+def elided_page_range(page_obj):
+    return list(_elided_page_range(
+        page_obj.number, page_obj.paginator.num_pages
+    ))
@@ -0,0 +1,17 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts import cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def prefetch_post_cards(posts):
+    """{% prefetch_post_cards page_obj as cards %} перед циклом по ленте."""
+    return cards.lookup(posts)
+
+
+@register.simple_tag
+def post_card(post, prefetched=None):
+    return mark_safe(cards.render(post, prefetched))
@@ -0,0 +1,11 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/includes/picture.html')
+def post_picture(image):
+    """{% post_picture post.image %} - <picture> с вариантами по ширине."""
+    return {'picture': thumbnails.picture(image)}
@@ -1,7 +1,19 @@
+import os
+import shutil
+import tempfile
 from http import HTTPStatus
-from django.test import Client, TestCase
+from io import BytesIO
+from unittest import mock
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template.defaultfilters import filesizeformat
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
+from posts import thumbnails
 from posts.models import Group, Post, User
+from posts.uploads import upload_dir
 
 
 class PostFormTests(TestCase):
@@ -88,3 +100,101 @@ class PostFormTests(TestCase):
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertEqual(Post.objects.first().text, 'form_text')
         self.assertEqual(Post.objects.first().group, self.group2)
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageUploadTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='uploader')
+        self.client.force_login(self.user)
+
+    def jpeg(self, size, name='photo.jpg'):
+        content = BytesIO()
+        Image.new('RGB', size, 'red').save(content, format='JPEG')
+        return SimpleUploadedFile(
+            name, content.getvalue(), content_type='image/jpeg')
+
+    def create(self, image):
+        return self.client.post(
+            reverse('posts:post_create'), {'text': 'Фото', 'image': image})
+
+    def leftovers(self):
+        return [name for name in os.listdir(upload_dir())
+                if name.endswith('.upload.jpg')]
+
+    @override_settings(POST_IMAGE_MAX_BYTES=1000)
+    def test_too_many_bytes(self):
+        response = self.create(self.jpeg((300, 300)))
+        self.assertFormError(
+            response, 'form', 'image', f'Файл больше {filesizeformat(1000)}.')
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(self.leftovers(), [])
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=10 ** 6)
+    def test_too_many_pixels(self):
+        response = self.create(self.jpeg((1001, 1000)))
+        self.assertFormError(
+            response, 'form', 'image', 'Картинка больше 1 мегапикселей.')
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100, THUMBNAIL_WORKERS=0)
+    def test_oversized_original_is_downsampled_in_background(self):
+        """Запрос не декодирует картинку, оригинал уменьшают миниатюры"""
+        with mock.patch.object(
+                thumbnails.transaction, 'on_commit') as on_commit:
+            self.create(self.jpeg((400, 300)))
+            original = Post.objects.get().image
+            with Image.open(original.path) as saved:
+                self.assertEqual(saved.size, (400, 300))
+            build_thumbnails, = on_commit.call_args[0]
+            on_commit.reset_mock()
+            build_thumbnails()
+            # Старый файл удаляется после коммита перевода постов.
+            for call in on_commit.call_args_list:
+                call[0][0]()
+        image = Post.objects.get().image
+        self.assertNotEqual(image.name, original.name)
+        with open(image.path, 'rb') as saved:
+            # Имя по-прежнему соответствует содержимому.
+            self.assertEqual(
+                image.storage.hashed_name('posts/photo.jpg', File(saved)),
+                image.name)
+        with Image.open(image.path) as saved:
+            self.assertEqual(saved.size, (100, 75))
+        self.assertFalse(os.path.exists(original.path))
+        self.assertEqual(self.leftovers(), [])
+        self.assertEqual(
+            [name for name in os.listdir(os.path.dirname(image.path))
+             if name.startswith('.')], [])
+        with mock.patch.object(thumbnails.transaction, 'on_commit'):
+            self.create(self.jpeg((400, 300)))
+        again = Post.objects.latest('pk').image
+        self.assertEqual(again.name, original.name)
+        with Image.open(again.path) as saved:
+            self.assertEqual(saved.size, (400, 300))
+
+    def test_post_edit_replaces_image(self):
+        post = Post.objects.create(author=self.user, text='Без картинки')
+        self.client.post(
+            reverse('posts:post_edit', args=[post.pk]),
+            {'text': 'С картинкой', 'image': self.jpeg((20, 10))})
+        post.refresh_from_db()
+        with Image.open(post.image.path) as saved:
+            self.assertEqual(saved.size, (20, 10))
+
+    def test_csrf_is_still_checked(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post(
+            reverse('posts:post_create'),
+            {'text': 'Фото', 'image': self.jpeg((20, 10))})
+        self.assertTemplateUsed(response, 'core/403csrf.html')
+        self.assertFalse(Post.objects.exists())
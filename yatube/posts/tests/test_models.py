@@ -1,5 +1,24 @@
-from django.test import TestCase
-from posts.models import Group, Post, User
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+from unittest import mock
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from posts.models import (Comment, Follow, Group, Post, Profile,
+                          TimelineEntry, User)
+from posts import counters, search, thumbnails
+from posts.paginators import keyset_filter
 
 
 class PostModelTest(TestCase):
@@ -70,3 +89,398 @@ class GroupModelTest(TestCase):
         group = GroupModelTest.group
         expected_object_name = group.title
         self.assertEqual(expected_object_name, str(group))
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание')
+        self.other_group = Group.objects.create(
+            title='Другая', slug='other', description='Описание')
+
+    def _profile(self, user):
+        return Profile.objects.get(user=user)
+
+    def test_post_counters(self):
+        """Посты считаются у автора и группы, в т.ч. при смене группы"""
+        post = Post.objects.create(
+            author=self.author, group=self.group, text='Пост')
+        self.assertEqual(self._profile(self.author).posts_count, 1)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
+        post.group = self.other_group
+        post.save()
+        self.group.refresh_from_db()
+        self.other_group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.other_group.posts_count, 1)
+        post.delete()
+        self.other_group.refresh_from_db()
+        self.assertEqual(self.other_group.posts_count, 0)
+        self.assertEqual(self._profile(self.author).posts_count, 0)
+
+    def test_comment_and_follow_counters(self):
+        """Комментарии и подписки меняют счётчики"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий')
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self._profile(self.author).followers_count, 1)
+        self.assertEqual(self._profile(self.reader).following_count, 1)
+        Follow.objects.filter(user=self.reader).delete()
+        self.assertEqual(self._profile(self.author).followers_count, 0)
+        self.assertEqual(self._profile(self.reader).following_count, 0)
+
+    def test_recount_repairs_drift(self):
+        """Команда recount чинит разошедшиеся счётчики"""
+        Post.objects.create(author=self.author, group=self.group, text='1')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Profile.objects.update(posts_count=7, followers_count=7)
+        Group.objects.update(posts_count=7)
+        Profile.objects.filter(user=self.reader).delete()
+        call_command('recount', batch_size=1, stdout=StringIO())
+        self.assertEqual(self._profile(self.author).posts_count, 1)
+        self.assertEqual(self._profile(self.author).followers_count, 1)
+        self.assertEqual(self._profile(self.reader).following_count, 1)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN')
+class FeedQueryPlanTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='planner')
+        cls.group = Group.objects.create(
+            title='Группа', slug='plan', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.user, group=cls.group, text='Пост')
+
+    def _plan(self, queryset):
+        sql, params = queryset.query.get_compiler(
+            using=queryset.db).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_feeds_use_index_range_scan(self):
+        """Ленты читаются диапазоном индекса без сортировки"""
+        cursor = (timezone.now(), self.post.pk)
+        feeds = {
+            'posts_post_pub_date': Post.objects.select_related(
+                'author', 'group'),
+            'post_author_pub_date_idx': self.user.posts.all(),
+            'post_group_pub_date_idx': self.group.posts.all(),
+            'timeline_user_pub_date_idx': self.user.timeline.all(),
+        }
+        for index, queryset in feeds.items():
+            keys = ('pub_date', 'pk')
+            if index.startswith('timeline'):
+                keys = ('pub_date', 'post_id')
+            with self.subTest(index=index):
+                plan = self._plan(
+                    keyset_filter(queryset, cursor, keys=keys)[:11])
+                self.assertTrue(plan[0].startswith('SEARCH'), plan)
+                self.assertIn(index, plan[0])
+                self.assertIn('pub_date<?', plan[0])
+                self.assertFalse(
+                    any('TEMP B-TREE' in line for line in plan), plan)
+
+    def test_comments_use_index(self):
+        """Комментарии поста читаются по индексу (post, -created)"""
+        plan = self._plan(self.post.comments.all()[:11])
+        self.assertIn('comment_post_created_idx', plan[0])
+        self.assertFalse(any('TEMP B-TREE' in line for line in plan), plan)
+
+    def test_follow_is_unique(self):
+        """Повторная подписка на того же автора запрещена"""
+        author = User.objects.create_user(username='plan_author')
+        Follow.objects.create(user=self.user, author=author)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.user, author=author)
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@mock.patch.object(thumbnails.transaction, 'on_commit',
+                   lambda callback: callback())
+class ContentAddressedStorageTest(TestCase):
+    IMAGE = (
+        b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00'
+        b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00\x00\x00\x00\x2C\x00\x00\x00\x00'
+        b'\x01\x00\x01\x00\x00\x02\x02\x44\x01\x00\x3B'
+    )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='reposter')
+        self.storage = Post._meta.get_field('image').storage
+
+    def post(self, name='meme.gif', content=IMAGE):
+        return Post.objects.create(
+            author=self.author, text=name,
+            image=SimpleUploadedFile(name, content, 'image/gif'))
+
+    def test_same_content_is_stored_once(self):
+        first = self.post('meme.gif')
+        second = self.post('repost.GIF')
+        digest = hashlib.sha256(self.IMAGE).hexdigest()
+        self.assertEqual(
+            first.image.name,
+            f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(
+            os.listdir(os.path.dirname(first.image.path)),
+            [f'{digest}.gif'])
+
+    def test_file_is_deleted_with_last_reference(self):
+        first = self.post()
+        second = self.post()
+        path = first.image.path
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_upload_during_release_keeps_file(self):
+        first = self.post()
+        path = first.image.path
+        # Загрузка того же файла нашла его до удаления, а в базу попала
+        # после проверки ссылок.
+        with mock.patch.object(thumbnails.transaction, 'on_commit') as later:
+            second = self.post('again.gif')
+        self.assertEqual(second.image.name, first.image.name)
+        with mock.patch.object(thumbnails, '_referenced', return_value=False):
+            first.delete()
+        self.assertFalse(os.path.exists(path))
+        for call in later.call_args_list:
+            call[0][0]()
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), self.IMAGE)
+        self.assertEqual(os.listdir(os.path.dirname(path)),
+                         [os.path.basename(path)])
+
+    def test_replaced_image_is_released(self):
+        post = self.post()
+        path = post.image.path
+        post.image = SimpleUploadedFile(
+            'other.gif', self.IMAGE + b'\x00', 'image/gif')
+        post.save()
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(post.image.path))
+
+    def test_dedupe_media(self):
+        legacy = FileSystemStorage()
+        names = [
+            legacy.save('posts/a.gif', ContentFile(self.IMAGE)),
+            legacy.save('posts/b.gif', ContentFile(self.IMAGE)),
+            legacy.save('posts/c.gif', ContentFile(self.IMAGE + b'\x00')),
+        ]
+        posts = []
+        for name in names:
+            post = Post.objects.create(author=self.author, text=name)
+            Post.objects.filter(pk=post.pk).update(image=name)
+            posts.append(post)
+        out = StringIO()
+        call_command('dedupe_media', stdout=out)
+        self.assertIn(
+            'Переименовано: 2, объединено дублей: 1, не найдено: 0, '
+            f'освобождено байт: {len(self.IMAGE)}', out.getvalue())
+        images = [Post.objects.get(pk=post.pk).image for post in posts]
+        self.assertEqual(images[0].name, images[1].name)
+        self.assertNotEqual(images[0].name, images[2].name)
+        for image in images:
+            self.assertTrue(self.storage.is_hashed(image.name))
+            self.assertTrue(os.path.exists(image.path))
+        for name in names:
+            self.assertFalse(legacy.exists(name))
+
+
+class ImportYatubeTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            if name.endswith('.csv'):
+                file.write(content)
+            else:
+                file.writelines(json.dumps(row) + '\n' for row in content)
+        return path
+
+    def call(self, **files):
+        out = StringIO()
+        call_command('import_yatube', batch_size=2, stdout=out, **files)
+        return out.getvalue()
+
+    def test_import_resolves_references_and_rebuilds_derived_data(self):
+        User.objects.create_user(username='old')
+        files = {
+            'users': self.write('users.csv', (
+                'id,username,email,date_joined\n'
+                'u1,leo,leo@example.com,2020-01-01T10:00:00\n'
+                'u2,anna,,2020-01-02T10:00:00+03:00\n'
+                'u3,old,,\n'
+            )),
+            'groups': self.write('groups.ndjson', [
+                {'id': 7, 'title': 'Коты', 'slug': 'cats'},
+            ]),
+            'posts': self.write('posts.ndjson', [
+                {'id': 'p1', 'author': 'u1', 'group': 7, 'text': 'Мой кот',
+                 'pub_date': '2021-05-01T12:00:00Z'},
+                {'id': 'p2', 'author': 'u1', 'text': 'Второй пост',
+                 'pub_date': '2021-05-02T12:00:00Z'},
+                {'id': 'p3', 'author': 'u2', 'text': 'Пост Анны'},
+                {'id': 'p4', 'author': 'missing', 'text': 'Без автора'},
+            ]),
+            'comments': self.write('comments.ndjson', [
+                {'post': 'p1', 'author': 'u2', 'text': 'Красивый',
+                 'created': '2021-05-03T12:00:00Z'},
+                {'post': 'p9', 'author': 'u2', 'text': 'Потерянный'},
+            ]),
+            'follows': self.write('follows.csv', (
+                'user,author\nu2,u1\nu2,u1\nu1,u1\nu3,u1\n'
+            )),
+        }
+        output = self.call(**files)
+        self.assertIn('posts: 3 строк, пропущено 1', output)
+        self.assertIn('users: 2 строк, пропущено 1', output)
+        self.assertIn('строк/с', output)
+        self.assertEqual(User.objects.filter(username='old').count(), 1)
+        leo = User.objects.get(username='leo')
+        post = Post.objects.get(text='Мой кот')
+        self.assertEqual(post.author, leo)
+        self.assertEqual(post.group.slug, 'cats')
+        self.assertEqual(post.pub_date.isoformat(),
+                         '2021-05-01T12:00:00+00:00')
+        comment = Comment.objects.get()
+        self.assertEqual(comment.created.day, 3)
+        self.assertEqual(Follow.objects.filter(author=leo).count(), 2)
+        leo.profile.refresh_from_db()
+        self.assertEqual(leo.profile.posts_count, 2)
+        self.assertEqual(leo.profile.followers_count, 2)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(counters.index_count(), 3)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user__username='anna').count(), 2)
+        self.assertEqual(
+            list(search.find('кот').values_list('pk', flat=True)), [post.pk])
+        Post.objects.filter(pk=post.pk).update(text='Мой пёс')
+        self.assertFalse(search.find('кот').exists())
+        Post.objects.create(author=leo, text='Новый пост')
+
+    def test_duplicate_usernames_in_one_batch_are_merged(self):
+        output = self.call(
+            users=self.write('users.ndjson', [
+                {'id': 'u1', 'username': 'leo'},
+                {'id': 'u2', 'username': 'leo'},
+                {'id': 'u3', 'username': 'anna'},
+            ]),
+            groups=self.write('groups.ndjson', [
+                {'id': 1, 'title': 'Коты', 'slug': 'cats'},
+                {'id': 2, 'title': 'Кошки', 'slug': 'cats'},
+            ]),
+            posts=self.write('posts.ndjson', [
+                {'id': 'p1', 'author': 'u2', 'group': 2, 'text': 'Пост'},
+            ]),
+        )
+        self.assertIn('users: 2 строк, пропущено 1', output)
+        self.assertIn('groups: 1 строк, пропущено 1', output)
+        post = Post.objects.get()
+        self.assertEqual(post.author.username, 'leo')
+        self.assertEqual(post.group.title, 'Коты')
+
+    def test_bad_record_reports_line(self):
+        path = os.path.join(self.dir, 'posts.ndjson')
+        with open(path, 'w') as file:
+            file.write('{"id": 1, "author": 1, "text": "x"}\n{oops\n')
+        with self.assertRaisesMessage(CommandError, 'posts.ndjson:2'):
+            self.call(posts=path)
+        with self.assertRaisesMessage(CommandError, 'Укажите'):
+            self.call()
+
+
+class GenerateLoadDataTest(TestCase):
+    def generate(self, **options):
+        options = {
+            'users': 40, 'groups': 4, 'posts': 300, 'follows': 120,
+            'comments': 200, 'seed': 3, 'batch_size': 50, **options,
+        }
+        call_command('generate_load_data', stdout=StringIO(), **options)
+
+    def snapshot(self):
+        return (
+            list(Post.objects.order_by('pk').values_list(
+                'text', 'author__username', 'group__slug')),
+            list(Follow.objects.order_by('pk').values_list(
+                'user__username', 'author__username')),
+            list(Comment.objects.order_by('pk').values_list(
+                'post__text', 'author__username', 'text')),
+        )
+
+    def test_skewed_data_with_derived_counters(self):
+        self.generate()
+        self.assertEqual(Post.objects.count(), 300)
+        self.assertEqual(Comment.objects.count(), 200)
+        self.assertFalse(Follow.objects.filter(user=F('author')).exists())
+        top = Profile.objects.order_by('-posts_count').first()
+        self.assertEqual(top.posts_count, top.user.posts.count())
+        # Степенной закон: у первого автора много больше среднего.
+        self.assertGreater(top.posts_count, 300 / 40 * 4)
+        commented = Post.objects.order_by('-comments_count').first()
+        self.assertGreater(commented.comments_count, 200 / 300 * 10)
+        self.assertEqual(counters.index_count(), 300)
+        reader = Follow.objects.values_list('user', flat=True).first()
+        self.assertTrue(TimelineEntry.objects.filter(user=reader).exists())
+        word = Post.objects.first().text.split()[0]
+        self.assertTrue(search.find(word).exists())
+
+    def test_same_seed_gives_same_data(self):
+        self.generate(skip_timelines=True)
+        first = self.snapshot()
+        for model in (Comment, Follow, Post, Group, User):
+            model.objects.all().delete()
+        self.generate(skip_timelines=True)
+        self.assertEqual(self.snapshot(), first)
+        self.generate(seed=4, skip_timelines=True)
+        self.assertNotEqual(self.snapshot()[0][300:], first[0])
+
+    def test_taken_username_is_reported(self):
+        user = User.objects.create_user(username='taken')
+        # Генератор начинает id пользователей со следующего.
+        user.username = f'user{user.pk + 1}'
+        user.save()
+        with self.assertRaisesMessage(CommandError, 'users: '):
+            self.generate()
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_images_are_shared_content_addressed_files(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media):
+            self.generate(images=0.5, skip_timelines=True)
+            names = set(Post.objects.exclude(image='').exclude(
+                image=None).values_list('image', flat=True))
+            self.assertTrue(names)
+            self.assertTrue(all(
+                os.path.exists(os.path.join(media, name)) for name in names
+            ))
+        with self.assertRaisesMessage(CommandError, '--images'):
+            self.generate(images=2)
@@ -28,7 +28,8 @@ class PostURLTests(TestCase):
         self.public_pages = ['/',
                              f'/group/{self.post.group.slug}/',
                              f'/profile/{self.post.author}/',
-                             f'/posts/{self.post.id}/']
+                             f'/posts/{self.post.id}/',
+                             '/search/?q=пост']
         self.private_page = [f'/posts/{self.post.id}/edit/',
                              '/create/',
                              '/follow/'
@@ -86,6 +87,7 @@ class PostURLTests(TestCase):
             f'/posts/{post_id}/': 'posts/post_detail.html',
             f'/posts/{post_id}/edit/': 'posts/create_post.html',
             '/create/': 'posts/create_post.html',
+            '/search/': 'posts/search.html',
         }
         for address, template in templates_url_names.items():
             with self.subTest(address=address):
@@ -1,11 +1,41 @@
+import gzip
+import hashlib
+import json
 import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures.process import BrokenProcessPool
+from io import StringIO
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.core.paginator import Page
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from posts.models import Comment, Group, Post, User, Follow
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.images import ImageFile
+from core import metrics
+from core.testing import QueryBudget, QueryBudgetMixin, shape
+from posts import (counters, exporter, search, thumbnail_index,
+                   thumbnails, timeline)
+from posts.models import (Comment, FeedCount, Group, Post, Profile, User,
+                          Follow, TimelineEntry)
 from django.core.files.uploadedfile import SimpleUploadedFile
 from posts.forms import PostForm
 from http import HTTPStatus
-from posts.settings import ALL_PAGES, LIST_LENGHT, SECOND_PAGE_POST
+from posts.paginators import (ELLIPSIS, AdminPaginator,
+                              EstimatedCountPaginator, decode_cursor,
+                              elided_page_range, pack_cursor)
+from posts.settings import (ALL_PAGES, COMMENTS_PER_PAGE, LIST_LENGHT,
+                            POST_IMAGE_WIDTHS, SECOND_PAGE_POST)
 
 
 @override_settings()
@@ -20,7 +50,7 @@ class PostsViewsTest(TestCase):
             slug='test_slug',
             description='Тестовое описание',
         )
-        small_gif = (
+        cls.small_gif = small_gif = (
             b'\x47\x49\x46\x38\x39\x61\x02\x00'
             b'\x01\x00\x80\x00\x00\x00\x00\x00'
             b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
@@ -195,8 +225,9 @@ class PostsViewsTest(TestCase):
         response = self.authorized_client.get(url)
         post = response.context.get('page_obj')[0]
         image_name = post.image.name.split('/')[-1]
-        self.assertEqual(image_name, self.uploaded_file.name,
-                         'Полученное изображение требует соответствия.')
+        self.assertEqual(
+            image_name, hashlib.sha256(self.small_gif).hexdigest() + '.gif',
+            'Полученное изображение требует соответствия.')
         self._assert_post_has_attribs(post)
 
     def test_follow_index_context(self):
@@ -283,6 +314,96 @@ class PaginatorTests(TestCase):
                 self.assertEqual(len(response.context['page_obj']),
                                  SECOND_PAGE_POST, danger_message)
 
+    def test_keyset_pages_views(self):
+        """Курсоры after/before листают ленту без COUNT и OFFSET"""
+        for address, temp in self.paginate_dict.items():
+            with self.subTest(temp=temp):
+                first = self.authorized_client.get(address)
+                first_page = first.context['page_obj']
+                self.assertFalse(first_page.has_previous())
+                self.assertTrue(first_page.has_next())
+                with CaptureQueriesContext(connection) as queries:
+                    second = self.authorized_client.get(
+                        address + '?after='
+                        + first_page.paginator.next_cursor)
+                sql = ' '.join(query['sql'] for query in queries)
+                self.assertNotIn('OFFSET', sql.upper())
+                page_obj = second.context['page_obj']
+                self.assertEqual(len(page_obj), SECOND_PAGE_POST)
+                self.assertFalse(page_obj.has_next())
+                self.assertTrue(
+                    set(page_obj).isdisjoint(set(first_page)))
+                back = self.authorized_client.get(
+                    address + '?before='
+                    + page_obj.paginator.previous_cursor)
+                self.assertEqual(
+                    list(back.context['page_obj']), list(first_page))
+
+    def test_numbered_pages_without_count(self):
+        """?page=N не выполняет COUNT(*) и берёт число из счётчиков"""
+        cache.clear()
+        FeedCount.objects.all().delete()
+        for address, temp in self.paginate_dict.items():
+            with self.subTest(temp=temp):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.authorized_client.get(address + '?page=1')
+                sql = ' '.join(query['sql'] for query in queries)
+                self.assertNotIn('COUNT(', sql.upper())
+                page_obj = response.context['page_obj']
+                self.assertTrue(page_obj.has_next())
+                self.assertEqual(page_obj.paginator.num_pages, 2)
+        response = self.authorized_client.get(
+            reverse('posts:index') + '?page=1')
+        self.assertFalse(response.context['page_obj'].paginator.count_known)
+        self.assertNotContains(response, 'Последняя')
+        call_command('refresh_feed_counts', stdout=StringIO())
+        response = self.authorized_client.get(
+            reverse('posts:index') + '?page=1')
+        self.assertEqual(
+            response.context['page_obj'].paginator.count, ALL_PAGES)
+        self.assertContains(response, 'Последняя')
+
+    def test_numbered_page_out_of_range(self):
+        """Несуществующая страница отдаёт последнюю по оценке"""
+        response = self.authorized_client.get(
+            reverse('posts:profile', args=[self.user.username])
+            + '?page=99')
+        self.assertEqual(response.context['page_obj'].number, 2)
+        self.assertEqual(len(response.context['page_obj']), SECOND_PAGE_POST)
+
+    def test_huge_page_number_gives_last_page(self):
+        """Номер страницы больше целого базы данных отдаёт последнюю"""
+        for number in ('99999999999999999999999', str(sys.maxsize)):
+            with self.subTest(number=number):
+                response = self.authorized_client.get(
+                    reverse('posts:index') + '?page=' + number)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(response.context['page_obj'].number, 2)
+
+    def test_keyset_bad_cursor(self):
+        """Битый курсор отдаёт начало ленты"""
+        response = self.authorized_client.get(
+            reverse('posts:index') + '?after=broken')
+        self.assertEqual(len(response.context['page_obj']), LIST_LENGHT)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+    def test_keyset_cursor_out_of_range(self):
+        """Курсор с id или датой вне пределов базы отдаёт начало ленты"""
+        cursors = (
+            pack_cursor('2021-01-01T00:00:00+00:00', 2 ** 63),
+            pack_cursor('2021-01-01T00:00:00+00:00', 0),
+            pack_cursor('0001-01-01T00:00:00+05:00', 1),
+            pack_cursor('9999-12-31T23:59:59-05:00', 1),
+        )
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(decode_cursor(cursor))
+                response = self.authorized_client.get(
+                    reverse('posts:index') + '?after=' + cursor)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertFalse(
+                    response.context['page_obj'].has_previous())
+
     def test_comment_to_post_detail(self):
         """Комментарий появляется на странице поста."""
         comments_count = Comment.objects.count()
@@ -294,3 +415,905 @@ class PaginatorTests(TestCase):
         self.assertEqual(
             Comment.objects.first().text,
             comment_new.text)
+
+
+class FollowTimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='writer')
+        cls.old_post = Post.objects.create(
+            author=cls.author, text='Пост до подписки')
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def _feed(self):
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_follow_backfills_and_unfollow_purges(self):
+        """Подписка дозаполняет ленту, отписка её чистит"""
+        self.reader_client.get(
+            reverse('posts:profile_follow', args=[self.author.username]))
+        self.assertEqual(self._feed(), [self.old_post])
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        self.assertEqual(self._feed(), [new_post, self.old_post])
+        self.reader_client.get(
+            reverse('posts:profile_unfollow', args=[self.author.username]))
+        self.assertEqual(self._feed(), [])
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.reader).exists())
+
+    def test_rebuild_timelines_command(self):
+        """Команда пересобирает ленту и обрезает её до --length"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(author=self.author, text='Второй')
+        TimelineEntry.objects.filter(user=self.reader).delete()
+        call_command('rebuild_timelines', length=1, stdout=StringIO())
+        self.assertEqual(len(self._feed()), 1)
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(len(self._feed()), 2)
+        out = StringIO()
+        call_command('rebuild_timelines', length=1, trim_only=True, stdout=out)
+        self.assertIn('Обрезано лент: 1', out.getvalue())
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 1)
+
+
+@override_settings(TIMELINE_PULL_THRESHOLD=1)
+class HybridFeedTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.star = User.objects.create_user(username='star')
+        cls.writer = User.objects.create_user(username='writer')
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=cls.reader, author=cls.star)
+        Follow.objects.create(user=fan, author=cls.star)
+        Follow.objects.create(user=cls.reader, author=cls.writer)
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_pulled_authors_are_merged_on_read(self):
+        """Посты популярного автора подтягиваются и сливаются с лентой"""
+        posts = [
+            Post.objects.create(
+                author=(self.star, self.writer)[i % 2], text=str(i))
+            for i in range(ALL_PAGES)
+        ]
+        self.assertFalse(TimelineEntry.objects.filter(
+            post__author=self.star).exists())
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        page_obj = response.context['page_obj']
+        self.assertEqual(list(page_obj), posts[::-1][:LIST_LENGHT])
+        response = self.reader_client.get(
+            reverse('posts:follow_index')
+            + '?after=' + page_obj.paginator.next_cursor)
+        self.assertEqual(
+            list(response.context['page_obj']), posts[::-1][LIST_LENGHT:])
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['gauges']['timeline_pull_threshold'], 1)
+        self.assertEqual(snapshot['gauges']['timeline_pulled_authors'], 1)
+        self.assertEqual(
+            snapshot['observations']['timeline_merge_sources'],
+            {'count': 2, 'sum': 4})
+
+    def test_author_below_threshold_is_pushed_again(self):
+        """Посты, написанные пока автор подтягивался, не пропадают из лент"""
+        self.reader_client.get(reverse('posts:follow_index'))
+        self.star.profile.refresh_from_db()
+        self.assertIsNotNone(self.star.profile.pulled_since)
+        posts = [Post.objects.create(author=self.star, text=str(i))
+                 for i in range(3)]
+        Follow.objects.filter(author=self.star).exclude(
+            user=self.reader).delete()
+        # Кешированное множество подтягиваемых авторов устарело.
+        cache.delete(timeline.PULLED_AUTHORS_KEY)
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), posts[::-1])
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(
+                user=self.reader).values_list('post', flat=True)),
+            {post.pk for post in posts})
+        self.star.profile.refresh_from_db()
+        self.assertIsNone(self.star.profile.pulled_since)
+
+    def test_pulled_authors_come_from_follower_counter(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(timeline.pulled_authors(), {self.star.pk})
+        self.assertFalse(any('GROUP BY' in query['sql'] for query in queries))
+        Profile.objects.filter(user=self.writer).update(followers_count=2)
+        cache.delete(timeline.PULLED_AUTHORS_KEY)
+        self.assertEqual(
+            timeline.pulled_authors(), {self.star.pk, self.writer.pk})
+
+    def test_pushed_back_timelines_are_trimmed(self):
+        own = Post.objects.create(author=self.writer, text='Свой')
+        posts = [Post.objects.create(author=self.star, text=str(i))
+                 for i in range(3)]
+        timeline.push_since(self.star.pk, own.pub_date, length=2)
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(
+                user=self.reader).values_list('post', flat=True)),
+            [posts[2].pk, posts[1].pk])
+
+
+class PostCardCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='carder')
+        cls.group = Group.objects.create(
+            title='Старое название', slug='cards', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Исходный текст')
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        # Авторизованному кеш страниц не отдаётся, карточки рендерятся.
+        self.client_with_user = Client()
+        self.client_with_user.force_login(self.author)
+
+    def _counters(self):
+        counters = metrics.snapshot()['counters']
+        return (counters.get('post_card_cache_hits', 0),
+                counters.get('post_card_cache_misses', 0))
+
+    def test_cards_are_cached_until_post_changes(self):
+        """Карточка берётся из кеша, пока пост не изменится"""
+        self.client_with_user.get(reverse('posts:index'))
+        self.assertEqual(self._counters(), (0, 1))
+        self.client_with_user.get(reverse('posts:index'))
+        self.assertEqual(self._counters(), (1, 1))
+        self.post.text = 'Новый текст'
+        self.post.save()
+        response = self.client_with_user.get(reverse('posts:index'))
+        self.assertEqual(self._counters(), (1, 2))
+        self.assertContains(response, 'Новый текст')
+
+    def test_group_change_invalidates_cards(self):
+        """Переименование группы обновляет карточки её постов"""
+        address = reverse('posts:profile', args=[self.author.username])
+        self.client_with_user.get(address)
+        self.group.slug = 'new-cards'
+        self.group.save()
+        response = self.client_with_user.get(address)
+        self.assertEqual(self._counters(), (0, 2))
+        self.assertContains(response, '/group/new-cards/')
+
+
+class AnonymousPageCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='paged')
+        cls.reader = User.objects.create_user(username='page_reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='paged', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Первый пост')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.pages = {
+            'index': reverse('posts:index'),
+            'group': reverse('posts:group_list', args=[self.group.slug]),
+            'profile': reverse('posts:profile', args=[self.author.username]),
+            'post': reverse('posts:post_detail', args=[self.post.pk]),
+        }
+
+    def _is_cached(self, address):
+        return self.guest_client.get(address).context is None
+
+    def test_pages_cached_until_dependencies_change(self):
+        """Страница отдаётся из кеша, пока не изменится то, что на ней"""
+        for name, address in self.pages.items():
+            with self.subTest(page=name):
+                self.assertFalse(self._is_cached(address))
+                self.assertTrue(self._is_cached(address))
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий')
+        self.assertFalse(self._is_cached(self.pages['post']))
+        self.assertTrue(self._is_cached(self.pages['index']))
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertFalse(self._is_cached(self.pages['profile']))
+        self.assertTrue(self._is_cached(self.pages['group']))
+        Post.objects.create(author=self.author, text='Без группы')
+        self.assertFalse(self._is_cached(self.pages['index']))
+        self.assertTrue(self._is_cached(self.pages['group']))
+
+    def test_new_post_updates_author_count_on_other_posts(self):
+        """Новый пост автора обновляет число постов на его прежних постах"""
+        response = self.guest_client.get(self.pages['post'])
+        self.assertContains(response, 'Всего постов автора: 1')
+        self.assertTrue(self._is_cached(self.pages['post']))
+        Post.objects.create(author=self.author, text='Второй пост')
+        response = self.guest_client.get(self.pages['post'])
+        self.assertContains(response, 'Всего постов автора: 2')
+        self.assertTrue(self._is_cached(self.pages['post']))
+
+    def test_moving_post_invalidates_old_group(self):
+        """Перенос поста в другую группу обновляет обе страницы групп"""
+        self.assertFalse(self._is_cached(self.pages['group']))
+        self.post.group = None
+        self.post.save()
+        response = self.guest_client.get(self.pages['group'])
+        self.assertIsNotNone(response.context)
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+    @override_settings(CACHE_SINGLE_PROCESS=False)
+    def test_process_local_cache_is_not_used_by_many_workers(self):
+        """С кешем в памяти процесса и несколькими воркерами кеш отключён"""
+        self.assertFalse(self._is_cached(self.pages['index']))
+        self.assertFalse(self._is_cached(self.pages['index']))
+        self.assertEqual(
+            [error.id for error in checks.run_checks()], ['posts.W001'])
+
+    def test_authorized_requests_bypass_cache(self):
+        """Авторизованный пользователь получает страницу без кеша"""
+        self.guest_client.get(self.pages['index'])
+        self.guest_client.force_login(self.reader)
+        self.assertFalse(self._is_cached(self.pages['index']))
+
+
+class ElidedPageRangeTests(TestCase):
+    def test_elided_page_range(self):
+        """Номера страниц: края и окно вокруг текущей"""
+        self.assertEqual(list(elided_page_range(1, 5)), [1, 2, 3, 4, 5])
+        self.assertEqual(
+            list(elided_page_range(50, 100)),
+            [1, 2, ELLIPSIS, 47, 48, 49, 50, 51, 52, 53, ELLIPSIS, 99, 100])
+        self.assertEqual(
+            list(elided_page_range(1, 100)),
+            [1, 2, 3, 4, ELLIPSIS, 99, 100])
+
+    def test_paginator_render_size_is_constant(self):
+        """Размер и время рендера пагинатора не растут с числом постов"""
+        sizes = {}
+        for total in (10 ** 3, 10 ** 5, 10 ** 7):
+            paginator = EstimatedCountPaginator(
+                Post.objects.all(), LIST_LENGHT, count=total)
+            page_obj = Page([], paginator.num_pages // 2, paginator)
+            started = time.perf_counter()
+            html = render_to_string(
+                'posts/includes/paginator.html', {'page_obj': page_obj})
+            elapsed = time.perf_counter() - started
+            sizes[total] = len(html.encode())
+            self.assertLess(elapsed, 0.5)
+            self.assertEqual(html.count('<li'), 17)
+        self.assertLess(max(sizes.values()) - min(sizes.values()), 100)
+
+
+class PostDetailQueriesTests(TestCase):
+    COMMENTS = 1000
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='talkative')
+        cls.group = Group.objects.create(
+            title='Обсуждения', slug='talks', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Обсуждаемый пост')
+        commenters = [
+            User.objects.create_user(username=f'commenter{i}')
+            for i in range(5)
+        ]
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=commenters[i % 5], text=str(i))
+            for i in range(cls.COMMENTS)
+        )
+        Post.objects.filter(pk=cls.post.pk).update(
+            comments_count=cls.COMMENTS)
+
+    def setUp(self):
+        cache.clear()
+        self.address = reverse('posts:post_detail', args=[self.post.pk])
+
+    def test_detail_query_count_is_bounded(self):
+        """Пост, автор, группа - один запрос, комментарии - ещё один"""
+        with self.assertNumQueries(2):
+            response = self.client.get(self.address)
+        comments = response.context['comments']
+        self.assertEqual(len(comments), COMMENTS_PER_PAGE)
+        self.assertContains(response, 'commenter4')
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                self.address + '?after=' + comments.paginator.next_cursor)
+        self.assertTrue(
+            set(response.context['comments']).isdisjoint(set(comments)))
+
+    def test_numbered_comment_pages(self):
+        """Последняя страница комментариев берётся из счётчика"""
+        with self.assertNumQueries(2):
+            response = self.client.get(self.address + '?page=1')
+        self.assertEqual(
+            response.context['comments'].paginator.num_pages,
+            self.COMMENTS // COMMENTS_PER_PAGE)
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0,
+                   THUMBNAIL_INDEX_CHECK_INTERVAL=0)
+class ThumbnailsTests(TestCase):
+    SMALL_GIF = (
+        b'\x47\x49\x46\x38\x39\x61\x02\x00'
+        b'\x01\x00\x80\x00\x00\x00\x00\x00'
+        b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+        b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+        b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+        b'\x0A\x00\x3B'
+    )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        # Записи sorl в базе откатываются после каждого теста, а индекс
+        # на диске нет.
+        if os.path.exists(thumbnail_index.index_path()):
+            os.remove(thumbnail_index.index_path())
+        self.author = User.objects.create_user(username='photographer')
+        self.client.force_login(self.author)
+
+    def upload(self, name='photo.gif'):
+        return SimpleUploadedFile(
+            name=name, content=self.SMALL_GIF, content_type='image/gif')
+
+    def assertThumbnailsReady(self, image):
+        for _, _, geometry, options in thumbnails.variants():
+            thumbnail = get_thumbnail(image, geometry, **options)
+            self.assertIsNotNone(default.kvstore.get(thumbnail))
+            self.assertTrue(thumbnail.exists())
+
+    def test_generate_builds_every_geometry(self):
+        post = Post.objects.create(
+            author=self.author, text='Фото', image=self.upload())
+        name, built, error = thumbnails.generate(post.image.name)
+        self.assertEqual(
+            (name, built, error),
+            (post.image.name, len(list(thumbnails.variants())), None))
+        self.assertThumbnailsReady(post.image)
+
+    def test_generate_reports_missing_source(self):
+        _, built, error = thumbnails.generate('posts/missing.gif')
+        self.assertEqual(built, 0)
+        self.assertIsNotNone(error)
+        for name in (None, ''):
+            with self.subTest(name=name), \
+                    self.assertLogs('posts.thumbnails', 'ERROR'):
+                _, built, error = thumbnails.generate(name)
+                self.assertEqual(built, 0)
+                self.assertIsNotNone(error)
+
+    def test_post_create_schedules_thumbnails(self):
+        """Миниатюры готовы до первого рендера страницы"""
+        with mock.patch.object(
+                thumbnails.transaction, 'on_commit',
+                side_effect=lambda callback: callback()) as on_commit:
+            self.client.post(
+                reverse('posts:post_create'),
+                {'text': 'С картинкой', 'image': self.upload()})
+        on_commit.assert_called()
+        self.assertThumbnailsReady(Post.objects.get().image)
+
+    @override_settings(THUMBNAIL_WORKERS=2)
+    def test_broken_pool_is_replaced(self):
+        """Умерший процесс пула не роняет создание поста"""
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool
+        fresh = mock.Mock()
+        # Второй раз пересозданный пул тоже оказывается сломанным.
+        for replacement in (fresh, broken):
+            with self.subTest(replacement=replacement), \
+                    mock.patch.object(thumbnails, '_executor', broken), \
+                    mock.patch.object(thumbnails, 'make_pool',
+                                      return_value=replacement), \
+                    mock.patch.object(
+                        thumbnails.transaction, 'on_commit',
+                        side_effect=lambda callback: callback()), \
+                    self.assertLogs('posts.thumbnails', 'WARNING'):
+                response = self.client.post(
+                    reverse('posts:post_create'),
+                    {'text': 'С картинкой', 'image': self.upload()})
+                self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        fresh.submit.assert_called_once()
+        self.assertEqual(broken.shutdown.call_count, 2)
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_post_edit_without_new_image_schedules_nothing(self):
+        post = Post.objects.create(
+            author=self.author, text='Фото', image=self.upload())
+        with mock.patch.object(thumbnails, 'schedule') as schedule:
+            self.client.post(
+                reverse('posts:post_edit', args=[post.pk]),
+                {'text': 'Новый текст'})
+        schedule.assert_not_called()
+
+    def test_backfill_command(self):
+        for index in range(3):
+            Post.objects.create(
+                author=self.author, text=str(index),
+                image=self.upload(f'photo{index}.gif'))
+        Post.objects.create(author=self.author, text='Без картинки')
+        # Так пишут посты без картинки импорт и generate_load_data.
+        Post.objects.filter(
+            pk=Post.objects.create(author=self.author, text='NULL').pk
+        ).update(image=None)
+        out = StringIO()
+        call_command('generate_thumbnails', workers=0, stdout=out)
+        built = 3 * len(list(thumbnails.variants()))
+        self.assertIn(f'Построено миниатюр: {built}, картинок с ошибками: 0',
+                      out.getvalue())
+        for post in Post.objects.exclude(image='').exclude(
+                image__isnull=True):
+            self.assertThumbnailsReady(post.image)
+
+    def test_index_roundtrip(self):
+        path = os.path.join(TEMP_MEDIA_ROOT, 'roundtrip.idx')
+        items = [(f'sorl-thumbnail||image||{i}', f'{{"size": [{i}, 1]}}')
+                 for i in range(100)]
+        self.assertEqual(thumbnail_index.write(path, items), 100)
+        with override_settings(THUMBNAIL_INDEX_PATH=path):
+            for key, value in items:
+                self.assertEqual(thumbnail_index._index.get(key), value)
+            self.assertIsNone(thumbnail_index._index.get('missing'))
+            self.assertEqual(thumbnail_index.remove(
+                [items[5][0], 'missing'], path), 1)
+            self.assertIsNone(thumbnail_index._index.get(items[5][0]))
+            self.assertEqual(
+                thumbnail_index._index.get(items[6][0]), items[6][1])
+            thumbnail_index.write(path, items[:1])
+            self.assertIsNone(thumbnail_index._index.get(items[1][0]))
+
+    def test_indexed_thumbnail_resolves_without_queries(self):
+        """После пересборки индекса тег миниатюры не ходит в базу"""
+        post = Post.objects.create(
+            author=self.author, text='Фото', image=self.upload())
+        thumbnails.generate(post.image.name)
+        out = StringIO()
+        call_command('rebuild_thumbnail_index', stdout=out)
+        records = 1 + len(list(thumbnails.variants()))
+        self.assertIn(f'Записей в индексе миниатюр: {records}',
+                      out.getvalue())
+        cache.clear()
+        _, _, geometry, options = next(thumbnails.variants())
+        with self.assertNumQueries(0):
+            thumbnail = get_thumbnail(post.image, geometry, **options)
+        self.assertTrue(thumbnail.exists())
+
+    def test_deleted_record_leaves_index(self):
+        post = Post.objects.create(
+            author=self.author, text='Фото', image=self.upload())
+        thumbnails.generate(post.image.name)
+        thumbnail_index.rebuild()
+        source = ImageFile(post.image)
+        self.assertIsNotNone(default.kvstore.get(source))
+        # Файл индекса не пересобирается: запись стирается на месте.
+        with mock.patch.object(thumbnail_index, 'rebuild') as rebuild, \
+                CaptureQueriesContext(connection) as queries:
+            default.kvstore.delete(source)
+        rebuild.assert_not_called()
+        self.assertTrue(all(
+            query['sql'].startswith('DELETE') for query in queries))
+        cache.clear()
+        self.assertIsNone(thumbnail_index._index.get(source.key))
+        self.assertIsNone(default.kvstore.get(source))
+
+    def test_picture_markup_has_srcset_for_every_width(self):
+        post = Post.objects.create(
+            author=self.author, text='Фото', image=self.upload())
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk]))
+        self.assertContains(response, '<picture>')
+        for width in POST_IMAGE_WIDTHS:
+            self.assertContains(response, f' {width}w')
+        for image_format in thumbnails.modern_formats():
+            self.assertContains(
+                response, f'<source type="image/{image_format.lower()}"')
+
+    @skipUnless('WEBP' in thumbnails.modern_formats(),
+                'Pillow собран без WebP')
+    def test_webp_variants(self):
+        post = Post.objects.create(
+            author=self.author, text='Фото', image=self.upload())
+        thumbnails.generate(post.image.name)
+        picture = thumbnails.picture(post.image)
+        self.assertEqual(picture['sources'][-1]['type'], 'image/webp')
+        self.assertIn('.webp 480w', picture['sources'][-1]['srcset'])
+
+    def test_savings_report(self):
+        Post.objects.create(
+            author=self.author, text='Фото', image=self.upload())
+        Post.objects.filter(
+            pk=Post.objects.create(author=self.author, text='NULL').pk
+        ).update(image=None)
+        out = StringIO()
+        call_command('image_savings', stdout=out)
+        self.assertIn('JPEG полной ширины (сейчас)', out.getvalue())
+        for width in POST_IMAGE_WIDTHS:
+            self.assertIn(f'JPEG {width}w', out.getvalue())
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='auth')
+        self.cat = Post.objects.create(
+            author=self.author, text='Наш кот ловит мышей')
+        self.cats = Post.objects.create(
+            author=self.author, text='Коты, коты и снова коты')
+        self.hedgehog = Post.objects.create(
+            author=self.author, text='Ёжик в тумане')
+
+    def found(self, query):
+        response = self.client.get(reverse('posts:search'), {'q': query})
+        return list(response.context['page_obj'])
+
+    def test_stemmed_prefix_search_ranked(self):
+        self.assertEqual(self.found('котами'), [self.cats, self.cat])
+
+    def test_yo_and_case_insensitive(self):
+        self.assertEqual(self.found('ЕЖИК'), [self.hedgehog])
+        self.assertEqual(self.found('ёжика'), [self.hedgehog])
+
+    def test_fts_syntax_is_escaped(self):
+        for query in ('"кот', 'кот AND OR', 'NEAR(кот', '*', ''):
+            with self.subTest(query=query):
+                response = self.client.get(
+                    reverse('posts:search'), {'q': query})
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_cursor_out_of_range(self):
+        for cursor in (pack_cursor('1.0', 10 ** 30), pack_cursor('nan', 1),
+                       pack_cursor('кот', 1), 'broken'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    reverse('posts:search'), {'q': 'кот', 'after': cursor})
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(len(response.context['page_obj']), 2)
+
+    def test_index_follows_edits_and_deletes(self):
+        self.cat.text = 'Наш пёс ловит мышей'
+        self.cat.save()
+        self.assertEqual(self.found('кот'), [self.cats])
+        self.assertEqual(self.found('пес'), [self.cat])
+        self.cats.delete()
+        self.assertEqual(self.found('кот'), [])
+        Post.objects.bulk_create(
+            [Post(author=self.author, text='Котик') for _ in range(2)])
+        self.assertEqual(len(self.found('кот')), 2)
+
+    def test_keyset_pagination_by_rank(self):
+        Post.objects.bulk_create([
+            Post(author=self.author, text='кот ' * (i % 4 + 1) + 'и пёс')
+            for i in range(LIST_LENGHT * 2)
+        ])
+        expected = list(
+            search.find('пёс').order_by('rank', '-pk')
+            .values_list('pk', flat=True)
+        )
+        url = reverse('posts:search')
+        response = self.client.get(url, {'q': 'пёс'})
+        pages = [response.context['page_obj']]
+        while pages[-1].paginator.next_cursor:
+            pages.append(self.client.get(url, {
+                'q': 'пёс', 'after': pages[-1].paginator.next_cursor,
+            }).context['page_obj'])
+        self.assertEqual(
+            [post.pk for page in pages for post in page], expected)
+        self.assertContains(
+            response, f'?q=%D0%BF%D1%91%D1%81&after='
+            f'{pages[0].paginator.next_cursor}')
+        back = self.client.get(url, {
+            'q': 'пёс', 'before': pages[-1].paginator.previous_cursor,
+        }).context['page_obj']
+        self.assertEqual(list(back), list(pages[-2]))
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), {'q': 'кот'})
+        self.assertEqual(
+            set(response.context['cl'].result_list), {self.cat, self.cats})
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertIn('MATCH', sql)
+        self.assertNotIn('LIKE', sql)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {search.FTS_TABLE} "
+                           f"({search.FTS_TABLE}) VALUES ('delete-all')")
+        self.assertEqual(self.found('кот'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.found('кот')), 2)
+
+
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        cls.groups = Group.objects.bulk_create([
+            Group(title=f'Группа {i}', slug=f'group-{i}') for i in range(30)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def create_posts(self, count):
+        groups = list(Group.objects.all())
+        Post.objects.bulk_create([
+            Post(author=self.admin, text=f'Пост {i}',
+                 group=groups[i % len(groups)])
+            for i in range(count)
+        ])
+
+    def changelist(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response, [query['sql'] for query in queries]
+
+    def test_queries_do_not_grow_with_rows(self):
+        self.create_posts(5)
+        _, few = self.changelist()
+        self.create_posts(95)
+        response, many = self.changelist()
+        self.assertEqual(len(response.context['cl'].result_list), 100)
+        self.assertEqual(len(many), len(few))
+
+    def test_group_column_renders_only_selected_option(self):
+        self.create_posts(20)
+        response, _ = self.changelist()
+        options = re.findall(
+            r'<option[^>]*>([^<]*)', response.content.decode())
+        self.assertEqual(
+            sum(label.startswith('Группа') for label in options), 20)
+        self.assertContains(response, 'admin-autocomplete')
+
+    def test_unfiltered_count_uses_estimate(self):
+        self.create_posts(3)
+        counters.refresh_index_count()
+        counters.shift_index_count(1000)
+        response, queries = self.changelist()
+        self.assertEqual(response.context['cl'].result_count, 1003)
+        self.assertFalse(any('COUNT(' in sql for sql in queries))
+
+    def test_filtered_count_is_limited(self):
+        self.create_posts(30)
+        paginator = AdminPaginator(
+            Post.objects.filter(text__startswith='Пост'), 10, limit=25)
+        self.assertEqual(paginator.count, 25)
+        self.assertEqual(str(paginator.count), '25+')
+        paginator = AdminPaginator(Post.objects.all(), 10, limit=30)
+        self.assertEqual(str(paginator.count), '30')
+        response, _ = self.changelist(pub_date__gte='2000-01-01 00:00+00:00')
+        self.assertEqual(response.context['cl'].result_count, 30)
+
+    def test_capped_count_is_marked_in_changelist(self):
+        with mock.patch('posts.paginators.ADMIN_COUNT_LIMIT', 25):
+            response = self.client.get(
+                reverse('admin:posts_group_changelist'))
+        self.assertEqual(response.context['cl'].result_count, 25)
+        self.assertContains(response, '25+')
+
+    def test_pub_date_filter_uses_index(self):
+        queryset = Post.objects.filter(
+            pub_date__gte='2000-01-01 00:00+00:00')[:100]
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertRegex(plan, r'USING (COVERING )?INDEX \w*pub_date')
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        cls.posts = [
+            Post.objects.create(author=cls.author, text=f'Пост {i}')
+            for i in range(5)
+        ]
+        Comment.objects.create(
+            post=cls.posts[0], author=cls.author, text='Комментарий')
+
+    def lines(self, data):
+        return [json.loads(line) for line in data.decode().splitlines()]
+
+    def test_export_walks_pk_ranges(self):
+        export = exporter.Export('posts', chunk_size=2)
+        with CaptureQueriesContext(connection) as queries:
+            records = [json.loads(line) for line in export]
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(
+            [record['id'] for record in records],
+            [post.pk for post in self.posts])
+        self.assertEqual(records[0]['author'], self.author.pk)
+        self.assertEqual(records[0]['text'], 'Пост 0')
+        self.assertEqual(export.last_id, self.posts[-1].pk)
+
+    def test_command_incremental_and_gzip(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        plain = os.path.join(directory, 'posts.ndjson')
+        packed = os.path.join(directory, 'posts.ndjson.gz')
+        err = StringIO()
+        call_command('export_yatube', 'posts', output=plain,
+                     after_id=self.posts[2].pk, chunk_size=1, stderr=err)
+        self.assertIn(f'последний id: {self.posts[-1].pk}', err.getvalue())
+        call_command('export_yatube', 'posts', output=packed, gzip=True,
+                     after_id=self.posts[2].pk, stderr=StringIO())
+        with open(plain, 'rb') as file:
+            data = file.read()
+        with gzip.open(packed) as file:
+            self.assertEqual(file.read(), data)
+        self.assertEqual(
+            [record['id'] for record in self.lines(data)],
+            [post.pk for post in self.posts[3:]])
+        call_command('export_yatube', 'comments', output=plain,
+                     since='2000-01-01', stderr=StringIO())
+        with open(plain, 'rb') as file:
+            comments = self.lines(file.read())
+        self.assertEqual(comments[0]['post'], self.posts[0].pk)
+        with self.assertRaisesMessage(CommandError, 'after_id'):
+            call_command('export_yatube', 'posts', output=plain,
+                         after_id=2 ** 63, stderr=StringIO())
+
+    def test_endpoint_is_staff_only_and_streams(self):
+        url = reverse('posts:export', args=['posts'])
+        self.assertEqual(self.client.get(url).status_code, HTTPStatus.FOUND)
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(url).status_code, HTTPStatus.FOUND)
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {'after_id': self.posts[0].pk})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        data = b''.join(response.streaming_content)
+        self.assertEqual(len(self.lines(data)), 4)
+        response = self.client.get(url, {'gzip': 1})
+        self.assertEqual(
+            len(self.lines(gzip.decompress(
+                b''.join(response.streaming_content)))), 5)
+        self.assertIn('posts.ndjson.gz', response['Content-Disposition'])
+        for params in ({'since': 'вчера'}, {'after_id': 'два'},
+                       {'after_id': 2 ** 63}, {'after_id': -1}):
+            with self.subTest(params=params):
+                self.assertEqual(
+                    self.client.get(url, params).status_code,
+                    HTTPStatus.BAD_REQUEST)
+        self.assertEqual(
+            self.client.get(
+                reverse('posts:export', args=['users'])).status_code,
+            HTTPStatus.NOT_FOUND)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Число запросов каждого маршрута posts не зависит от числа постов.
+
+    Кеш очищается перед каждым запросом: карточки постов рендерятся
+    заново и обращаются к автору и группе каждого поста.
+    """
+    # (маршрут, аргументы, метод, бюджет анонима, бюджет пользователя);
+    # None - маршрут только для вошедших.
+    ROUTES = (
+        ('posts:index', (), 'get', 1, 3),
+        ('posts:group_list', ('budget-a',), 'get', 2, 4),
+        ('posts:profile', ('writer0',), 'get', 2, 5),
+        ('posts:post_detail', ('post',), 'get', 2, 4),
+        ('posts:search', (), 'get', 1, 3),
+        ('posts:follow_index', (), 'get', None, 5),
+        ('posts:post_create', (), 'get', None, 3),
+        ('posts:post_create', (), 'post', None, 10),
+        ('posts:post_edit', ('post',), 'get', None, 4),
+        ('posts:post_edit', ('post',), 'post', None, 8),
+        ('posts:add_comment', ('post',), 'post', None, 5),
+        ('posts:export', ('posts',), 'get', None, 3),
+        ('posts:export', ('comments',), 'get', None, 3),
+        ('posts:profile_follow', ('writer1',), 'get', None, 4),
+        ('posts:profile_unfollow', ('writer1',), 'get', None, 9),
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(
+            username='reader', is_staff=True)
+        writers = [
+            User.objects.create_user(username=f'writer{i}')
+            for i in range(2)
+        ]
+        for writer in writers:
+            Follow.objects.create(user=cls.reader, author=writer)
+        groups = [
+            Group.objects.create(
+                title=f'Группа {i}', slug=f'budget-{"ab"[i]}',
+                description='Описание')
+            for i in range(2)
+        ]
+        for i in range(LIST_LENGHT + SECOND_PAGE_POST):
+            Post.objects.create(
+                author=writers[i % 2], group=groups[i // 2 % 2],
+                text=f'Пост про бюджет {i}')
+        cls.post = Post.objects.create(
+            author=cls.reader, group=groups[0], text='Свой пост')
+        for writer in writers:
+            Comment.objects.create(
+                post=cls.post, author=writer, text='Комментарий')
+
+    def setUp(self):
+        self.user_client = Client()
+        self.user_client.force_login(self.reader)
+
+    def request(self, client, name, args, method):
+        args = [self.post.pk if arg == 'post' else arg for arg in args]
+        address = reverse(name, args=args)
+        data = {'text': 'Бюджет'} if method == 'post' else None
+        if name == 'posts:search':
+            address += '?q=бюджет'
+        cache.clear()
+        response = getattr(client, method)(address, data)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def test_every_route_has_a_budget(self):
+        from posts.urls import urlpatterns
+        covered = {name.split(':')[1] for name, *_ in self.ROUTES}
+        self.assertEqual(
+            covered, {pattern.name for pattern in urlpatterns})
+
+    def test_routes_stay_within_budget(self):
+        for name, args, method, anonymous, user in self.ROUTES:
+            for client, budget in ((self.client, anonymous),
+                                   (self.user_client, user)):
+                if budget is None:
+                    continue
+                with self.subTest(name=name, method=method, budget=budget):
+                    with self.assertQueryBudget(budget):
+                        response = self.request(client, name, args, method)
+                    self.assertLess(response.status_code, 400)
+
+    def test_report_lists_repeated_query_shapes(self):
+        budget = QueryBudget(1)
+        with self.assertRaises(AssertionError) as raised:
+            with budget:
+                for post in Post.objects.all()[:3]:
+                    post.author.username
+        self.assertEqual(len(budget), 4)
+        self.assertIn('4 запросов при бюджете 1', str(raised.exception))
+        self.assertIn('3 x SELECT', str(raised.exception))
+        self.assertEqual(budget.duplicates()[0][1], 3)
+        self.assertEqual(
+            shape("SELECT 1 FROM t WHERE id IN (1, 2) AND s = 'a''b'"),
+            'SELECT ? FROM t WHERE id IN (...) AND s = ?')
+
+    @QueryBudget(1)
+    def test_budget_as_decorator(self):
+        Post.objects.count()
@@ -0,0 +1,226 @@
+"""Индекс метаданных миниатюр в файле, отображённом в память.
+
+Тег {% thumbnail %} на каждую картинку спрашивает хранилище ключей sorl
+о готовой миниатюре: в cached_db это кеш процесса, а после перезапуска -
+запрос к базе. Индекс - снимок записей sorl об изображениях (исходник
+или миниатюра -> имя, хранилище, размеры) в компактном файле. Файл
+открывается через mmap, поэтому его страницы в памяти общие для всех
+процессов, а поиск - двоичный по таблице хешей без обращений к базе.
+
+Формат: заголовок (MAGIC, число записей), таблица записей
+(хеш ключа, смещение, длина ключа, длина значения), отсортированная по
+хешу, затем ключи и значения подряд. Записи, которых нет в индексе,
+KVStore берёт из cached_db; rebuild() пересобирает файл из базы, а
+remove() стирает удалённые записи прямо в файле, не пересобирая его.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from django.conf import settings
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from posts import settings as posts_settings
+
+MAGIC = b'YTBTHMB1'
+HEADER = struct.Struct('<8sI')
+ENTRY = struct.Struct('<QIHI')
+# В индекс попадают только записи изображений: они не меняются, пока
+# не удалены. Списки миниатюр исходника дописываются и живут в базе.
+IMAGE_PREFIX = add_prefix('')
+
+
+def index_path():
+    return getattr(settings, 'THUMBNAIL_INDEX_PATH', None) or os.path.join(
+        settings.MEDIA_ROOT, 'cache', 'thumbnail.idx'
+    )
+
+
+def key_hash(key):
+    return int.from_bytes(
+        hashlib.blake2b(key, digest_size=8).digest(), 'little'
+    )
+
+
+def write(path, items):
+    """Записывает пары (ключ, значение) в индекс атомарной заменой файла.
+
+    Возвращает число записей.
+    """
+    entries = sorted(
+        (key_hash(key), key, value)
+        for key, value in (
+            (key.encode(), value.encode()) for key, value in items
+        )
+    )
+    offset = HEADER.size + ENTRY.size * len(entries)
+    table, data = [], []
+    for hashed, key, value in entries:
+        table.append(ENTRY.pack(hashed, offset, len(key), len(value)))
+        data.append(key + value)
+        offset += len(key) + len(value)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as temp:
+            temp.write(HEADER.pack(MAGIC, len(entries)))
+            temp.writelines(table)
+            temp.writelines(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return len(entries)
+
+
+def _entry(mapped, position):
+    return ENTRY.unpack_from(mapped, HEADER.size + ENTRY.size * position)
+
+
+def _find(mapped, count, raw_key):
+    """(смещение, длина ключа, длина значения) записи raw_key или None."""
+    hashed = key_hash(raw_key)
+    # Двоичный поиск прямо по таблице в mmap: память процесса не
+    # копирует индекс.
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if _entry(mapped, middle)[0] < hashed:
+            low = middle + 1
+        else:
+            high = middle
+    for position in range(low, count):
+        entry_hash, offset, key_length, value_length = _entry(
+            mapped, position
+        )
+        if entry_hash != hashed:
+            break
+        if mapped[offset:offset + key_length] == raw_key:
+            return offset, key_length, value_length
+    return None
+
+
+def remove(keys, path=None):
+    """Стирает записи keys в файле индекса, не пересобирая его.
+
+    Первый байт ключа записи заменяется нулевым, и запись больше ни с чем
+    не совпадает; процессы видят это сразу, ведь файл отображён в их
+    память общим. Место освобождает следующий rebuild(). Возвращает
+    число стёртых записей.
+    """
+    try:
+        index_file = open(path or index_path(), 'r+b')
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    with index_file:
+        if os.fstat(index_file.fileno()).st_size < HEADER.size:
+            return 0
+        with mmap.mmap(index_file.fileno(), 0) as mapped:
+            magic, count = HEADER.unpack_from(mapped)
+            if magic != MAGIC:
+                return 0
+            for key in keys:
+                found = _find(mapped, count, key.encode())
+                if found is not None:
+                    mapped[found[0]] = 0
+                    removed += 1
+            mapped.flush()
+    return removed
+
+
+def rebuild(path=None):
+    """Пересобирает индекс из записей sorl в базе."""
+    rows = KVStoreModel.objects.filter(
+        key__startswith=IMAGE_PREFIX
+    ).values_list('key', 'value')
+    count = write(path or index_path(), rows.iterator())
+    _index.reset()
+    return count
+
+
+class ThumbnailIndex:
+    """Читает индекс; файл переоткрывается, если его заменили."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._map = None
+        self._count = 0
+        self._stamp = None
+        self._checked = None
+
+    def _refresh(self):
+        now = time.monotonic()
+        interval = getattr(
+            settings, 'THUMBNAIL_INDEX_CHECK_INTERVAL',
+            posts_settings.THUMBNAIL_INDEX_CHECK_INTERVAL,
+        )
+        if self._checked is not None and now - self._checked < interval:
+            return
+        self._checked = now
+        path = index_path()
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._map, self._count, self._stamp = None, 0, None
+            return
+        stamp = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+        self._stamp = stamp
+        self._map, self._count = None, 0
+        if stat.st_size < HEADER.size:
+            return
+        with open(path, 'rb') as index_file:
+            mapped = mmap.mmap(
+                index_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        magic, count = HEADER.unpack_from(mapped)
+        if magic != MAGIC:
+            return
+        self._map, self._count = mapped, count
+
+    def get(self, key):
+        """Значение по ключу sorl или None."""
+        self._refresh()
+        if self._map is None:
+            return None
+        found = _find(self._map, self._count, key.encode())
+        if found is None:
+            return None
+        offset, key_length, value_length = found
+        start = offset + key_length
+        return self._map[start:start + value_length].decode()
+
+
+_index = ThumbnailIndex()
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """Хранилище sorl, которое сначала смотрит в индекс на диске."""
+
+    def _get_raw(self, key):
+        if key.startswith(IMAGE_PREFIX):
+            value = _index.get(key)
+            if value is not None:
+                return value
+        return super()._get_raw(key)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        # Удалённая запись не должна находиться в индексе.
+        indexed = [key for key in keys if key.startswith(IMAGE_PREFIX)]
+        if indexed:
+            remove(indexed)
+
+    def clear(self, delete_thumbnails=False):
+        super().clear(delete_thumbnails)
+        rebuild()
@@ -0,0 +1,279 @@
+"""Заранее построенные миниатюры картинок постов.
+
+Без этого sorl строит миниатюру при первом рендере шаблона, и первый
+посетитель страницы ждёт декодирования и масштабирования картинки.
+schedule() после сохранения поста отдаёт картинку пулу процессов,
+generate() заменяет слишком большой оригинал уменьшенным (у него своё
+имя по содержимому), строит все варианты из variants() и записывает их
+в хранилище ключей sorl, откуда их берут шаблоны. Декодирование
+больших картинок так не занимает память процессов, обслуживающих
+запросы.
+
+Вариант - ширина из POST_IMAGE_WIDTHS в JPEG или в современном формате
+(WebP, AVIF), если его поддерживает Pillow. picture() собирает из них
+<source>/srcset для тега {% post_picture %}.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import django
+from django.conf import settings
+from django.db import transaction
+from PIL import Image
+from sorl.thumbnail import default, delete, get_thumbnail
+from sorl.thumbnail.base import EXTENSIONS
+from sorl.thumbnail.images import ImageFile
+
+from posts import settings as posts_settings
+from posts.models import Post
+from posts.uploads import downsample_stored
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def workers():
+    return getattr(
+        settings, 'THUMBNAIL_WORKERS', posts_settings.THUMBNAIL_WORKERS
+    )
+
+
+def source(name):
+    """Исходник для sorl в том же хранилище, что и Post.image.
+
+    Ключи sorl включают хранилище, поэтому миниатюры, построенные здесь,
+    совпадают с теми, что запрашивают шаблоны через post.image.
+    """
+    return ImageFile(name, Post._meta.get_field('image').storage)
+
+
+def modern_formats():
+    """Форматы из POST_IMAGE_FORMATS, которые можно сохранить здесь."""
+    Image.init()
+    return tuple(
+        image_format for image_format in posts_settings.POST_IMAGE_FORMATS
+        if image_format in Image.SAVE and image_format in EXTENSIONS
+    )
+
+
+def geometry(width):
+    full_width, full_height = posts_settings.POST_IMAGE_SIZE
+    return f'{width}x{round(full_height * width / full_width)}'
+
+
+def variants():
+    """(формат или None для JPEG по умолчанию, ширина, geometry, опции).
+
+    JPEG полной ширины строится с теми же опциями, что и раньше, поэтому
+    уже построенные миниатюры остаются в силе.
+    """
+    for image_format in (None,) + modern_formats():
+        options = dict(posts_settings.POST_IMAGE_OPTIONS)
+        if image_format:
+            options['format'] = image_format
+        for width in posts_settings.POST_IMAGE_WIDTHS:
+            yield image_format, width, geometry(width), options
+
+
+def picture(image):
+    """Данные для <picture>: запасной <img> и <source> по форматам."""
+    if not image:
+        return None
+    renditions = {}
+    for image_format, width, size, options in variants():
+        renditions.setdefault(image_format, []).append(
+            (width, get_thumbnail(image, size, **options))
+        )
+
+    def srcset(items):
+        return ', '.join(f'{item.url} {width}w' for width, item in items)
+
+    fallback = renditions.pop(None)
+    # crop и upscale дают ровно заданный размер; у миниатюры отсутствующего
+    # файла размера нет, поэтому он берётся из настроек.
+    width, height = posts_settings.POST_IMAGE_SIZE
+    return {
+        'img': fallback[-1][1],
+        'width': width,
+        'height': height,
+        'srcset': srcset(fallback),
+        'sources': [
+            {'type': f'image/{image_format.lower()}', 'srcset': srcset(items)}
+            for image_format, items in renditions.items()
+        ],
+        'sizes': posts_settings.POST_IMAGE_SIZES,
+    }
+
+
+def make_pool(max_workers=None):
+    # Процессы запускаются заново, а не форкаются: унаследованные
+    # соединения с базой и открытые курсоры родителя им не нужны.
+    return ProcessPoolExecutor(
+        max_workers=max_workers or workers(),
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup,
+    )
+
+
+def generate(name):
+    """Уменьшает оригинал name и строит его миниатюры во всех размерах.
+
+    Возвращает (имя картинки, после уменьшения - новое, число
+    построенных миниатюр, текст ошибки или None).
+    """
+    built = 0
+    try:
+        image = source(name)
+        if not image.exists():
+            return name, 0, 'исходный файл не найден'
+        resized = downsample_stored(name)
+        if resized is not None:
+            replace_image(name, resized)
+            name, image = resized, source(resized)
+        for _, _, size, options in variants():
+            thumbnail = get_thumbnail(image, size, **options)
+            if not default.kvstore.get(thumbnail):
+                return name, built, f'миниатюра {size} не записана'
+            built += 1
+    except Exception as error:
+        logger.exception('Не удалось построить миниатюры %s', name)
+        return name, built, str(error)
+    return name, built, None
+
+
+def _report(name, future):
+    try:
+        name, _, error = future.result()
+    except BrokenProcessPool:
+        # Процесс пула умер, например, от нехватки памяти; пул
+        # пересоздаст следующий _submit.
+        error = 'пул процессов сломан'
+    if error:
+        logger.warning('Миниатюры %s не построены: %s', name, error)
+
+
+def _pool(broken=None):
+    """Пул процессов; сломанный пул broken заменяется новым."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor is broken:
+            broken.shutdown(wait=False)
+            _executor = None
+        if _executor is None:
+            _executor = make_pool()
+        return _executor
+
+
+def _submit(name):
+    """Отдаёт картинку пулу. Ошибка здесь не роняет запрос: миниатюры
+    тогда построит sorl при первом рендере."""
+    try:
+        if not workers():
+            generate(name)
+            return
+        pool = _pool()
+        try:
+            future = pool.submit(generate, name)
+        except BrokenProcessPool:
+            logger.warning('Пул миниатюр сломан, создаётся заново')
+            future = _pool(broken=pool).submit(generate, name)
+        future.add_done_callback(partial(_report, name))
+    except Exception:
+        logger.exception('Не удалось поставить миниатюры %s в очередь', name)
+
+
+def release(name):
+    """После коммита удаляет картинку name вместе с миниатюрами.
+
+    Картинка общая для постов с одинаковым содержимым (см. posts.storage),
+    поэтому удаляется, только когда на неё не ссылается ни один пост.
+    """
+    storage = Post._meta.get_field('image').storage
+    # Файлы со старыми именами учитывает и объединяет dedupe_media.
+    if not name or not storage.is_hashed(name):
+        return
+    transaction.on_commit(partial(_delete_unused, name))
+
+
+def _referenced(name):
+    return Post.objects.filter(image=name).exists()
+
+
+def _delete_unused(name):
+    """Удаляет картинку name, если на неё не ссылается ни один пост.
+
+    Файл сначала убирается из-под своего имени и только потом
+    проверяются ссылки: пост, закоммиченный после проверки, уже не
+    найдёт файла и запишет его заново (ContentAddressedStorage.restore).
+    """
+    path = Post._meta.get_field('image').storage.path(name)
+    removed = os.path.join(
+        os.path.dirname(path), f'.{os.path.basename(path)}.deleted'
+    )
+    try:
+        os.rename(path, removed)
+    except FileNotFoundError:
+        removed = None
+    except OSError:
+        logger.exception('Не удалось удалить картинку %s', name)
+        return
+    try:
+        if _referenced(name):
+            if removed is not None:
+                os.replace(removed, path)
+            return
+        delete(source(name), delete_file=False)
+    except OSError:
+        logger.exception('Не удалось удалить картинку %s', name)
+    finally:
+        if removed is not None and os.path.exists(removed):
+            os.remove(removed)
+
+
+def replace_image(old, new):
+    """Переводит посты с картинки old на new.
+
+    Посты сохраняются по одному, поэтому сигналы сбрасывают их карточки
+    и страницы, а old удаляется после коммита (release).
+    """
+    with transaction.atomic():
+        for post in Post.objects.filter(image=old).select_related('author'):
+            post.image = new
+            post.save(update_fields=['image'])
+
+
+def schedule(image):
+    """Ставит построение миниатюр в очередь после коммита транзакции."""
+    if not image:
+        return
+    name = image.name
+    transaction.on_commit(lambda: _submit(name))
+
+
+def savings(names):
+    """Суммарный вес вариантов картинок names в байтах.
+
+    Возвращает (вес исходников, {(формат, ширина): вес}), где формат
+    None - JPEG по умолчанию. Недостающие варианты строятся.
+    """
+    sources = 0
+    totals = {}
+    for name in names:
+        image = source(name)
+        if not image.exists():
+            continue
+        sources += image.storage.size(name)
+        for image_format, width, size, options in variants():
+            thumbnail = get_thumbnail(image, size, **options)
+            key = (image_format, width)
+            totals[key] = totals.get(key, 0) + default.storage.size(
+                thumbnail.name
+            )
+    return sources, totals
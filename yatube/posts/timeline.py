@@ -0,0 +1,246 @@
+"""Лента подписок: гибрид fan-out on write и fan-out on read.
+
+Для обычных авторов каждому читателю хранится список (user, post,
+pub_date) - пост раскладывается в ленты подписчиков при публикации,
+лента дозаполняется при подписке и чистится при отписке. Авторы, у
+которых подписчиков больше TIMELINE_PULL_THRESHOLD, в ленты не
+раскладываются: их последние посты подтягиваются при чтении и
+сливаются с материализованной лентой (k-way merge).
+
+Момент, с которого автор подтягивается, хранится в Profile.pulled_since.
+Когда автор опускается ниже порога, его посты с этого момента (и за
+PULLED_AUTHORS_TTL до него, пока множество было в кеше) раскладываются
+в ленты подписчиков, иначе они пропали бы из лент.
+"""
+import heapq
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from core import metrics
+from posts.models import Follow, Post, Profile, TimelineEntry
+from posts.paginators import KeysetPaginator, keyset_filter
+from posts.settings import (PULLED_AUTHORS_TTL, TIMELINE_BATCH_SIZE,
+                            TIMELINE_LENGTH, TIMELINE_PULL_THRESHOLD)
+
+PULLED_AUTHORS_KEY = 'timeline:pulled_authors'
+
+
+def pull_threshold():
+    return getattr(
+        settings, 'TIMELINE_PULL_THRESHOLD', TIMELINE_PULL_THRESHOLD
+    )
+
+
+def pulled_authors():
+    """id авторов, чьи посты подтягиваются при чтении, а не раскладываются.
+
+    Множество берётся из счётчика Profile.followers_count и кешируется
+    на PULLED_AUTHORS_TTL секунд.
+    """
+    authors = cache.get(PULLED_AUTHORS_KEY)
+    if authors is None:
+        threshold = pull_threshold()
+        authors = frozenset(
+            Profile.objects.filter(
+                followers_count__gt=threshold
+            ).values_list('user_id', flat=True)
+        )
+        sync_pulled(authors)
+        cache.set(PULLED_AUTHORS_KEY, authors, PULLED_AUTHORS_TTL)
+        metrics.set_gauge('timeline_pull_threshold', threshold)
+        metrics.set_gauge('timeline_pulled_authors', len(authors))
+    return authors
+
+
+def sync_pulled(authors):
+    """Отмечает в Profile.pulled_since новых подтягиваемых авторов и
+    возвращает в ленты посты тех, кто подтягиваться перестал."""
+    recorded = dict(
+        Profile.objects.filter(pulled_since__isnull=False).values_list(
+            'user_id', 'pulled_since'
+        )
+    )
+    joined = authors - recorded.keys()
+    if joined:
+        Profile.objects.filter(user_id__in=joined).update(
+            pulled_since=timezone.now()
+        )
+    for author_id in recorded.keys() - authors:
+        # Пока множество было в кеше, посты могли не раскладываться и
+        # до отметки.
+        since = recorded[author_id] - timedelta(seconds=PULLED_AUTHORS_TTL)
+        push_since(author_id, since)
+        Profile.objects.filter(user_id=author_id).update(pulled_since=None)
+        metrics.inc('timeline_authors_unpulled')
+
+
+def _write(entries):
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=TIMELINE_BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def push_post(post):
+    """Раскладывает новый пост в ленты подписчиков автора."""
+    if post.author_id in pulled_authors():
+        metrics.inc('timeline_posts_pulled')
+        return
+    metrics.inc('timeline_posts_pushed')
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    _write(
+        TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+        for user_id in followers.iterator()
+    )
+
+
+def push_since(author_id, since, length=TIMELINE_LENGTH):
+    """Раскладывает в ленты подписчиков посты автора начиная с since."""
+    posts = list(
+        Post.objects.filter(author_id=author_id, pub_date__gte=since)
+        .order_by('-pub_date').values_list('pk', 'pub_date')[:length]
+    )
+    if not posts:
+        return
+    followers = Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True)
+    followers = list(followers)
+    _write(
+        TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+        for user_id in followers
+        for pk, pub_date in posts
+    )
+    for user_id in followers:
+        trim(user_id, length)
+
+
+def backfill(user_id, author_id, length=TIMELINE_LENGTH):
+    """Добавляет в ленту читателя последние посты нового автора."""
+    if author_id in pulled_authors():
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date'
+    ).values_list('pk', 'pub_date')[:length]
+    _write(
+        TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+        for pk, pub_date in posts
+    )
+
+
+def purge(user_id, author_id):
+    """Убирает из ленты читателя посты автора, от которого он отписался."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def trim(user_id, length=TIMELINE_LENGTH):
+    """Обрезает ленту читателя до length последних записей."""
+    boundary = TimelineEntry.objects.filter(user_id=user_id).values_list(
+        'pub_date', 'post_id'
+    )[length:length + 1]
+    if not boundary:
+        return 0
+    pub_date, post_id = boundary[0]
+    deleted, _ = TimelineEntry.objects.filter(
+        user_id=user_id, pub_date__lte=pub_date
+    ).exclude(pub_date=pub_date, post_id__gt=post_id).delete()
+    return deleted
+
+
+def trim_all(length=TIMELINE_LENGTH):
+    """Обрезает все ленты длиннее length; возвращает их число.
+
+    push_post добавляет в ленты по записи и не обрезает их, чтобы
+    публикация не стоила запросов на каждого подписчика, поэтому это
+    запускается периодически (rebuild_timelines --trim-only).
+    """
+    users = TimelineEntry.objects.order_by().values('user_id').annotate(
+        entries=Count('id')
+    ).filter(entries__gt=length).values_list('user_id', flat=True)
+    trimmed = 0
+    for user_id in users.iterator():
+        trim(user_id, length)
+        trimmed += 1
+    return trimmed
+
+
+def rebuild(user_id, length=TIMELINE_LENGTH):
+    """Собирает ленту читателя заново из его подписок."""
+    TimelineEntry.objects.filter(user_id=user_id).delete()
+    authors = Follow.objects.filter(user_id=user_id).exclude(
+        author_id__in=pulled_authors()
+    ).values('author_id')
+    posts = Post.objects.filter(author_id__in=authors).order_by(
+        '-pub_date'
+    ).values_list('pk', 'pub_date')[:length]
+    _write(
+        TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+        for pk, pub_date in posts
+    )
+
+
+class FeedPaginator(KeysetPaginator):
+    """Курсорная пагинация ленты подписок.
+
+    object_list - посты всех авторов, на которых подписан user; он
+    нужен только для ?page=N. Курсорные страницы собираются из
+    материализованной ленты и списков подтягиваемых авторов.
+    """
+
+    def __init__(self, object_list, per_page, after=None, before=None,
+                 user=None):
+        super().__init__(object_list, per_page, after, before)
+        self.user = user
+
+    def fetch(self, cursor, newer, limit):
+        started = time.perf_counter()
+        # Раньше чтения ленты: при пересчёте множества в неё могут
+        # вернуться посты авторов, которые перестали подтягиваться.
+        authors = pulled_authors()
+        entries = keyset_filter(
+            self.user.timeline.select_related(
+                'post__author__profile', 'post__group'
+            ),
+            cursor,
+            newer,
+            keys=('pub_date', 'post_id'),
+        )[:limit]
+        sources = [[entry.post for entry in entries]]
+        pulled = Follow.objects.filter(
+            user=self.user, author_id__in=authors
+        ).values_list('author_id', flat=True)
+        for author_id in pulled:
+            posts = Post.objects.filter(
+                author_id=author_id
+            ).select_related('author__profile', 'group')
+            sources.append(list(keyset_filter(posts, cursor, newer)[:limit]))
+        rows = []
+        seen = set()
+        merged = heapq.merge(
+            *sources,
+            key=lambda post: (post.pub_date, post.pk),
+            reverse=not newer,
+        )
+        for post in merged:
+            if post.pk in seen:
+                continue
+            seen.add(post.pk)
+            rows.append(post)
+            if len(rows) == limit:
+                break
+        metrics.observe('timeline_merge_sources', len(sources))
+        metrics.observe(
+            'timeline_merge_rows', sum(len(source) for source in sources)
+        )
+        metrics.observe(
+            'timeline_merge_seconds', time.perf_counter() - started
+        )
+        return rows
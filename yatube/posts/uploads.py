@@ -0,0 +1,226 @@
+"""Потоковая загрузка картинок постов.
+
+Обработчик пишет картинку кусками сразу во временный файл в
+MEDIA_ROOT/posts/, поэтому сохранение поста - это переименование файла,
+а не копирование, и в памяти процесса не бывает целой картинки. Размер
+в байтах проверяется по мере поступления данных, а размер в пикселях -
+по заголовку, как только он пришёл. Запрос картинку не декодирует:
+слишком большие по стороне картинки уменьшает downsample_stored() в
+фоновом построении миниатюр (posts.thumbnails) и сохраняет под новым
+именем. Отклонённая загрузка
+доходит до формы как RejectedUpload, и PostForm показывает причину
+рядом с полем.
+"""
+import os
+import posixpath
+import tempfile
+from functools import wraps
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import (TemporaryUploadedFile,
+                                            UploadedFile)
+from django.core.files.uploadhandler import (FileUploadHandler,
+                                             StopFutureHandlers,
+                                             TemporaryFileUploadHandler)
+from django.template.defaultfilters import filesizeformat
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image
+
+from posts import settings as posts_settings
+from posts.models import Post
+
+# Сколько первых байт файла держать в памяти, чтобы прочитать заголовок.
+HEADER_PROBE_SIZE = 256 * 1024
+
+
+def _setting(name):
+    return getattr(settings, name, getattr(posts_settings, name))
+
+
+def upload_dir():
+    return os.path.join(
+        settings.MEDIA_ROOT, Post._meta.get_field('image').upload_to
+    )
+
+
+class MediaUploadedFile(TemporaryUploadedFile):
+    """Временный файл рядом с местом хранения картинок постов."""
+
+    def __init__(self, name, content_type, size, charset,
+                 content_type_extra=None):
+        _, ext = os.path.splitext(name)
+        os.makedirs(upload_dir(), exist_ok=True)
+        file = tempfile.NamedTemporaryFile(
+            prefix='.', suffix='.upload' + ext, dir=upload_dir()
+        )
+        UploadedFile.__init__(
+            self, file, name, content_type, size, charset, content_type_extra
+        )
+
+
+class RejectedUpload(UploadedFile):
+    """Пустая замена файла, не прошедшего ограничения при загрузке."""
+
+    def __init__(self, name, error):
+        super().__init__(BytesIO(), name, size=0)
+        self.upload_error = error
+
+
+def read_dimensions(header):
+    """Размер картинки по началу файла или None, если его ещё не видно."""
+    try:
+        with Image.open(BytesIO(header)) as image:
+            return image.size
+    except Image.DecompressionBombError:
+        raise
+    except Exception:
+        return None
+
+
+def downsample(source, target, max_side):
+    """Пишет в target картинку из source, уменьшенную до max_side.
+
+    JPEG декодируется сразу в уменьшенном масштабе (draft), остальные
+    форматы сначала сжимаются в целое число раз (reduce). Анимация
+    не трогается. Возвращает False, если уменьшать не нужно.
+    """
+    with Image.open(source) as image:
+        if (max(image.size) <= max_side
+                or getattr(image, 'n_frames', 1) > 1):
+            return False
+        image_format = image.format
+        image.draft(None, (max_side, max_side))
+        factor = max(image.size) // max_side
+        if factor > 1:
+            image = image.reduce(factor)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        image.save(target, format=image_format)
+    return True
+
+
+def downsample_stored(name):
+    """Уменьшает сохранённую картинку поста name до POST_IMAGE_MAX_SIDE.
+
+    Уменьшенная картинка сохраняется через хранилище отдельным файлом:
+    имя по содержимому у неё своё (см. posts.storage), а исходный файл
+    не меняется. Возвращает новое имя или None, если уменьшать не нужно.
+    """
+    field = Post._meta.get_field('image')
+    with tempfile.TemporaryFile(dir=upload_dir()) as target:
+        with field.storage.open(name) as source:
+            if not downsample(
+                    source, target, _setting('POST_IMAGE_MAX_SIDE')):
+                return None
+        target.seek(0)
+        return field.storage.save(
+            posixpath.join(field.upload_to, posixpath.basename(name)),
+            File(target),
+        )
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """Принимает поле image формы поста, остальные файлы пропускает."""
+
+    field_name = 'image'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.active = False
+
+    def new_file(self, field_name, file_name, content_type, content_length,
+                 charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type,
+                         content_length, charset, content_type_extra)
+        self.active = field_name == self.field_name
+        if not self.active:
+            return
+        self.received = 0
+        self.header = b''
+        self.error = None
+        self.file = MediaUploadedFile(
+            file_name, content_type, 0, charset, content_type_extra
+        )
+        limit = _setting('POST_IMAGE_MAX_BYTES')
+        if content_length and content_length > limit:
+            self.reject_size()
+        raise StopFutureHandlers()
+
+    def reject(self, error):
+        self.error = error
+        self.file.close()
+
+    def reject_size(self):
+        self.reject(
+            'Файл больше {}.'.format(
+                filesizeformat(_setting('POST_IMAGE_MAX_BYTES'))
+            )
+        )
+
+    def check_header(self, raw_data):
+        self.header += raw_data
+        try:
+            dimensions = read_dimensions(self.header)
+        except Image.DecompressionBombError:
+            dimensions = (_setting('POST_IMAGE_MAX_PIXELS') + 1, 1)
+        if dimensions is None:
+            if len(self.header) >= HEADER_PROBE_SIZE:
+                # Заголовок не разобран - решит проверка картинки в форме.
+                self.header = None
+            return
+        self.header = None
+        width, height = dimensions
+        if width * height > _setting('POST_IMAGE_MAX_PIXELS'):
+            self.reject(
+                'Картинка больше {} мегапикселей.'.format(
+                    _setting('POST_IMAGE_MAX_PIXELS') // 10 ** 6
+                )
+            )
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if self.error:
+            # Остаток отклонённого файла читается и выбрасывается.
+            return None
+        self.received += len(raw_data)
+        if self.received > _setting('POST_IMAGE_MAX_BYTES'):
+            self.reject_size()
+            return None
+        if self.header is not None:
+            self.check_header(raw_data)
+            if self.error:
+                return None
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        if self.error:
+            return RejectedUpload(self.file_name, self.error)
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+
+def stream_image_uploads(view):
+    """Подключает ImageUploadHandler к view до разбора тела запроса.
+
+    Обработчики нужно заменить раньше, чем CsrfViewMiddleware прочитает
+    request.POST, поэтому CSRF проверяется здесь, после замены.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if _setting('POST_IMAGE_STREAMING_UPLOADS'):
+            request.upload_handlers = [
+                ImageUploadHandler(request),
+                TemporaryFileUploadHandler(request),
+            ]
+        return protected(request, *args, **kwargs)
+    return wrapper
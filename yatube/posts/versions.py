@@ -0,0 +1,53 @@
+"""Версии объектов в кеше для инвалидации производных данных.
+
+Ключ производных данных (карточки, страницы) включает версии всего,
+от чего они зависят. Изменение объекта меняет его версию, после чего
+старые записи перестают читаться и просто вытесняются кешем.
+
+Версию, изменённую одним процессом, должны видеть все остальные, поэтому
+кеш должен быть общим (memcached, redis). С кешем в памяти процесса
+(LocMemCache) кеши по версиям работают, только если процесс один
+(settings.CACHE_SINGLE_PROCESS), иначе отключаются - см. enabled().
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+
+# Бэкенды, у которых в каждом процессе свой кеш.
+PROCESS_LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def enabled():
+    """Можно ли кешировать по версиям: их изменения видят все процессы."""
+    backend = settings.CACHES[DEFAULT_CACHE_ALIAS]['BACKEND']
+    return (backend not in PROCESS_LOCAL_BACKENDS
+            or getattr(settings, 'CACHE_SINGLE_PROCESS', False))
+
+
+def version_key(kind, pk):
+    return f'version:{kind}:{pk}'
+
+
+def _stamp():
+    # Свежая версия не совпадает с версиями, вытесненными из кеша.
+    return int(time.time() * 1000000)
+
+
+def bump(kind, pk):
+    """Меняет версию объекта, делая зависящие от него записи устаревшими."""
+    key = version_key(kind, pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _stamp(), None)
+
+
+def get_many(keys):
+    """Версии по ключам version_key одним запросом к кешу."""
+    versions = cache.get_many(keys)
+    missing = {key: _stamp() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
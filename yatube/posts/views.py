@@ -1,31 +1,39 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from posts.settings import LIST_LENGHT
+from .counters import index_count
 from .forms import PostForm, CommentForm
 from .models import Post, Group, User, Follow
-from django.core.paginator import Paginator
+from .paginators import paginate
+from .search import SearchPaginator, find
+from .timeline import FeedPaginator
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
 from django.urls import reverse
-# from django.views.decorators.cache import cache_page
+from .page_cache import (cache_anonymous_page, post_author_scope,
+                         remember_post_author)
+from . import exporter, thumbnails
+from .importer import parse_date
+from .uploads import stream_image_uploads
+from .settings import COMMENTS_PER_PAGE, LIST_LENGHT
+from django.utils.http import urlencode
 
 
-# @cache_page(20, key_prefix='index_page')
+@cache_anonymous_page('index')
 def index(request):
     template = 'posts/index.html'
     post_list = Post.objects.select_related('author', 'group')
-    paginator = Paginator(post_list, LIST_LENGHT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, post_list, count=index_count)
     context = {'page_obj': page_obj}
     return render(request, template, context)
 
 
+@cache_anonymous_page('group:{slug}')
 def group_posts(request, slug):
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    paginator = Paginator(posts, LIST_LENGHT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    posts = group.posts.select_related('author')
+    page_obj = paginate(request, posts, count=group.posts_count)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -33,18 +41,20 @@ def group_posts(request, slug):
     return render(request, template, context)
 
 
+@cache_anonymous_page('author:{username}')
 def profile(request, username):
     template = 'posts/profile.html'
-    author = get_object_or_404(User, username=username)
-    author_posts = author.posts.all()
-    post_count = author_posts.count()
-    following = author.following.all()
-    follower = author.follower.all()
-    count_follower = follower.count()
-    count_following = following.count()
-    paginator = Paginator(author_posts, LIST_LENGHT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    author = get_object_or_404(
+        User.objects.select_related('profile'), username=username
+    )
+    author_posts = author.posts.select_related('group')
+    post_count = author.profile.posts_count
+    count_follower = author.profile.following_count
+    count_following = author.profile.followers_count
+    following = request.user.is_authenticated and Follow.objects.filter(
+        user=request.user, author=author
+    ).exists()
+    page_obj = paginate(request, author_posts, count=post_count)
     context = {
         'author': author,
         'post_count': post_count,
@@ -57,30 +67,71 @@ def profile(request, username):
     return render(request, template, context)
 
 
-def post_detail(request, post_id):
-    template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, pk=post_id)
-    username = get_object_or_404(User, id=post.author_id)
-    posts_count = Post.objects.filter(author__exact=post.author).count()
-    form = CommentForm()
+def search(request):
+    template = 'posts/search.html'
+    query = request.GET.get('q', '').strip()
+    posts = find(query, Post.objects.select_related('author', 'group'))
+    page_obj = SearchPaginator(
+        posts,
+        LIST_LENGHT,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    ).get_page()
     context = {
+        'query': query,
+        'page_obj': page_obj,
+        'search_query': urlencode({'q': query}),
+    }
+    return render(request, template, context)
+
+
+def _get_post_for_detail(post_id):
+    return get_object_or_404(
+        Post.objects.select_related('author__profile', 'group'),
+        pk=post_id,
+        author__isnull=False,
+    )
+
+
+def _post_detail_context(request, post, form):
+    comments = paginate(
+        request,
+        post.comments.select_related('author'),
+        per_page=COMMENTS_PER_PAGE,
+        count=post.comments_count,
+        keys=('created', 'pk'),
+    )
+    return {
         'post': post,
-        'username': username,
-        'post_count': posts_count,
+        'username': post.author,
+        'post_count': post.author.profile.posts_count,
         'title': f'Пост {post.text[:30]}',
-        'form': form
+        'form': form,
+        'comments': comments,
     }
+
+
+@cache_anonymous_page('post:{post_id}', post_author_scope)
+def post_detail(request, post_id):
+    template = 'posts/post_detail.html'
+    post = _get_post_for_detail(post_id)
+    remember_post_author(post)
+    context = _post_detail_context(request, post, CommentForm())
     return render(request, template, context)
 
 
 @login_required
+@stream_image_uploads
 def post_create(request):
     form = PostForm(request.POST, files=request.FILES or None)
     template = 'posts/create_post.html'
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
+        # Проверка картинки после коммита (posts.storage).
+        with transaction.atomic():
+            post.save()
+        thumbnails.schedule(post.image)
         return redirect('posts:profile', username=request.user.username)
     form = PostForm(request.POST, files=request.FILES or None)
     context = {
@@ -90,18 +141,22 @@ def post_create(request):
 
 
 @login_required
+@stream_image_uploads
 def post_edit(request, post_id):
     is_edit = True
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.select_related('author'), id=post_id)
     form = PostForm(
         request.POST or None,
         files=request.FILES or None,
         instance=post)
     template = "posts/create_post.html"
-    if post.author != request.user:
+    if post.author_id != request.user.pk:
         return redirect('posts:post_detail', post_id=post.id)
     if form.is_valid():
-        post = form.save()
+        with transaction.atomic():
+            post = form.save()
+        if 'image' in form.changed_data:
+            thumbnails.schedule(post.image)
         return redirect('posts:post_detail', post_id=post.id)
     context = {'form': form, 'post': post, 'is_edit': is_edit}
     return render(request, template, context)
@@ -109,8 +164,7 @@ def post_edit(request, post_id):
 
 @login_required
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    comments = post.comments.select_related('post')
+    post = _get_post_for_detail(post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -118,10 +172,7 @@ def add_comment(request, post_id):
         comment.post = post
         comment.save()
         return redirect('posts:post_detail', post_id=post_id)
-    context = {
-        'form': form,
-        'comments': comments
-    }
+    context = _post_detail_context(request, post, form)
     template = 'posts/post_detail.html'
     return render(request, template, context)
 
@@ -132,19 +183,19 @@ def server_error(request):
 
 @login_required
 def follow_index(request):
-    user = request.user
-    authors = user.follower.values_list('author', flat=True)
     posts_list = Post.objects.filter(
-        author__id__in=authors).select_related('author')
-    paginator = Paginator(posts_list, LIST_LENGHT)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+        author__following__user=request.user
+    ).select_related('author__profile', 'group')
+    page = paginate(
+        request, posts_list, paginator_class=FeedPaginator,
+        user=request.user
+    )
 
     return render(
         request,
         'posts/follow.html',
         {
-            'page_obj': page, 'paginator': paginator
+            'page_obj': page, 'paginator': page.paginator
         }
     )
 
@@ -168,3 +219,26 @@ def profile_unfollow(request, username):
     ).delete()
     return redirect(
         reverse('posts:profile', args=[username]))
+
+
+@staff_member_required
+def export(request, entity):
+    if entity not in exporter.ENTITIES:
+        raise Http404
+    try:
+        since = request.GET.get('since')
+        since = parse_date(since) if since else None
+        after_id = int(request.GET.get('after_id') or 0)
+        export = exporter.Export(entity, since=since, after_id=after_id)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    chunks = exporter.encode(export)
+    filename = f'{entity}.ndjson'
+    content_type = 'application/x-ndjson'
+    if request.GET.get('gzip'):
+        chunks = exporter.gzipped(chunks)
+        filename += '.gz'
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
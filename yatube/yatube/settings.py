@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,21 +63,41 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'yatube.urls'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Кто отдаёт media (core.media): None - Django через FileResponse,
+# 'x-sendfile' - Apache/lighttpd, 'x-accel-redirect' - nginx с internal
+# location MEDIA_ACCEL_REDIRECT_PREFIX, смотрящим в MEDIA_ROOT.
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+# Cache-Control для media, секунды: обычные файлы и файлы, имя которых
+# меняется вместе с содержимым (миниатюры, картинки постов).
+MEDIA_MAX_AGE = 60 * 60
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 #  подключаем движок filebased.EmailBackend
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
+# Кеш страниц и карточек постов сбрасывается по версиям (posts.versions),
+# и версию, изменённую одним воркером, должны видеть все остальные: в
+# продакшене с несколькими процессами нужен общий кеш, например,
+# django.core.cache.backends.memcached.MemcachedCache с LOCATION
+# '127.0.0.1:11211' (python-memcached) или redis. У LocMemCache кеш свой в
+# каждом процессе, поэтому с ним кеши по версиям включаются, только если
+# процесс один (CACHE_SINGLE_PROCESS: runserver, тесты), иначе
+# отключаются с предупреждением posts.W001.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
+CACHE_SINGLE_PROCESS = DEBUG
+# Записи sorl-thumbnail об изображениях читаются из индекса на диске.
+THUMBNAIL_KVSTORE = 'posts.thumbnail_index.KVStore'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.instrumentation.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -149,3 +170,26 @@ LOGIN_REDIRECT_URL = 'posts:index'
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+# Сюда collectstatic собирает файлы с отпечатками и их сжатые копии
+# (core.static); отдаёт их веб-сервер или core.static.serve.
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+STATICFILES_STORAGE = 'core.static.CompressedManifestStaticFilesStorage'
+# Файла нет в манифесте collectstatic: True - ошибка (ValueError), как в
+# ManifestStaticFilesStorage; False - ссылка на файл без отпечатка.
+STATIC_MANIFEST_STRICT = not DEBUG
+# Cache-Control для статики, секунды: файлы без отпечатка в имени и с ним.
+STATIC_MAX_AGE = 60 * 10
+STATIC_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+# Метрики запросов (core.instrumentation) отдаются в /metrics. Несколько
+# процессов-воркеров складывают свои метрики в файлы METRICS_DIR (общий
+# каталог, очищаемый при перезапуске сервиса); None - только метрики
+# процесса, обработавшего запрос к /metrics.
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 1.0
+# /metrics читают сотрудники (is_staff) и запросы с заголовком
+# Authorization: Bearer <METRICS_TOKEN>; None - только сотрудники.
+# Адрес клиента не проверяется: за nginx все запросы идут с 127.0.0.1.
+METRICS_TOKEN = None
+# Заголовок Server-Timing с временем ответа, базы и шаблонов.
+SERVER_TIMING = True
@@ -13,12 +13,16 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from django.conf.urls import handler404, handler500
 
+from core import media, static
+from core.views import metrics_endpoint
+
 handler404 = 'core.views.page_not_found'
 handler500 = 'core.views.server_error'
 handler403 = 'core.views.permission_denied'
@@ -29,9 +33,18 @@ urlpatterns = [
     path('auth/', include('django.contrib.auth.urls')),
     path('', include('posts.urls', namespace='index')),
     path('about/', include('about.urls', namespace='about')),
+    path('metrics', metrics_endpoint, name='metrics'),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(
-        settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
-    )
+urlpatterns += [
+    re_path(
+        r'^{}(?P<path>.+)$'.format(re.escape(settings.MEDIA_URL.lstrip('/'))),
+        media.serve,
+        name='media',
+    ),
+    re_path(
+        r'^{}(?P<path>.+)$'.format(re.escape(settings.STATIC_URL.lstrip('/'))),
+        static.serve,
+        name='static',
+    ),
+]